@@ -0,0 +1,67 @@
+"""
+Compare the per-call overhead of the compiled custom detector adapters against the wrapper they replaced, which
+introspected the function's signature and picked one of four call shapes on every call.
+
+The detectors are the cheap examples of custom_detectors.py, where the overhead is most of the cost of a call.
+
+    PYTHONPATH=detectors/built_in:. python benchmarks/bench_custom_calls.py
+"""
+import inspect
+import logging
+import timeit
+
+from custom_detectors_wrapper import build_custom_detection, compile_custom_adapter, inspect_custom_function
+
+CALLS = 200_000
+
+
+def legacy_custom_func_wrapper(func, func_name, s, headers, func_kwargs=None):
+    sig = inspect.signature(func)
+    try:
+        if headers is not None:
+            if func_kwargs is None:
+                result = func(s, headers=headers)
+            else:
+                result = func(s, headers=headers, **func_kwargs)
+        else:
+            if func_kwargs is None:
+                result = func(s)
+            else:
+                result = func(s, **func_kwargs)
+    except Exception as e:
+        logging.error(f"Error when computing custom detector function {func_name}: {e}")
+        raise e
+    return build_custom_detection(result, func_name, s)
+
+
+def over_100_characters(text: str) -> bool:
+    return len(text) > 100
+
+
+def function_that_needs_headers(text: str, headers: dict) -> bool:
+    return headers["magic-key"] != "123"
+
+
+def function_that_needs_kwargs(text: str, **kwargs: dict) -> bool:
+    return kwargs["magic-key"] != "123"
+
+
+CASES = [
+    ("over_100_characters", over_100_characters, None, None),
+    ("function_that_needs_headers", function_that_needs_headers, {"magic-key": "123"}, None),
+    ("function_that_needs_kwargs", function_that_needs_kwargs, None, {"magic-key": "123"}),
+]
+
+
+def main():
+    text = "a short, harmless message"
+    print(f"{'detector':<30} {'legacy (ns/call)':>18} {'adapter (ns/call)':>18}")
+    for name, func, headers, func_kwargs in CASES:
+        adapter = compile_custom_adapter(func, name, inspect_custom_function(func), func_kwargs)
+        legacy = min(timeit.repeat(lambda: legacy_custom_func_wrapper(func, name, text, headers, func_kwargs), number=CALLS, repeat=3))
+        compiled = min(timeit.repeat(lambda: adapter(text, headers), number=CALLS, repeat=3))
+        print(f"{name:<30} {legacy / CALLS * 1e9:>18.0f} {compiled / CALLS * 1e9:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
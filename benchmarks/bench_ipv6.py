@@ -0,0 +1,54 @@
+"""
+Compare the ipv6 detector scanner against the regex it replaced, on inputs of doubling size.
+
+The scanner's time per character stays flat as the inputs grow, while the regex's grows with the input size.
+
+    PYTHONPATH=detectors/built_in:. python benchmarks/bench_ipv6.py
+"""
+import re
+import time
+
+from regex_detectors import ipv6_detector
+
+LEGACY_IPV6_PATTERN = re.compile(
+    r"\s*(?!.*::.*::)(?:(?!:)|:(?=:))(?:[0-9a-f]{0,4}(?:(?<=::)|(?<!::):)){6}(?:[0-9a-f]{0,4}(?:(?<=::)|(?<!::):)[0-9a-f]{0,4}(?:(?<=::)|(?<!:)|(?<=:)(?<!::):)|(?:25[0-4]|2[0-4]\d|1\d\d|[1-9]?\d)(?:\.(?:25[0-4]|2[0-4]\d|1\d\d|[1-9]?\d)){3})\s*",
+    re.VERBOSE | re.IGNORECASE | re.DOTALL,
+)
+
+ADVERSARIAL_INPUTS = {
+    "log lines": lambda n: ("2024-01-01T12:30:45 client fe80::1 sent 0xdeadbeef\n" * n)[:n],
+    "colon runs": lambda n: ":" * n,
+    "hex runs": lambda n: ("deadbeef" * n)[:n] + "::",
+    "colon/hex pairs": lambda n: ("a:" * n)[:n],
+    "whitespace": lambda n: " " * n + "::1",
+}
+SIZES = [1_000, 2_000, 4_000, 8_000, 16_000]
+LEGACY_TIME_LIMIT = 5.0  # seconds, the regex is not run on larger inputs once one run exceeds this
+
+
+def time_call(func, string: str, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(string)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'input':<16} {'size':>8} {'scanner (ms)':>14} {'regex (ms)':>14}")
+    for name, make_input in ADVERSARIAL_INPUTS.items():
+        run_legacy = True
+        for size in SIZES:
+            string = make_input(size)
+            scanner_time = time_call(ipv6_detector, string)
+            legacy = "skipped"
+            if run_legacy:
+                legacy_time = time_call(lambda s: list(LEGACY_IPV6_PATTERN.finditer(s)), string, repeat=1)
+                legacy = f"{legacy_time * 1000:.2f}"
+                run_legacy = legacy_time < LEGACY_TIME_LIMIT
+            print(f"{name:<16} {size:>8} {scanner_time * 1000:>14.2f} {legacy:>14}")
+
+
+if __name__ == "__main__":
+    main()
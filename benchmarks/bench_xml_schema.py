@@ -0,0 +1,54 @@
+"""
+Compare validating XML against a known XSD through the compiled schema cache against what it replaced, which compiled
+the XSD on every call and let xmlschema parse the document a second time after the syntax check.
+
+    PYTHONPATH=detectors/built_in:. python benchmarks/bench_xml_schema.py
+"""
+import timeit
+import xml.etree.ElementTree as ET
+
+import xmlschema
+
+from file_type_detectors import is_valid_xml_schema
+
+XSD = """<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:orders" xmlns="urn:orders" elementFormDefault="qualified">
+  <xs:simpleType name="sku"><xs:restriction base="xs:string"><xs:pattern value="[A-Z]{3}-[0-9]{4}"/></xs:restriction></xs:simpleType>
+  <xs:complexType name="line">
+    <xs:sequence>
+      <xs:element name="sku" type="sku"/>
+      <xs:element name="quantity" type="xs:positiveInteger"/>
+      <xs:element name="price" type="xs:decimal"/>
+    </xs:sequence>
+  </xs:complexType>
+  <xs:element name="order">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="customer" type="xs:string"/>
+        <xs:element name="line" type="line" maxOccurs="unbounded"/>
+      </xs:sequence>
+      <xs:attribute name="id" type="xs:ID" use="required"/>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+LINE = "<line><sku>ABC-1234</sku><quantity>2</quantity><price>9.99</price></line>"
+NUMBER, REPEAT = 20, 3
+
+
+def legacy_is_valid_xml_schema(s: str, schema: str):
+    ET.fromstring(s)
+    xmlschema.XMLSchema(schema).validate(s)
+
+
+def main():
+    print(f"{'lines':>6} {'cached (ms)':>12} {'legacy (ms)':>12}")
+    for lines in [1, 10, 100]:
+        order = f'<order xmlns="urn:orders" id="o1"><customer>ACME</customer>{LINE * lines}</order>'
+        cached = min(timeit.repeat(lambda: is_valid_xml_schema(order, XSD), number=NUMBER, repeat=REPEAT)) / NUMBER
+        legacy = min(timeit.repeat(lambda: legacy_is_valid_xml_schema(order, XSD), number=NUMBER, repeat=REPEAT)) / NUMBER
+        print(f"{lines:>6} {cached * 1000:>12.2f} {legacy * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,172 @@
+import asyncio
+import contextlib
 import json
 import logging
 
 from fastapi import HTTPException, Request
 from contextlib import asynccontextmanager
 from base_detector_registry import BaseDetectorRegistry
+from detection_record import serialize_detection
+from detector_executor import DetectorExecutor
 from regex_detectors import RegexDetectorRegistry
-from custom_detectors_wrapper import CustomDetectorRegistry
+from custom_detectors_wrapper import CustomDetectorRegistry, async_detectors
+from custom_detectors_reloader import CustomDetectorReloader
 from file_type_detectors import FileTypeDetectorRegistry
+from keyword_detectors import KeywordDetectorRegistry
+from result_cache import ResultCache
 
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, multiprocess
-from starlette.responses import Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, multiprocess
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
 from detectors.common.scheme import ContentAnalysisHttpRequest,  ContentsAnalysisResponse
-from detectors.common.app import DetectorBaseAPI as FastAPI
+from detectors.common.app import DetectorBaseAPI as FastAPI, METRIC_PREFIX
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # the async custom detectors, awaited by the requests on the server's loop, and the coroutines handed over by
+    # threads, e.g. async @on_startup functions, share that loop
+    async_detectors.attach(asyncio.get_running_loop())
     for detector_registry in [
         RegexDetectorRegistry(),
         FileTypeDetectorRegistry(),
+        KeywordDetectorRegistry(),
         CustomDetectorRegistry()
     ]:
         app.set_detector(detector_registry, detector_registry.registry_name)
         detector_registry.set_instruments(app.state.instruments)
+    # build the resources of the registries, e.g. those of the custom detectors' @on_startup functions, before taking
+    # traffic. They run in a thread, so that their coroutines can be awaited on the loop
+    for detector_registry in app.get_all_detectors().values():
+        await run_in_threadpool(detector_registry.start)
+    app.state.ready = True
+    app.state.custom_detectors_reloader.record_generation(app.get_detector("custom"))
+    app.state.custom_detectors_reloader.start_watching()
     yield
+    app.state.ready = False
+    await run_in_threadpool(app.state.custom_detectors_reloader.stop_watching)
+    await run_in_threadpool(app.state.detector_executor.shutdown)
+    for detector_registry in app.get_all_detectors().values():
+        await run_in_threadpool(detector_registry.close)
+    async_detectors.stop()
     app.cleanup_detector()
 
 
 app = FastAPI(lifespan=lifespan)
+app.state.instruments.update({
+    "cache_hits": Counter(
+        f"{METRIC_PREFIX}_cache_hits",
+        "Number of cache hits per built-in cache",
+        ["cache_name"]
+    ),
+    "cache_misses": Counter(
+        f"{METRIC_PREFIX}_cache_misses",
+        "Number of cache misses per built-in cache",
+        ["cache_name"]
+    ),
+    "cache_evictions": Counter(
+        f"{METRIC_PREFIX}_cache_evictions",
+        "Number of entries evicted per built-in cache",
+        ["cache_name"]
+    ),
+    "cache_hit_ratio": Gauge(
+        f"{METRIC_PREFIX}_cache_hit_ratio",
+        "Ratio of cache lookups that were hits, per built-in cache and server process",
+        ["cache_name"],
+        multiprocess_mode="liveall"
+    ),
+    "prefilter_skips": Counter(
+        f"{METRIC_PREFIX}_prefilter_skips",
+        "Number of detector runs skipped because a cheap prefilter showed that the detector cannot match",
+        ["detector_kind", "detector_name"]
+    ),
+    "schema_compile_time": Counter(
+        f"{METRIC_PREFIX}_schema_compile_time",
+        "Total time spent compiling schemas into validators, in seconds, per schema cache",
+        ["cache_name"]
+    ),
+    "regex_timeouts": Counter(
+        f"{METRIC_PREFIX}_regex_timeouts",
+        "Number of custom regexes stopped for exceeding their execution budget",
+        ["detector_kind", "detector_name"]
+    ),
+    "background_queue_depth": Gauge(
+        f"{METRIC_PREFIX}_background_queue_depth",
+        "Number of background tasks waiting to run, per background queue and server process",
+        ["queue_name"],
+        multiprocess_mode="liveall"
+    ),
+    "background_tasks": Counter(
+        f"{METRIC_PREFIX}_background_tasks",
+        "Number of background tasks run, per background queue and detector function",
+        ["queue_name", "detector_name"]
+    ),
+    "background_task_time": Counter(
+        f"{METRIC_PREFIX}_background_task_time",
+        "Total time from the submission of background tasks to their completion, in seconds",
+        ["queue_name", "detector_name"]
+    ),
+    "background_task_drops": Counter(
+        f"{METRIC_PREFIX}_background_task_drops",
+        "Number of background tasks dropped because their queue was full or the server was shutting down",
+        ["queue_name", "detector_name", "reason"]
+    ),
+    "isolated_queue_wait": Counter(
+        f"{METRIC_PREFIX}_isolated_queue_wait",
+        "Total time that calls of @isolated custom detectors waited for a free worker process, in seconds",
+        ["pool_name", "detector_name"]
+    ),
+    "isolated_exec_time": Counter(
+        f"{METRIC_PREFIX}_isolated_exec_time",
+        "Total time that calls of @isolated custom detectors spent in a worker process, in seconds",
+        ["pool_name", "detector_name"]
+    ),
+    "isolated_timeouts": Counter(
+        f"{METRIC_PREFIX}_isolated_timeouts",
+        "Number of calls of @isolated custom detectors killed for exceeding their timeout",
+        ["pool_name", "detector_name"]
+    ),
+    "isolated_recycles": Counter(
+        f"{METRIC_PREFIX}_isolated_recycles",
+        "Number of worker processes of @isolated custom detectors replaced, per reason (max_calls, timeout or crashed)",
+        ["pool_name", "reason"]
+    ),
+    "registry_generation": Gauge(
+        f"{METRIC_PREFIX}_registry_generation",
+        "Generation of the detectors loaded by each server process, incremented on every reload",
+        ["detector_kind"],
+        multiprocess_mode="liveall"
+    ),
+    "registry_reload_duration": Gauge(
+        f"{METRIC_PREFIX}_registry_reload_duration",
+        "Duration of the last successful reload of the detectors, in seconds, per server process",
+        ["detector_kind"],
+        multiprocess_mode="liveall"
+    ),
+    "registry_reloads": Counter(
+        f"{METRIC_PREFIX}_registry_reloads",
+        "Number of reloads of the detectors, per result (success or failed)",
+        ["detector_kind", "result"]
+    ),
+})
+# optional cache of detection results, in front of every registry's run_plan_contents
+app.state.result_cache = ResultCache.from_env()
+app.state.result_cache.set_instruments(app.state.instruments)
+# runs the registries of a request serially, or fanned out over a thread or process pool
+app.state.detector_executor = DetectorExecutor.from_env()
+# whether the registries are started, see /ready
+app.state.ready = False
+
+
+def set_custom_detectors(registry: CustomDetectorRegistry):
+    app.set_detector(registry, registry.registry_name)
+    # worker processes hold copies of the registries
+    app.state.detector_executor.recycle_processes()
+
+
+# reloads custom_detectors.py on /custom_detectors/reload, or when the file changes
+app.state.custom_detectors_reloader = CustomDetectorReloader.from_env(lambda: app.get_detector("custom"), set_custom_detectors)
+app.state.custom_detectors_reloader.set_instruments(app.state.instruments)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -39,30 +178,88 @@ def metrics():
     data = generate_latest(registry)
     return Response(data, media_type=CONTENT_TYPE_LATEST)
 
+@app.get("/ready")
+def ready():
+    """Check if the server is ready to take detection requests, i.e. if its registries finished starting up"""
+    if not app.state.ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready"}
+
+def get_plans(detector_params: dict, leases: contextlib.ExitStack) -> list:
+    """
+    Compile the parameters of every registry once per request, rejecting invalid names before any content is scanned.
+    Every registry is held in `leases` as soon as it is resolved, so that a reload cannot retire it before the request
+    has run on it.
+    """
+    plans = []
+    for detector_kind in detector_params:
+        detector_registry = app.get_all_detectors().get(detector_kind)
+        if detector_registry is None:
+            raise HTTPException(status_code=400, detail=f"Detector {detector_kind} not found")
+        if not isinstance(detector_registry, BaseDetectorRegistry):
+            raise TypeError(f"Detector {detector_kind} is not a valid BaseDetectorRegistry")
+        leases.enter_context(detector_registry.serving())
+        try:
+            plans.append((detector_registry, detector_registry.get_plan(detector_params)))
+        except HTTPException as e:
+            raise e
+        except Exception as e:
+            raise HTTPException(status_code=500) from e
+    return plans
+
+
 @app.post("/api/v1/text/contents", response_model=ContentsAnalysisResponse)
-def detect_content(request: ContentAnalysisHttpRequest, raw_request: Request):
+async def detect_content(request: ContentAnalysisHttpRequest, raw_request: Request):
     logger.info(f"Request for {request.detector_params}")
 
     headers = dict(raw_request.headers)
 
-    detections = []
-    for content in request.contents:
-        message_detections = []
-        for detector_kind in request.detector_params:
-            detector_registry = app.get_all_detectors().get(detector_kind)
-            if detector_registry is None:
-                raise HTTPException(status_code=400, detail=f"Detector {detector_kind} not found")
-            if not isinstance(detector_registry, BaseDetectorRegistry):
-                raise TypeError(f"Detector {detector_kind} is not a valid BaseDetectorRegistry")
-            else:
-                try:
-                    message_detections += detector_registry.handle_request(content, request.detector_params, headers)
-                except HTTPException as e:
-                    raise e
-                except Exception as e:
-                    raise HTTPException(status_code=500) from e
-        detections.append(message_detections)
-    return ContentsAnalysisResponse(root=detections)
+    # the async custom detectors are awaited on the server's loop, everything else runs in threads
+    with contextlib.ExitStack() as leases:
+        plans = await run_in_threadpool(get_plans, request.detector_params, leases)
+        try:
+            content_detections = await app.state.detector_executor.run_async(
+                plans,
+                request.contents,
+                headers,
+                run=app.state.result_cache.run_plan_contents,
+                run_async=app.state.result_cache.run_plan_contents_async,
+                all_registries=app.get_all_detectors(),
+                instrument_names=list(app.state.instruments),
+            )
+        except HTTPException as e:
+            raise e
+        except Exception as e:
+            raise HTTPException(status_code=500) from e
+    return await run_in_threadpool(build_detections_response, content_detections)
+
+
+def build_detections_response(content_detections: list) -> JSONResponse:
+    detections = [[serialize_detection(detection) for detection in message_detections] for message_detections in content_detections]
+    # the detections are serialized here, once: returning a response directly skips FastAPI's re-validation of the
+    # response_model, which is only kept to document the schema
+    return JSONResponse(content=detections)
+
+
+@app.post("/schemas/reload")
+def reload_schemas():
+    """Reload the named schemas of the file_type detector from its schema directory"""
+    detector_registry = app.get_detector("file_type")
+    if not hasattr(detector_registry, "reload_schemas"):
+        raise HTTPException(status_code=404, detail="Detector file_type not found")
+    schemas = detector_registry.reload_schemas()
+    app.state.detector_executor.recycle_processes()
+    return {"schemas": schemas}
+
+
+@app.post("/custom_detectors/reload")
+def reload_custom_detectors():
+    """Reload custom_detectors.py, swapping in the new detectors once they are loaded and started"""
+    try:
+        registry = app.state.custom_detectors_reloader.reload()
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Failed to reload the custom detectors: {e}")
+    return {"generation": registry.generation, "detectors": sorted(registry.registry)}
 
 
 @app.get("/registry")
@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, List, Optional
+
+from config import get_float_env, get_int_env
+
+logger = logging.getLogger(__name__)
+
+# what to do with a task submitted while the queue is full
+OVERFLOW_POLICIES = ("drop_oldest", "drop_new", "run_inline")
+
+
+@dataclass
+class BackgroundTask:
+    name: str
+    function: Callable[[], None]
+    submitted: float
+
+
+class BackgroundTaskQueue:
+    """
+    Runs fire-and-forget tasks, e.g. the work of `@non_blocking` guardrails, on a fixed set of worker threads.
+
+    At most `max_queue` tasks wait to run (`0` removes the bound). A task submitted to a full queue either replaces the
+    oldest waiting task (`drop_oldest`), is dropped itself (`drop_new`), or runs in the submitting thread (`run_inline`),
+    which slows the caller down rather than losing work. `drain` waits for the waiting tasks on shutdown.
+
+    The queue depth, the time from submission to completion, and the dropped tasks are reported to the
+    `background_queue_depth`, `background_task_time`, `background_tasks` and `background_task_drops` instruments.
+    """
+    def __init__(self, name: str, workers: int = 0, max_queue: int = 1000, overflow: str = "drop_oldest", drain_timeout: float = 10.0):
+        if overflow not in OVERFLOW_POLICIES:
+            logger.warning(f"Unknown overflow policy {overflow} for {name}, defaulting to drop_oldest. Available policies: {list(OVERFLOW_POLICIES)}")
+            overflow = "drop_oldest"
+        self.name = name
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.drain_timeout = drain_timeout
+        self.instruments = {}
+        self._tasks: Deque[BackgroundTask] = deque()
+        self._threads: List[threading.Thread] = []
+        self._running = 0
+        self._draining = False
+        self._generation = 0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls, name: str) -> "BackgroundTaskQueue":
+        return cls(
+            name,
+            workers=get_int_env("NON_BLOCKING_WORKERS", 0),
+            max_queue=get_int_env("NON_BLOCKING_MAX_QUEUE", 1000),
+            overflow=os.environ.get("NON_BLOCKING_OVERFLOW", "drop_oldest").strip().lower(),
+            drain_timeout=get_float_env("NON_BLOCKING_DRAIN_TIMEOUT", 10.0),
+        )
+
+    def set_instruments(self, instruments: dict):
+        self.instruments = instruments
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def submit(self, name: str, function: Callable[[], None]):
+        """Queue `function()` to run in the background, reported as the task `name`"""
+        task = BackgroundTask(name, function, time.perf_counter())
+        with self._condition:
+            if self._draining:
+                self.record_drop(task, "shutdown")
+                return
+            if not self._threads:
+                self.start_workers()
+            inline = False
+            if self.max_queue and len(self._tasks) >= self.max_queue:
+                if self.overflow == "drop_new":
+                    self.record_drop(task, "queue_full")
+                    return
+                if self.overflow == "drop_oldest":
+                    self.record_drop(self._tasks.popleft(), "queue_full")
+                else:
+                    inline = True
+            if not inline:
+                self._tasks.append(task)
+                self.record_depth()
+                self._condition.notify()
+                return
+        self.run(task)
+
+    def start_workers(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, args=(self._generation,), name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def work(self, generation: int):
+        while True:
+            with self._condition:
+                while not self._tasks and not self._draining and generation == self._generation:
+                    self._condition.wait()
+                # workers left over from before a drain, e.g. stuck in a task past its deadline, exit after that task
+                if not self._tasks or generation != self._generation:
+                    return
+                task = self._tasks.popleft()
+                self._running += 1
+                self.record_depth()
+            try:
+                self.run(task)
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self._condition.notify_all()
+
+    def run(self, task: BackgroundTask):
+        try:
+            task.function()
+        except Exception as e:
+            logger.error(f"Exception in background task {task.name} of {self.name}: {e}")
+        finally:
+            if self.instruments.get("background_task_time"):
+                self.instruments["background_task_time"].labels(self.name, task.name).inc(time.perf_counter() - task.submitted)
+            if self.instruments.get("background_tasks"):
+                self.instruments["background_tasks"].labels(self.name, task.name).inc()
+
+    def record_depth(self):
+        if self.instruments.get("background_queue_depth"):
+            self.instruments["background_queue_depth"].labels(self.name).set(len(self._tasks))
+
+    def record_drop(self, task: BackgroundTask, reason: str):
+        logger.warning(f"Dropped background task {task.name} of {self.name}: {reason}")
+        if self.instruments.get("background_task_drops"):
+            self.instruments["background_task_drops"].labels(self.name, task.name, reason).inc()
+
+    def drain(self, timeout: Optional[float] = None):
+        """
+        Stop taking tasks and wait up to `timeout` seconds for the waiting and running tasks to finish. Tasks that are
+        still waiting after that are dropped. The queue takes tasks again afterwards, starting new workers.
+        """
+        deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+        with self._condition:
+            self._draining = True
+            self._condition.notify_all()
+            while self._tasks or self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            while self._tasks:
+                self.record_drop(self._tasks.popleft(), "shutdown")
+            self.record_depth()
+            threads, self._threads = self._threads, []
+            self._generation += 1
+        # the workers exit once the queue is empty, except those stuck in a task past the deadline
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        with self._condition:
+            self._draining = False
@@ -1,24 +1,179 @@
+import contextlib
+import json
 import logging
+import threading
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from fastapi import HTTPException
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Callable, List, Optional, Tuple
 
 from detectors.common.instrumented_detector import InstrumentedDetector
-from detectors.common.scheme import ContentAnalysisResponse
+from cache import LRUCache
+from config import get_int_env
+from detection_record import Detection
+
+
+@dataclass(frozen=True)
+class DetectorStep:
+    """One requested detector function, resolved: `function(content)` runs it, and it is reported as `metric_name`"""
+    name: Any
+    metric_name: str
+    function: Optional[Callable] = None
+
+
+@dataclass(frozen=True)
+class DetectorPlan:
+    """
+    The `detector_params` of one registry, compiled once: the requested functions are resolved (and their names
+    validated) up front, so that running the plan over each content of a request does no per-content parsing.
+    """
+    registry_name: str
+    params: Any  # this registry's entry of the request's detector_params
+    steps: Tuple[DetectorStep, ...]
+    cache_params: Optional[str] = None
+
 
 class BaseDetectorRegistry(InstrumentedDetector, ABC):
     def __init__(self, registry_name):
         super().__init__(registry_name)
         self.registry = None
+        self._recorded_instruments = threading.local()
+        # plans are keyed by the normalized parameters, so that requests with the same configuration share them
+        self.plan_cache = LRUCache(f"{registry_name}_plans", maxsize=get_int_env("PLAN_CACHE_SIZE", 256))
 
 
     @abstractmethod
-    def handle_request(self, content: str, detector_params: dict, headers: dict, **kwargs) -> List[ContentAnalysisResponse]:
+    def handle_request(self, content: str, detector_params: dict, headers: dict, **kwargs) -> List[Detection]:
         pass
     
     def get_registry(self):
         return self.registry
 
+    def start(self, in_worker: bool = False):
+        """
+        Build the resources of this registry when the server starts, before it reports ready. `in_worker` is set in the
+        worker processes of the detector executor, which build registries of their own.
+        """
+        pass
+
+    def close(self):
+        """Release the resources of this registry when the server shuts down"""
+        pass
+
+    @contextlib.contextmanager
+    def serving(self):
+        """Hold this registry for a request, from the compilation of its plan until its detections are returned"""
+        yield
+
+    def set_instruments(self, instruments):
+        super().set_instruments(instruments)
+        self.plan_cache.set_instruments(instruments)
+
+    def get_params_key(self, detector_params: dict) -> Optional[str]:
+        """Normalize the parameters of this registry into a hashable key, or return None if they cannot be serialized"""
+        try:
+            return json.dumps(detector_params.get(self.registry_name), sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+
+    def get_cache_params(self, detector_params: dict) -> Optional[str]:
+        """
+        Normalize the parameters of this registry into a result cache key, or return None if the results of this request
+        must not be cached. Results may only be cached if they depend on nothing but the content and these parameters.
+        """
+        return self.get_params_key(detector_params)
+
+    def compile_plan(self, detector_params: dict) -> DetectorPlan:
+        """
+        Compile the parameters of this registry into a plan, raising an HTTPException for invalid function names.
+        Registries that do not compile their own plans run the plan through `handle_request`.
+        """
+        return DetectorPlan(
+            registry_name=self.registry_name,
+            params=detector_params.get(self.registry_name),
+            steps=tuple(DetectorStep(name, str(name)) for name in self.get_detection_functions_from_params(detector_params)),
+            cache_params=self.get_cache_params(detector_params),
+        )
+
+    def get_plan(self, detector_params: dict) -> DetectorPlan:
+        """Compile the parameters of this registry into a plan, or fetch the plan of previous identical parameters"""
+        key = self.get_params_key(detector_params)
+        if key is None:
+            return self.compile_plan(detector_params)
+        return self.plan_cache.get_or_create(key, lambda: self.compile_plan(detector_params))
+
+    def run_plan(self, plan: DetectorPlan, content: str, headers: dict) -> List[Detection]:
+        return self.handle_request(content, {self.registry_name: plan.params}, headers)
+
+    def run_plan_contents(
+        self, plan: DetectorPlan, contents: List[str], headers: dict, recordings: Optional[list] = None,
+    ) -> List[List[Detection]]:
+        """
+        Run a plan over the contents of a request, returning the detections of each content. By default the contents
+        are run one after another: registries that run them together, e.g. concurrently, override this along with
+        `runs_contents_together`. With `recordings`, the detector instrument updates of the i-th content are recorded
+        into `recordings[i]`, see `record_content`.
+        """
+        results = []
+        for index, content in enumerate(contents):
+            with self.record_content(recordings, index):
+                results.append(self.run_plan(plan, content, headers))
+        return results
+
+    def runs_contents_together(self, plan: DetectorPlan) -> bool:
+        """Whether `run_plan_contents` gains from being handed every content of a request at once"""
+        return False
+
+    def awaits_contents(self, plan: DetectorPlan) -> bool:
+        """Whether the plan awaits I/O that `run_plan_contents_async` waits on without holding a thread"""
+        return False
+
+    async def run_plan_contents_async(
+        self, plan: DetectorPlan, contents: List[str], headers: dict, recordings: Optional[list] = None,
+    ) -> List[List[Detection]]:
+        """
+        `run_plan_contents` for the server's event loop. By default the plan runs in a thread: registries whose plans
+        await I/O, see `awaits_contents`, override this to await it on the loop itself.
+        """
+        return await run_in_threadpool(self.run_plan_contents, plan, contents, headers, recordings)
+
+    def increment_detector_instruments(self, function_name: str, is_detection: bool):
+        super().increment_detector_instruments(function_name, is_detection)
+        recorded = getattr(self._recorded_instruments, "calls", None)
+        if recorded is not None:
+            recorded.append((function_name, is_detection))
+
+    @contextlib.contextmanager
+    def record_detector_instruments(self):
+        """Record the detector instrument updates made in this block, so that they can be replayed for a cached result"""
+        calls: List[Tuple[str, bool]] = []
+        outer_calls = getattr(self._recorded_instruments, "calls", None)
+        self._recorded_instruments.calls = calls
+        try:
+            yield calls
+        finally:
+            # recordings nest, e.g. the recording of each content within that of a whole request in a worker process
+            self._recorded_instruments.calls = outer_calls
+            if outer_calls is not None:
+                outer_calls.extend(calls)
+
+    @contextlib.contextmanager
+    def record_content(self, recordings: Optional[list], index: int):
+        """Record the detector instrument updates of one content of `run_plan_contents` into `recordings[index]`"""
+        if recordings is None:
+            yield
+            return
+        with self.record_detector_instruments() as calls:
+            yield
+        recordings[index] = calls
+
+    def add_recorded_detector_instruments(self, calls: List[Tuple[str, bool]]):
+        """Add instrument updates that were already applied elsewhere, e.g. in a worker process, to the active recording"""
+        recorded = getattr(self._recorded_instruments, "calls", None)
+        if recorded is not None:
+            recorded.extend(calls)
+
     def throw_internal_detector_error(self, function_name: str, logger: logging.Logger, exception: Exception, increment_requests: bool):
         """consistent handling of internal errors within a detection function"""
         if increment_requests and self.instruments.get("requests"):
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    A thread-safe, bounded least-recently-used cache.
+
+    Besides the number of entries, the cache can be bounded by age (`ttl`, in seconds) and by an estimate of the memory
+    its values take (`max_bytes`, measured with the `sizeof` function). Hits, misses and evictions are reported to the
+    `cache_hits`, `cache_misses` and `cache_evictions` instruments and the hit ratio to the `cache_hit_ratio`
+    instrument, all labelled with the cache name. A cache with a `maxsize` of 0 never stores anything.
+    """
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.instruments = {}
+        self.hits = 0
+        self.misses = 0
+        self.current_bytes = 0
+        # key -> (value, expiry time, size)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_instruments(self, instruments: dict):
+        self.instruments = instruments
+
+    def _record(self, event: str, count: int = 1):
+        if count and self.instruments.get(f"cache_{event}"):
+            self.instruments[f"cache_{event}"].labels(self.name).inc(count)
+
+    def _record_lookup(self, hit: bool):
+        self._record("hits" if hit else "misses")
+        if self.instruments.get("cache_hit_ratio"):
+            self.instruments["cache_hit_ratio"].labels(self.name).set(self.hits / (self.hits + self.misses))
+
+    def _remove(self, key: Hashable):
+        """Remove an entry, while holding the lock"""
+        _, _, size = self._data.pop(key)
+        self.current_bytes -= size
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        evicted = 0
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                entry, evicted = None, 1
+            if entry is not None:
+                self._data.move_to_end(key)
+                value, hit = entry[0], True
+                self.hits += 1
+            else:
+                value, hit = default, False
+                self.misses += 1
+        self._record("evictions", evicted)
+        self._record_lookup(hit)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+        evicted = 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expiry, size)
+            self.current_bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes is not None and self.current_bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                evicted += 1
+        self._record("evictions", evicted)
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the cached value for `key`, building and storing it with `factory` on a miss. Exceptions raised by the factory are not cached."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
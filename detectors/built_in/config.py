@@ -0,0 +1,46 @@
+import logging
+import os
+from typing import Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _get_env(name: str, default: T, parse: Callable[[str], T], minimum: Optional[T] = None) -> T:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    try:
+        value = parse(raw)
+    except ValueError:
+        logger.warning(f"Could not parse {name} env var: {raw}. Defaulting to {default}.")
+        return default
+    if minimum is not None and value < minimum:
+        logger.warning(f"{name} must be at least {minimum}, got {value}. Defaulting to {default}.")
+        return default
+    logger.info(f"{name} env var: {value}")
+    return value
+
+
+def _parse_bool(raw: str) -> bool:
+    if raw.strip().lower() in {"1", "true", "yes", "on"}:
+        return True
+    if raw.strip().lower() in {"0", "false", "no", "off"}:
+        return False
+    raise ValueError(raw)
+
+
+def get_int_env(name: str, default: int, minimum: int = 0) -> int:
+    """Parse an integer environment variable, falling back to `default` if it is unset or invalid"""
+    return _get_env(name, default, int, minimum)
+
+
+def get_float_env(name: str, default: float, minimum: float = 0.0) -> float:
+    """Parse a float environment variable, falling back to `default` if it is unset or invalid"""
+    return _get_env(name, default, float, minimum)
+
+
+def get_bool_env(name: str, default: bool) -> bool:
+    """Parse a boolean environment variable (true/false, yes/no, on/off, 1/0), falling back to `default` if it is unset or invalid"""
+    return _get_env(name, default, _parse_bool)
@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from prometheus_client import REGISTRY
+
+from config import get_float_env
+from custom_detectors_wrapper import CUSTOM_DETECTORS_PATH, CustomDetectorRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class CustomDetectorReloader:
+    """
+    Reloads custom_detectors.py without restarting the server, on `reload` (e.g. from an admin endpoint) or whenever the
+    file changes, when it is watched every `watch_interval` seconds (`0` disables the watch).
+
+    A reload builds and starts a new registry next to the current one, passing the same static code analysis and running
+    its @on_startup functions, and only then swaps it in. Requests in flight finish on the old registry, which is retired
+    in the background once they are done, or after `grace_period` seconds. A failed reload keeps the current registry.
+
+    The generation of the loaded registry, the duration of the last reload and the reloads are reported to the
+    `registry_generation`, `registry_reload_duration` and `registry_reloads` instruments.
+    """
+    def __init__(
+        self,
+        get_registry: Callable[[], Optional[CustomDetectorRegistry]],
+        set_registry: Callable[[CustomDetectorRegistry], None],
+        watch_interval: float = 0.0,
+        grace_period: float = 30.0,
+    ):
+        self.get_registry = get_registry
+        self.set_registry = set_registry
+        self.watch_interval = watch_interval
+        self.grace_period = grace_period
+        self.instruments = {}
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watching = threading.Event()
+
+    @classmethod
+    def from_env(cls, get_registry, set_registry) -> "CustomDetectorReloader":
+        return cls(
+            get_registry,
+            set_registry,
+            watch_interval=get_float_env("CUSTOM_DETECTORS_WATCH_INTERVAL", 0.0),
+            grace_period=get_float_env("CUSTOM_DETECTORS_RELOAD_GRACE_PERIOD", 30.0),
+        )
+
+    def set_instruments(self, instruments: dict):
+        self.instruments = instruments
+
+    def record_generation(self, registry: CustomDetectorRegistry):
+        if self.instruments.get("registry_generation"):
+            self.instruments["registry_generation"].labels(registry.registry_name).set(registry.generation)
+
+    def reload(self) -> CustomDetectorRegistry:
+        """Build, start and swap in a new registry from the current file, raising the error of a failed reload"""
+        with self._lock:
+            start_time = time.perf_counter()
+            old = self.get_registry()
+            # the prometheus instruments of the module are created again by the new version
+            if old is not None:
+                old.unregister_collectors()
+            collectors = set(REGISTRY._collector_to_names)
+            try:
+                registry = CustomDetectorRegistry(generation=old.generation + 1 if old is not None else 1)
+                registry.set_instruments(self.instruments)
+                registry.start()
+            except Exception as e:
+                logger.error(f"Failed to reload the custom detectors, keeping generation {getattr(old, 'generation', None)}: {e}")
+                # the new version may have created its prometheus instruments before it failed, which would clash with
+                # those of the current version
+                for collector in list(REGISTRY._collector_to_names):
+                    if collector not in collectors:
+                        REGISTRY.unregister(collector)
+                if old is not None:
+                    old.register_collectors()
+                self.record_reload("custom", "failed", time.perf_counter() - start_time)
+                raise e
+            self.set_registry(registry)
+            self.record_reload(registry.registry_name, "success", time.perf_counter() - start_time)
+            self.record_generation(registry)
+            logger.info(f"Reloaded the custom detectors, now at generation {registry.generation}")
+        if old is not None:
+            threading.Thread(target=old.retire, args=(self.grace_period,), name="custom_detectors_retire", daemon=True).start()
+        return registry
+
+    def record_reload(self, registry_name: str, result: str, duration: float):
+        if self.instruments.get("registry_reloads"):
+            self.instruments["registry_reloads"].labels(registry_name, result).inc()
+        if result == "success" and self.instruments.get("registry_reload_duration"):
+            self.instruments["registry_reload_duration"].labels(registry_name).set(duration)
+
+    def get_file_version(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(CUSTOM_DETECTORS_PATH)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start_watching(self):
+        """Reload the custom detectors whenever their file changes, if a watch interval is configured"""
+        if not self.watch_interval or self._watcher is not None:
+            return
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self.watch, name="custom_detectors_watch", daemon=True)
+        self._watcher.start()
+
+    def watch(self):
+        loaded = seen = self.get_file_version()
+        while not self._stop_watching.wait(self.watch_interval):
+            current = self.get_file_version()
+            # a change is only reloaded once it held for a whole interval, so that files are not read half-written
+            settled, seen = current == seen, current
+            if current is None or current == loaded or not settled:
+                continue
+            loaded = current
+            try:
+                self.reload()
+            except Exception:
+                # the error is logged by the reload, and the file is reloaded again on its next change
+                pass
+
+    def stop_watching(self):
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+        self._watcher = None
@@ -1,22 +1,43 @@
 import ast
+import asyncio
+import contextlib
 import logging
 import importlib.util
 import inspect
 import functools
+import json
 import os
 import sys
+import threading
+import time
 import traceback
 
-from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from fastapi import HTTPException
-from typing import List, Optional, Callable
-
-from base_detector_registry import BaseDetectorRegistry
+from prometheus_client import REGISTRY
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional, Callable, Tuple
+
+from background_tasks import BackgroundTaskQueue
+from base_detector_registry import BaseDetectorRegistry, DetectorPlan, DetectorStep
+from cache import LRUCache
+from event_loop import EventLoopThread
+from process_isolation import IsolatedProcessPool
+from result_cache import content_digest
 from detectors.common.app import METRIC_PREFIX
 from detectors.common.scheme import ContentAnalysisResponse
 
 logger = logging.getLogger(__name__)
 
+# the bounded queue that runs the work of the @non_blocking guardrails of this process
+non_blocking_tasks = BackgroundTaskQueue.from_env("non_blocking")
+# the event loop that awaits the `async def` guardrails of this process
+async_detectors = EventLoopThread("async_detectors")
+# the worker processes that run the @isolated guardrails of this process
+isolated_detectors = IsolatedProcessPool.from_env("isolated")
+
+CUSTOM_DETECTORS_PATH = os.path.join(os.path.dirname(__file__), "custom_detectors", "custom_detectors.py")
+
 def use_instruments(instruments: List):
     """Use this decorator to register the provided Prometheus instruments with the main /metrics endpoint"""
     def inner_layer_1(func):
@@ -35,21 +56,23 @@ def non_blocking(return_value):
     Use this decorator to run the guardrail as a non-blocking background thread.
 
     The `return_value` is returned instantly to the caller of the /api/v1/text/contents, while
-    the logic inside the function will run asynchronously in the background.
+    the logic inside the function will run asynchronously in the background, on the bounded
+    `non_blocking_tasks` queue.
     """
     def inner_layer_1(func):
+        # the background work has to run for every request, so the results of this guardrail are never cached
+        if getattr(get_underlying_function(func), "function_cache", None) is not None:
+            raise TypeError(f"@non_blocking cannot be combined with @cached, got {func.__name__}")
+        setattr(get_underlying_function(func), "cacheable", False)
+        setattr(get_underlying_function(func), "non_blocking", True)
+
         @functools.wraps(func)
         def inner_layer_2(*args, **kwargs):
-            executor = getattr(non_blocking, "_executor", None)
-            if executor is None:
-                executor = ThreadPoolExecutor()
-                non_blocking._executor = executor
-            def runner():
-                try:
-                    func(*args, **kwargs)
-                except Exception as e:
-                    logging.error(f"Exception in non-blocking guardrail {func.__name__}: {e}")
-            executor.submit(runner)
+            # errors of the background work are logged by the queue
+            if inspect.iscoroutinefunction(get_underlying_function(func)):
+                non_blocking_tasks.submit(func.__name__, lambda: async_detectors.run(func(*args, **kwargs)))
+            else:
+                non_blocking_tasks.submit(func.__name__, functools.partial(func, *args, **kwargs))
 
             # check to see if "func" is already decorated by `use_instruments`, and grab the instruments if so
             target = get_underlying_function(func)
@@ -59,7 +82,121 @@ def non_blocking(return_value):
         return inner_layer_2
     return inner_layer_1
 
-forbidden_names = [use_instruments.__name__, non_blocking.__name__]
+def non_cacheable(func):
+    """
+    Use this decorator to exclude the guardrail from the result cache, e.g. if it is non-deterministic or has side
+    effects that must happen on every request. Guardrails that take `headers` are never cached.
+    """
+    setattr(get_underlying_function(func), "cacheable", False)
+    return func
+
+def isolated(timeout: Optional[float] = None):
+    """
+    Use this decorator to run the guardrail in a worker process of the `isolated_detectors` pool, e.g. if it is
+    CPU-bound, so that it runs in parallel with the rest of the server rather than holding its GIL. A call that takes
+    longer than `timeout` seconds (by default `ISOLATED_TIMEOUT`) is killed together with its worker process, and fails.
+    """
+    def inner_layer_1(func):
+        if inspect.iscoroutinefunction(get_underlying_function(func)):
+            raise TypeError(f"@isolated does not support async functions, got {func.__name__}")
+        setattr(get_underlying_function(func), "isolated", True)
+
+        @functools.wraps(func)
+        def inner_layer_2(*args, **kwargs):
+            if isolated_detectors.in_process:
+                return func(*args, **kwargs)
+            # the worker processes load the custom detectors themselves, so the function is called by name
+            return isolated_detectors.call(func.__name__, args, kwargs, timeout)
+        return inner_layer_2
+    return inner_layer_1
+
+def cached(maxsize: int = 1024, ttl: Optional[float] = None):
+    """
+    Use this decorator to memoize the results of a guardrail that is a pure function of its text and `kwargs`, e.g. an
+    expensive heuristic, in an LRU cache of `maxsize` entries that expire after `ttl` seconds (by default never).
+
+    Results are keyed by a hash of the text and the other arguments, including the `headers` of guardrails that take
+    them. Errors are not cached. @non_blocking guardrails cannot be cached, as their background work runs every time. The hits, misses and evictions are reported like those of the built-in caches, as the
+    cache `custom_function_$NAME`.
+    """
+    def inner_layer_1(func):
+        # a memoized call would skip the background work of a @non_blocking guardrail, which has to run every time
+        if getattr(get_underlying_function(func), "non_blocking", False):
+            raise TypeError(f"@cached cannot be combined with @non_blocking, got {func.__name__}")
+        cache = LRUCache(f"custom_function_{func.__name__}", maxsize, ttl=ttl)
+        # registered on the original function, where the registry picks it up to report its metrics
+        setattr(get_underlying_function(func), "function_cache", cache)
+        missing = object()
+
+        def make_key(args: tuple, kwargs: dict) -> tuple:
+            # @batched guardrails take a list of texts
+            digest = tuple(map(content_digest, args[0])) if isinstance(args[0], list) else content_digest(args[0])
+            return digest, json.dumps([args[1:], kwargs], sort_keys=True, default=repr)
+
+        if inspect.iscoroutinefunction(get_underlying_function(func)):
+            # the calls in flight on the event loop, which concurrent calls with the same key, e.g. for the repeated
+            # contents of a request, wait on rather than calling the function again
+            pending = {}
+
+            @functools.wraps(func)
+            async def async_inner_layer_2(*args, **kwargs):
+                key = make_key(args, kwargs)
+                result = cache.get(key, missing)
+                if result is not missing:
+                    return result
+                if key in pending:
+                    return await asyncio.shield(pending[key])
+                pending[key] = asyncio.ensure_future(func(*args, **kwargs))
+                try:
+                    result = await asyncio.shield(pending[key])
+                finally:
+                    del pending[key]
+                cache.put(key, result)
+                return result
+            return async_inner_layer_2
+
+        @functools.wraps(func)
+        def inner_layer_2(*args, **kwargs):
+            key = make_key(args, kwargs)
+            return cache.get_or_create(key, lambda: func(*args, **kwargs))
+        return inner_layer_2
+    return inner_layer_1
+
+def on_startup(func):
+    """
+    Use this decorator for a function without parameters that builds the shared resources of the guardrails, e.g. a
+    model or a connection pool, once per server worker. The startup functions run, in the order they are defined, before
+    the server reports ready. Async functions run on the event loop of the `async def` guardrails.
+    """
+    setattr(func, "lifecycle_hook", "startup")
+    return func
+
+def on_shutdown(func):
+    """
+    Use this decorator for a function without parameters that releases the shared resources of the guardrails when the
+    server worker shuts down. The shutdown functions run in the reverse order they are defined, after the background
+    work of the @non_blocking guardrails is done.
+    """
+    setattr(func, "lifecycle_hook", "shutdown")
+    return func
+
+def get_lifecycle_hooks(module, hook: str) -> List[Callable]:
+    """The functions of the custom detectors module decorated as `hook`, in the order they are defined"""
+    hooks = [obj for _, obj in inspect.getmembers(module, inspect.isfunction) if getattr(obj, "lifecycle_hook", None) == hook]
+    return sorted(hooks, key=lambda func: func.__code__.co_firstlineno)
+
+def batched(func):
+    """
+    Use this decorator for guardrails that take the list of every content of a request, e.g. to run a model on all of
+    them at once, and return a list with one result per content, in order.
+    """
+    setattr(get_underlying_function(func), "batched", True)
+    return func
+
+forbidden_names = [
+    use_instruments.__name__, non_blocking.__name__, non_cacheable.__name__, isolated.__name__, cached.__name__, batched.__name__,
+    on_startup.__name__, on_shutdown.__name__,
+]
 
 def get_underlying_function(func):
     if hasattr(func, "__wrapped__"):
@@ -67,24 +204,97 @@ def get_underlying_function(func):
     return func
 
 
-def custom_func_wrapper(func: Callable, func_name: str, s: str, headers: dict, func_kwargs: dict=None) -> Optional[ContentAnalysisResponse]:
-    """Convert a some f(text)->bool into a Detector response"""
-    sig = inspect.signature(func)
-    try:
-        if headers is not None:
-            if func_kwargs is None:
-                result = func(s, headers=headers)
-            else:
-                result = func(s, headers=headers, **func_kwargs)
-        else:
-            if func_kwargs is None:
-                result = func(s)
-            else:
-                result = func(s, **func_kwargs)
+@dataclass(frozen=True)
+class CustomFunctionInfo:
+    """What the registry needs to know about how to call a custom function"""
+    needs_headers: bool
+    needs_kwargs: bool
+    is_async: bool
+    is_batched: bool = False
+
+
+def inspect_custom_function(func: Callable) -> CustomFunctionInfo:
+    """Introspect a custom function, once per registry rather than on every call"""
+    parameters = inspect.signature(func).parameters
+    return CustomFunctionInfo(
+        needs_headers="headers" in parameters,
+        needs_kwargs="kwargs" in parameters,
+        # decorators such as @use_instruments wrap async functions in sync wrappers that return their coroutine
+        is_async=inspect.iscoroutinefunction(get_underlying_function(func)),
+        is_batched=getattr(get_underlying_function(func), "batched", False),
+    )
 
+
+def compile_custom_adapter(func: Callable, func_name: str, info: CustomFunctionInfo, func_kwargs: Optional[dict] = None) -> Callable:
+    """
+    Specialize a custom function f(text)->bool into an adapter(text, headers) that returns its Detector response, so
+    that how to call the function is decided once rather than on every call. Adapters of async functions are async,
+    and those of @batched functions take the list of contents and return the response of each content.
+    """
+    if info.needs_headers and func_kwargs:
+        call = lambda s, headers: func(s, headers=headers, **func_kwargs)
+    elif info.needs_headers:
+        call = lambda s, headers: func(s, headers=headers)
+    elif func_kwargs:
+        call = lambda s, headers: func(s, **func_kwargs)
+    else:
+        call = lambda s, headers: func(s)
+
+    if info.is_batched:
+        return compile_batch_adapter(call, func_name, info)
+
+    if info.is_async:
+        async def async_adapter(s: str, headers: dict) -> Optional[ContentAnalysisResponse]:
+            try:
+                result = await call(s, headers)
+            except Exception as e:
+                logging.error(f"Error when computing custom detector function {func_name}: {e}")
+                raise e
+            return build_custom_detection(result, func_name, s) if result else None
+        return async_adapter
+
+    def adapter(s: str, headers: dict) -> Optional[ContentAnalysisResponse]:
+        try:
+            result = call(s, headers)
+        except Exception as e:
+            logging.error(f"Error when computing custom detector function {func_name}: {e}")
+            raise e
+        # most calls are non-detections, which need no further checks
+        return build_custom_detection(result, func_name, s) if result else None
+    return adapter
+
+
+def compile_batch_adapter(call: Callable, func_name: str, info: CustomFunctionInfo) -> Callable:
+    if info.is_async:
+        async def async_batch_adapter(contents: List[str], headers: dict) -> List[Optional[ContentAnalysisResponse]]:
+            try:
+                results = await call(contents, headers)
+            except Exception as e:
+                logging.error(f"Error when computing custom detector function {func_name}: {e}")
+                raise e
+            return build_custom_detections(results, func_name, contents)
+        return async_batch_adapter
+
+    def batch_adapter(contents: List[str], headers: dict) -> List[Optional[ContentAnalysisResponse]]:
+        try:
+            results = call(contents, headers)
+        except Exception as e:
+            logging.error(f"Error when computing custom detector function {func_name}: {e}")
+            raise e
+        return build_custom_detections(results, func_name, contents)
+    return batch_adapter
+
+
+async def timed_await(awaitable) -> Tuple[Optional[ContentAnalysisResponse], Optional[Exception], float]:
+    """Await an async adapter, returning its Detector response or error, and its runtime"""
+    start_time = time.time()
+    try:
+        return await awaitable, None, time.time() - start_time
     except Exception as e:
-        logging.error(f"Error when computing custom detector function {func_name}: {e}")
-        raise e
+        return None, e, time.time() - start_time
+
+
+def build_custom_detection(result, func_name: str, s: str) -> Optional[ContentAnalysisResponse]:
     if result:
         if isinstance(result, bool):
             return ContentAnalysisResponse(
@@ -108,6 +318,16 @@ def custom_func_wrapper(func: Callable, func_name: str, s: str, headers: dict, f
         return None
 
 
+def build_custom_detections(results, func_name: str, contents: List[str]) -> List[Optional[ContentAnalysisResponse]]:
+    """The responses of a @batched function, which must return one result per content"""
+    if not isinstance(results, (list, tuple)) or len(results) != len(contents):
+        got = f"{len(results)} results" if isinstance(results, (list, tuple)) else type(results)
+        msg = f"Batched custom detector function {func_name} must return a list of {len(contents)} results, got: {got}"
+        logging.error(msg)
+        raise TypeError(msg)
+    return [build_custom_detection(result, func_name, s) for result, s in zip(results, contents)]
+
+
 def static_code_analysis(module_path, forbidden_imports=None, forbidden_calls=None):
     """
     Perform static code analysis on a Python module to check for forbidden imports and function calls.
@@ -152,43 +372,79 @@ def static_code_analysis(module_path, forbidden_imports=None, forbidden_calls=No
     return issues
 
 
+def load_custom_detectors(module_path: str, inject_imports: Optional[dict] = None):
+    """Load the custom detectors module, with the utility decorators (or the given replacements) injected into it"""
+    spec = importlib.util.spec_from_file_location("custom_detectors.custom_detectors", module_path)
+    custom_detectors = importlib.util.module_from_spec(spec)
+
+    # inject any user utility functions into the code automatically
+    inject_imports = {
+        "use_instruments": use_instruments,
+        "non_blocking": non_blocking,
+        "non_cacheable": non_cacheable,
+        "isolated": isolated,
+        "cached": cached,
+        "batched": batched,
+        "on_startup": on_startup,
+        "on_shutdown": on_shutdown,
+        **(inject_imports or {}),
+    }
+    for name, mod in inject_imports.items():
+        setattr(custom_detectors, name, mod)
+
+    # load the module
+    sys.modules["custom_detectors.custom_detectors"] = custom_detectors
+    spec.loader.exec_module(custom_detectors)
+    return custom_detectors
+
+
+def load_isolated_functions(module_path: str) -> Dict[str, Callable]:
+    """Load the @isolated custom detectors inside a worker process of `isolated_detectors`, where they run directly"""
+    functions = {}
+
+    def run_here(timeout: Optional[float] = None):
+        def register(func):
+            functions[func.__name__] = func
+            return func
+        return register
+    custom_detectors = load_custom_detectors(module_path, {"isolated": run_here})
+    # the worker processes build the shared resources of their guardrails too, and are killed without shutting down
+    for hook in get_lifecycle_hooks(custom_detectors, "startup"):
+        if inspect.iscoroutinefunction(hook):
+            asyncio.run(hook())
+        else:
+            hook()
+    return functions
+
+
 class CustomDetectorRegistry(BaseDetectorRegistry):
-    def __init__(self):
+    def __init__(self, generation: int = 1):
         super().__init__("custom")
+        # the version of custom_detectors.py, incremented on every reload
+        self.generation = generation
+        self._in_flight = 0
+        self._in_flight_condition = threading.Condition()
 
         # check the imported code for potential security issues
-        issues = static_code_analysis(module_path = os.path.join(os.path.dirname(__file__), "custom_detectors", "custom_detectors.py"))
+        issues = static_code_analysis(module_path = CUSTOM_DETECTORS_PATH)
         if issues:
             logging.error(f"Detected {len(issues)} potential security issues inside the custom_detectors file: {issues}")
             raise ImportError(f"Unsafe code detected in custom_detectors:\n" + "\n".join(issues))
 
-        # grab custom detectors module
-        module_path = os.path.join(os.path.dirname(__file__), "custom_detectors", "custom_detectors.py")
-        spec = importlib.util.spec_from_file_location("custom_detectors.custom_detectors", module_path)
-        custom_detectors = importlib.util.module_from_spec(spec)
-
-        # inject any user utility functions into the code automatically
-        inject_imports = {
-            "use_instruments": use_instruments,
-            "non_blocking": non_blocking,
-        }
-        for name, mod in inject_imports.items():
-            setattr(custom_detectors, name, mod)
-
-        # load the module
-        sys.modules["custom_detectors.custom_detectors"] = custom_detectors
-        spec.loader.exec_module(custom_detectors)
+        # grab custom detectors module, noting the prometheus collectors that it registers, e.g. to replace them on reload
+        collectors = set(REGISTRY._collector_to_names)
+        custom_detectors = load_custom_detectors(CUSTOM_DETECTORS_PATH)
+        self.collectors = [collector for collector in REGISTRY._collector_to_names if collector not in collectors]
 
         self.registry = {name: obj for name, obj
                          in inspect.getmembers(custom_detectors, inspect.isfunction)
-                         if not name.startswith("_") and name not in forbidden_names}
-
-        self.function_needs_headers = {}
-        self.function_needs_kwargs = {}
-        for name, obj in self.registry.items():
-            self.function_needs_headers[name] = "headers" in inspect.signature(obj).parameters
-            self.function_needs_kwargs[name] = "kwargs" in inspect.signature(obj).parameters
+                         if not name.startswith("_") and name not in forbidden_names and not hasattr(obj, "lifecycle_hook")}
+        self.startup_hooks = get_lifecycle_hooks(custom_detectors, "startup")
+        self.shutdown_hooks = get_lifecycle_hooks(custom_detectors, "shutdown")
 
+        self.function_info = {name: inspect_custom_function(obj) for name, obj in self.registry.items()}
+        # the adapters of the requests without kwargs, the others are compiled with their plans
+        self.adapters = {name: compile_custom_adapter(obj, name, self.function_info[name]) for name, obj in self.registry.items()}
 
         # check if functions have requested user prometheus metrics
         for name, func in self.registry.items():
@@ -201,26 +457,253 @@ class CustomDetectorRegistry(BaseDetectorRegistry):
         logger.info(f"Registered the following custom detectors: {self.registry.keys()}")
 
 
-    def handle_request(self, content: str, detector_params: dict, headers: dict, **kwargs) -> List[ContentAnalysisResponse]:
-        detections = []
+    def set_instruments(self, instruments):
+        super().set_instruments(instruments)
+        non_blocking_tasks.set_instruments(instruments)
+        isolated_detectors.set_instruments(instruments)
+        for func in self.registry.values():
+            if getattr(get_underlying_function(func), "function_cache", None) is not None:
+                get_underlying_function(func).function_cache.set_instruments(instruments)
+
+    def start(self, in_worker: bool = False):
+        for hook in self.startup_hooks:
+            logger.info(f"Running custom detectors startup function {hook.__name__}")
+            try:
+                self.run_hook(hook)
+            except Exception as e:
+                logger.error(f"Error in custom detectors startup function {hook.__name__}: {e}")
+                raise e
+        if in_worker:
+            # the worker processes of the detector executor are separate from the server already, so they run the
+            # @isolated guardrails themselves rather than each starting a pool of worker processes
+            isolated_detectors.in_process = True
+        # pre-start the worker processes of the @isolated guardrails, which load this version of the module
+        elif any(getattr(get_underlying_function(func), "isolated", False) for func in self.registry.values()):
+            isolated_detectors.start(load_isolated_functions, CUSTOM_DETECTORS_PATH)
+
+    def close(self):
+        # let the background work of the @non_blocking guardrails finish, as it may still await on the event loop or
+        # use the resources released by the shutdown functions
+        non_blocking_tasks.drain()
+        self.run_shutdown_hooks()
+        async_detectors.stop()
+        isolated_detectors.shutdown()
+
+    def retire(self, timeout: float):
+        """
+        Release the resources of this registry once it has been replaced by a reload: wait up to `timeout` seconds for
+        the requests still running on it, then run its shutdown functions. The resources shared with the new registry,
+        e.g. the event loop, are kept.
+        """
+        deadline = time.monotonic() + timeout
+        with self._in_flight_condition:
+            while self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"{self._in_flight} requests still running on generation {self.generation} of the custom detectors")
+                    break
+                self._in_flight_condition.wait(remaining)
+        self.run_shutdown_hooks()
+
+    def run_shutdown_hooks(self):
+        for hook in reversed(self.shutdown_hooks):
+            try:
+                self.run_hook(hook)
+            except Exception as e:
+                logger.error(f"Error in custom detectors shutdown function {hook.__name__}: {e}")
+
+    @contextlib.contextmanager
+    def serving(self):
+        """Count the requests running on this registry, so that a reload can wait for them before retiring it"""
+        with self._in_flight_condition:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._in_flight_condition:
+                self._in_flight -= 1
+                self._in_flight_condition.notify_all()
+
+    def unregister_collectors(self):
+        """Remove the prometheus collectors of this version of the module, e.g. so that a reload can create them again"""
+        for collector in self.collectors:
+            if collector in REGISTRY._collector_to_names:
+                REGISTRY.unregister(collector)
+
+    def register_collectors(self):
+        for collector in self.collectors:
+            if collector not in REGISTRY._collector_to_names:
+                REGISTRY.register(collector)
+
+    @staticmethod
+    def run_hook(hook: Callable):
+        if inspect.iscoroutinefunction(hook):
+            async_detectors.run(hook())
+        else:
+            hook()
+
+    def get_cache_params(self, detector_params: dict) -> Optional[str]:
         for custom_function_name in self.get_detection_functions_from_params(detector_params):
-            if self.registry.get(custom_function_name):
-                try:
-                    func_headers = headers if self.function_needs_headers.get(custom_function_name) else None
-
-                    if self.function_needs_kwargs.get(custom_function_name)and isinstance(detector_params[self.registry_name][custom_function_name], dict):
-                        func_kwargs = detector_params[self.registry_name][custom_function_name]
-                    else:
-                        func_kwargs = None
-
-                    with self.instrument_runtime(custom_function_name):
-                        result = custom_func_wrapper(self.registry[custom_function_name], custom_function_name, content, func_headers, func_kwargs)
-                    is_detection = result is not None
-                    self.increment_detector_instruments(custom_function_name, is_detection)
-                    if is_detection:
-                        detections.append(result)
-                except Exception as e:
-                    self.throw_internal_detector_error(custom_function_name, logger, e, increment_requests=True)
-            else:
+            func = self.registry.get(custom_function_name)
+            if func is None:
+                return None  # let the request fail as usual
+            if self.function_info[custom_function_name].needs_headers or not getattr(get_underlying_function(func), "cacheable", True):
+                return None
+        cache_params = super().get_cache_params(detector_params)
+        # results of an earlier version of the module are not served after a reload
+        return None if cache_params is None else f"{cache_params}@{self.generation}"
+
+    def compile_plan(self, detector_params: dict) -> DetectorPlan:
+        steps = []
+        for custom_function_name in self.get_detection_functions_from_params(detector_params):
+            if not self.registry.get(custom_function_name):
                 raise HTTPException(status_code=400, detail=f"Unrecognized custom function: {custom_function_name}")
+            info = self.function_info[custom_function_name]
+            if info.needs_kwargs and isinstance(detector_params[self.registry_name][custom_function_name], dict):
+                func_kwargs = detector_params[self.registry_name][custom_function_name]
+                adapter = compile_custom_adapter(self.registry[custom_function_name], custom_function_name, info, func_kwargs)
+            else:
+                func_kwargs = None
+                adapter = self.adapters[custom_function_name]
+            steps.append(CustomDetectorStep(
+                custom_function_name,
+                custom_function_name,
+                adapter,
+                needs_headers=info.needs_headers,
+                func_kwargs=func_kwargs,
+                is_async=info.is_async,
+                is_batched=info.is_batched,
+            ))
+        return DetectorPlan(
+            registry_name=self.registry_name,
+            params=detector_params.get(self.registry_name),
+            steps=tuple(steps),
+            cache_params=self.get_cache_params(detector_params),
+        )
+
+    def handle_request(self, content: str, detector_params: dict, headers: dict, **kwargs) -> List[ContentAnalysisResponse]:
+        return self.run_plan(self.get_plan(detector_params), content, headers)
+
+    def runs_contents_together(self, plan: DetectorPlan) -> bool:
+        # the async steps of every content of a request are awaited together, and batched steps take all contents
+        return any(step.is_async or step.is_batched for step in plan.steps)
+
+    def run_plan(self, plan: DetectorPlan, content: str, headers: dict) -> List[ContentAnalysisResponse]:
+        if self.runs_contents_together(plan):
+            return self.run_plan_contents(plan, [content], headers)[0]
+        with self.serving():
+            return self.run_steps(plan, content, headers)
+
+    def run_plan_contents(
+        self, plan: DetectorPlan, contents: List[str], headers: dict, recordings: Optional[list] = None,
+    ) -> List[List[ContentAnalysisResponse]]:
+        with self.serving():
+            if not self.runs_contents_together(plan):
+                return super().run_plan_contents(plan, contents, headers, recordings)
+            # run the steps that take every content at once: the batched steps, and the async steps awaited concurrently
+            if self.awaits_contents(plan):
+                outcomes = async_detectors.run(self.gather_async_steps(plan, contents, headers))
+            else:
+                outcomes = [{} for _ in contents]
+            return self.run_prepared_contents(plan, contents, headers, outcomes, recordings)
+
+    def awaits_contents(self, plan: DetectorPlan) -> bool:
+        return any(step.is_async for step in plan.steps)
+
+    async def run_plan_contents_async(
+        self, plan: DetectorPlan, contents: List[str], headers: dict, recordings: Optional[list] = None,
+    ) -> List[List[ContentAnalysisResponse]]:
+        """Await the async steps on the running event loop, without holding a thread, then run the others in a thread"""
+        if not self.awaits_contents(plan):
+            return await super().run_plan_contents_async(plan, contents, headers, recordings)
+        with self.serving():
+            outcomes = await self.gather_async_steps(plan, contents, headers)
+            return await run_in_threadpool(self.run_prepared_contents, plan, contents, headers, outcomes, recordings)
+
+    def run_prepared_contents(
+        self, plan: DetectorPlan, contents: List[str], headers: dict, outcomes: List[Dict[int, tuple]], recordings: Optional[list] = None,
+    ) -> List[List[ContentAnalysisResponse]]:
+        """Run the sync batched steps on every content at once, then report all steps content by content, in order"""
+        for index, step in enumerate(plan.steps):
+            if step.is_batched and not step.is_async:
+                for content_outcomes, outcome in zip(outcomes, self.run_batch_step(step, contents, headers)):
+                    content_outcomes[index] = outcome
+        results = []
+        for index, content in enumerate(contents):
+            with self.record_content(recordings, index):
+                results.append(self.run_steps(plan, content, headers, outcomes[index]))
+        return results
+
+    @staticmethod
+    async def gather_async_steps(plan: DetectorPlan, contents: List[str], headers: dict) -> List[Dict[int, tuple]]:
+        """
+        Await every async step on every content at once, and batched async steps on all contents in one call,
+        returning the outcomes of each content by step index
+        """
+        calls, awaitables = [], []
+        for index, step in enumerate(plan.steps):
+            if not step.is_async:
+                continue
+            if step.is_batched:
+                calls.append((index, None))
+                awaitables.append(timed_await(step.function(contents, headers)))
+            else:
+                for position, content in enumerate(contents):
+                    calls.append((index, position))
+                    awaitables.append(timed_await(step.function(content, headers)))
+        outcomes = [{} for _ in contents]
+        for (index, position), outcome in zip(calls, await asyncio.gather(*awaitables)):
+            if position is None:
+                for content_outcomes, content_outcome in zip(outcomes, split_batch_outcome(outcome, len(contents))):
+                    content_outcomes[index] = content_outcome
+            else:
+                outcomes[position][index] = outcome
+        return outcomes
+
+    @staticmethod
+    def run_batch_step(step: "CustomDetectorStep", contents: List[str], headers: dict) -> List[tuple]:
+        """Run a batched step on every content in one call, returning the outcome of each content"""
+        start_time = time.time()
+        try:
+            responses, error = step.function(contents, headers), None
+        except Exception as e:
+            responses, error = [None] * len(contents), e
+        return split_batch_outcome((responses, error, time.time() - start_time), len(contents))
+
+    def run_steps(self, plan: DetectorPlan, content: str, headers: dict, outcomes: Optional[Dict[int, tuple]] = None) -> List[ContentAnalysisResponse]:
+        detections = []
+        for index, step in enumerate(plan.steps):
+            try:
+                if step.is_async or step.is_batched:
+                    result, error, runtime = outcomes[index]
+                    if self.instruments.get("runtime"):
+                        self.instruments["runtime"].labels(self.registry_name, step.name).inc(runtime)
+                    if error is not None:
+                        raise error
+                else:
+                    with self.instrument_runtime(step.name):
+                        result = step.function(content, headers)
+                is_detection = result is not None
+                self.increment_detector_instruments(step.name, is_detection)
+                if is_detection:
+                    detections.append(result)
+            except Exception as e:
+                self.throw_internal_detector_error(step.name, logger, e, increment_requests=True)
         return detections
+
+
+def split_batch_outcome(outcome: tuple, count: int) -> List[tuple]:
+    """Split the (responses, error, runtime) outcome of a batched call into one outcome per content, sharing its runtime"""
+    responses, error, runtime = outcome
+    if error is not None:
+        responses = [None] * count
+    return [(response, error, runtime / count) for response in responses]
+
+
+@dataclass(frozen=True)
+class CustomDetectorStep(DetectorStep):
+    """A custom function of a plan, whose `function(content, headers)` is its compiled adapter"""
+    needs_headers: bool = False
+    func_kwargs: Optional[dict] = None
+    is_async: bool = False
+    is_batched: bool = False
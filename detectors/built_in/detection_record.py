@@ -0,0 +1,55 @@
+from typing import Union
+
+from detectors.common.scheme import ContentAnalysisResponse
+
+
+class DetectionRecord:
+    """
+    A compact detection, emitted by the built-in detectors that can produce many matches per content. Building a
+    pydantic model per match costs more than finding it, so records are only converted to the `ContentAnalysisResponse`
+    schema once, when the response is serialized.
+    """
+    __slots__ = ("start", "end", "text", "detection", "detection_type", "score")
+
+    def __init__(self, start: int, end: int, text: str, detection: str, detection_type: str, score: float = 1.0):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.detection = detection
+        self.detection_type = detection_type
+        self.score = score
+
+    def to_dict(self) -> dict:
+        """The record in the JSON form of a `ContentAnalysisResponse`"""
+        return {
+            "start": self.start,
+            "end": self.end,
+            "text": self.text,
+            "detection": self.detection,
+            "detection_type": self.detection_type,
+            "score": self.score,
+            "evidences": None,
+            "metadata": {},
+        }
+
+    def to_response(self) -> ContentAnalysisResponse:
+        return ContentAnalysisResponse(**self.to_dict())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, DetectionRecord):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__)
+        return f"DetectionRecord({fields})"
+
+
+Detection = Union[ContentAnalysisResponse, DetectionRecord]
+
+
+def serialize_detection(detection: Detection) -> dict:
+    """Convert a detection to the JSON form of a `ContentAnalysisResponse`"""
+    if isinstance(detection, DetectionRecord):
+        return detection.to_dict()
+    return detection.model_dump(mode="json")
@@ -0,0 +1,347 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from base_detector_registry import BaseDetectorRegistry, DetectorPlan
+from config import get_bool_env, get_int_env
+from detection_record import Detection
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_MODES = ("serial", "thread", "process")
+
+# (instrument name, labels, method, value): an update of a prometheus instrument made inside a worker process
+InstrumentCall = Tuple[str, tuple, str, float]
+
+
+class RecordingInstrument:
+    """Stands in for a prometheus instrument inside a worker process, recording its updates for the server process"""
+    def __init__(self, name: str, calls: List[InstrumentCall]):
+        self.name = name
+        self.calls = calls
+
+    def labels(self, *labels):
+        return RecordingInstrumentChild(self, labels)
+
+
+class RecordingInstrumentChild:
+    def __init__(self, parent: RecordingInstrument, labels: tuple):
+        self.parent = parent
+        self.labels = labels
+
+    def inc(self, amount: float = 1):
+        self.parent.calls.append((self.parent.name, self.labels, "inc", amount))
+
+    def set(self, value: float):
+        self.parent.calls.append((self.parent.name, self.labels, "set", value))
+
+
+# the registries of a worker process, built by _init_worker
+_worker_registries: Dict[str, BaseDetectorRegistry] = {}
+_worker_instrument_calls: List[InstrumentCall] = []
+
+
+def _init_worker(registry_classes: Dict[str, type], instrument_names: Sequence[str]):
+    instruments = {name: RecordingInstrument(name, _worker_instrument_calls) for name in instrument_names}
+    for registry_name, registry_class in registry_classes.items():
+        registry = registry_class()
+        registry.set_instruments(instruments)
+        registry.start(in_worker=True)
+        _worker_registries[registry_name] = registry
+
+
+def _run_in_worker(registry_name: str, params, contents: List[str], headers: dict):
+    """
+    Run one registry on the contents, returning its outcome together with the instrument updates it made, and the
+    detector instrument updates of each content
+    """
+    registry = _worker_registries[registry_name]
+    _worker_instrument_calls.clear()
+    detector_calls = [None] * len(contents)
+    try:
+        # the worker compiles (and caches) its own plan, as plans hold functions that cannot be pickled
+        plan = registry.get_plan({registry_name: params})
+        # HTTPExceptions cannot be pickled, so they are sent back as their status code and detail
+        outcome = ("ok", registry.run_plan_contents(plan, contents, headers, detector_calls))
+    except HTTPException as e:
+        outcome = ("http_error", (e.status_code, e.detail))
+    except Exception as e:
+        outcome = ("error", repr(e))
+    return outcome, list(_worker_instrument_calls), detector_calls
+
+
+def can_run_in_worker(registry: BaseDetectorRegistry) -> bool:
+    """Worker processes import registry classes by name, so classes defined inside functions run in the server process"""
+    return "<locals>" not in type(registry).__qualname__
+
+
+class ProcessRegistryProxy:
+    """
+    Stands in for a registry of the server process, running its plans in a worker process. Everything else, e.g. the
+    recording of its instruments, is served by the local registry.
+    """
+    def __init__(self, registry: BaseDetectorRegistry, pool: ProcessPoolExecutor):
+        self.registry = registry
+        self.pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self.registry, name)
+
+    def run_plan(self, plan: DetectorPlan, content: str, headers: dict) -> List[Detection]:
+        return self.run_plan_contents(plan, [content], headers)[0]
+
+    def run_plan_contents(
+        self, plan: DetectorPlan, contents: List[str], headers: dict, recordings: Optional[list] = None,
+    ) -> List[List[Detection]]:
+        future = self.pool.submit(_run_in_worker, self.registry.registry_name, plan.params, contents, headers)
+        (status, result), instrument_calls, detector_calls = future.result()
+        for name, labels, method, value in instrument_calls:
+            if self.registry.instruments.get(name):
+                getattr(self.registry.instruments[name].labels(*labels), method)(value)
+        if status == "http_error":
+            raise HTTPException(status_code=result[0], detail=result[1])
+        if status == "error":
+            raise RuntimeError(f"Detector {self.registry.registry_name} failed in a worker process: {result}")
+        for index, calls in enumerate(detector_calls):
+            with self.registry.record_content(recordings, index):
+                self.registry.add_recorded_detector_instruments(calls)
+        return result
+
+
+class DetectorExecutor:
+    """
+    Runs the registries of a detection request, either one after another (`serial`) or fanned out over a bounded pool
+    of `thread`s or `process`es, so that a slow registry does not hold up the others. With `fan_out_contents`, the
+    contents of a request are fanned out as well; otherwise they are still processed one at a time. Detections are
+    always reassembled in request order, and when several registries fail, the error of the first one is raised. On the
+    server's event loop, `run_async` awaits the registries whose plans await I/O on the loop instead.
+
+    Worker processes build their own registries, from the classes of the server's registries and their default
+    configuration. The instrument updates they make are replayed on the server's instruments. Registries that are not
+    registered with the server, or whose class cannot be imported by name, run in a thread of the server process.
+    """
+    def __init__(self, mode: str = "serial", workers: int = 0, fan_out_contents: bool = False):
+        if mode not in EXECUTION_MODES:
+            logger.warning(f"Unknown detector execution mode {mode}, defaulting to serial. Available modes: {list(EXECUTION_MODES)}")
+            mode = "serial"
+        self.mode = mode
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.fan_out_contents = fan_out_contents
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._process_registries: Optional[Dict[str, type]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "DetectorExecutor":
+        return cls(
+            mode=os.environ.get("DETECTOR_EXECUTION_MODE", "serial").strip().lower(),
+            workers=get_int_env("DETECTOR_EXECUTION_WORKERS", 0),
+            fan_out_contents=get_bool_env("DETECTOR_EXECUTION_FAN_OUT_CONTENTS", False),
+        )
+
+    def get_threads(self) -> ThreadPoolExecutor:
+        """The thread pool that runs the registries, or in process mode waits on the worker processes"""
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="detector")
+            return self._threads
+
+    def get_processes(self, registries: Dict[str, BaseDetectorRegistry], instrument_names: Sequence[str]) -> ProcessPoolExecutor:
+        # worker processes hold copies of the registries, so the pool is rebuilt whenever the registries change
+        registry_classes = {name: type(registry) for name, registry in registries.items() if can_run_in_worker(registry)}
+        with self._lock:
+            if self._processes is None or self._process_registries != registry_classes:
+                if self._processes is not None:
+                    self._processes.shutdown(wait=False, cancel_futures=True)
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(registry_classes, list(instrument_names)),
+                )
+                self._process_registries = registry_classes
+            return self._processes
+
+    def discard_processes(self, processes: ProcessPoolExecutor):
+        with self._lock:
+            if self._processes is processes:
+                self._processes, self._process_registries = None, None
+        processes.shutdown(wait=False, cancel_futures=True)
+
+    def recycle_processes(self):
+        """Replace the worker processes, e.g. after a reload, so that the next request rebuilds their registries"""
+        with self._lock:
+            processes, self._processes, self._process_registries = self._processes, None, None
+        if processes is not None:
+            processes.shutdown(wait=False)
+
+    def run(
+        self,
+        plans: List[Tuple[BaseDetectorRegistry, DetectorPlan]],
+        contents: List[str],
+        headers: dict,
+        run: Callable[[BaseDetectorRegistry, DetectorPlan, List[str], dict], List[List[Detection]]],
+        all_registries: Dict[str, BaseDetectorRegistry],
+        instrument_names: Sequence[str],
+    ) -> List[List[Detection]]:
+        """
+        Run every (registry, plan) pair on the contents with `run(registry, plan, contents, headers)`, which returns the
+        detections of each of the contents it is given
+        """
+        return self.merge(self.run_registries(plans, contents, headers, run, all_registries, instrument_names), len(contents))
+
+    async def run_async(
+        self,
+        plans: List[Tuple[BaseDetectorRegistry, DetectorPlan]],
+        contents: List[str],
+        headers: dict,
+        run: Callable[[BaseDetectorRegistry, DetectorPlan, List[str], dict], List[List[Detection]]],
+        run_async: Callable[[BaseDetectorRegistry, DetectorPlan, List[str], dict], Awaitable[List[List[Detection]]]],
+        all_registries: Dict[str, BaseDetectorRegistry],
+        instrument_names: Sequence[str],
+    ) -> List[List[Detection]]:
+        """
+        `run` for the server's event loop. The registries whose plans await I/O, see `BaseDetectorRegistry.awaits_contents`,
+        are awaited on the loop with `run_async(registry, plan, contents, headers)`, also in process mode, rather than
+        holding a thread while they wait. The others run in threads, as with `run`.
+        """
+        awaited = [registry.awaits_contents(plan) for registry, plan in plans]
+        if not any(awaited):
+            return await run_in_threadpool(self.run, plans, contents, headers, run, all_registries, instrument_names)
+        if self.mode == "serial" or len(plans) == 1:
+            registry_results = []
+            for (registry, plan), is_awaited in zip(plans, awaited):
+                if is_awaited:
+                    registry_results.append(await run_async(registry, plan, contents, headers))
+                else:
+                    registry_results.append(await run_in_threadpool(run, registry, plan, contents, headers))
+            return self.merge(registry_results, len(contents))
+
+        # the other registries fan out over the pools while the awaited ones wait on the loop
+        others = [pair for pair, is_awaited in zip(plans, awaited) if not is_awaited]
+        other_outcomes, *awaited_outcomes = await asyncio.gather(
+            run_in_threadpool(self.run_registries, others, contents, headers, run, all_registries, instrument_names, True),
+            *[run_async(registry, plan, contents, headers) for (registry, plan), is_awaited in zip(plans, awaited) if is_awaited],
+            return_exceptions=True,
+        )
+        if isinstance(other_outcomes, BaseException):
+            raise other_outcomes
+        other_outcomes, awaited_outcomes = iter(other_outcomes), iter(awaited_outcomes)
+        registry_results = [next(awaited_outcomes) if is_awaited else next(other_outcomes) for is_awaited in awaited]
+        # like `run`, raise the error of the first failed registry
+        for outcome in registry_results:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return self.merge(registry_results, len(contents))
+
+    def run_registries(
+        self,
+        plans: List[Tuple[BaseDetectorRegistry, DetectorPlan]],
+        contents: List[str],
+        headers: dict,
+        run: Callable[[BaseDetectorRegistry, DetectorPlan, List[str], dict], List[List[Detection]]],
+        all_registries: Dict[str, BaseDetectorRegistry],
+        instrument_names: Sequence[str],
+        return_exceptions: bool = False,
+    ) -> list:
+        """
+        The detections of each content for each (registry, plan) pair, see `run`. With `return_exceptions`, every
+        registry runs, and the error of a failed one is returned in place of its detections rather than raised.
+        """
+        fan_out = len(plans) > 1 or (self.fan_out_contents and len(contents) > 1)
+        if self.mode == "serial" or not fan_out:
+            registry_results = []
+            for registry, plan in plans:
+                try:
+                    registry_results.append(run(registry, plan, contents, headers))
+                except Exception as e:
+                    if not return_exceptions:
+                        raise e
+                    registry_results.append(e)
+            return registry_results
+
+        processes = None
+        if self.mode == "process":
+            processes = self.get_processes(all_registries, instrument_names)
+            # `run` (e.g. the result cache) still wraps each registry in this process, around the remote call
+            plans = [
+                (ProcessRegistryProxy(registry, processes), plan)
+                if all_registries.get(registry.registry_name) is registry and can_run_in_worker(registry) else (registry, plan)
+                for registry, plan in plans
+            ]
+        threads = self.get_threads()
+        submit = lambda registry, plan, contents: threads.submit(run, registry, plan, contents, headers)
+
+        # the contents that each task of a registry runs: all of them, or with `fan_out_contents` one per task, unless
+        # the registry runs contents together anyway
+        batches = [
+            [[content] for content in contents]
+            if self.fan_out_contents and not registry.runs_contents_together(plan) else [contents]
+            for registry, plan in plans
+        ]
+        futures = [
+            [submit(registry, plan, batch) for batch in registry_batches]
+            for (registry, plan), registry_batches in zip(plans, batches)
+        ]
+        if return_exceptions:
+            registry_results = []
+            for registry_futures in futures:
+                errors = [future.exception() for future in registry_futures if future.exception() is not None]
+                if errors:
+                    registry_results.append(self.get_detection_error(errors[0], processes))
+                else:
+                    registry_results.append([detections for future in registry_futures for detections in future.result()])
+            return registry_results
+        try:
+            results = self.collect([future for registry_futures in futures for future in registry_futures])
+        except BrokenProcessPool as e:
+            raise self.get_detection_error(e, processes)
+        results = iter(results)
+        return [[detections for _ in registry_futures for detections in next(results)] for registry_futures in futures]
+
+    def get_detection_error(self, error: Exception, processes: Optional[ProcessPoolExecutor]) -> Exception:
+        """The error to report for a failed registry: a broken pool of worker processes is discarded, and reported as a 500"""
+        if not isinstance(error, BrokenProcessPool):
+            return error
+        self.discard_processes(processes)
+        http_error = HTTPException(status_code=500, detail="Detection error, check detector logs")
+        http_error.__cause__ = error
+        return http_error
+
+    @staticmethod
+    def collect(futures: List[Future]) -> list:
+        """Wait for the results of the futures in order, raising the error of the first failed one"""
+        results = []
+        for future in futures:
+            exception = future.exception()
+            if exception is not None:
+                for other in futures:
+                    other.cancel()
+                raise exception
+            results.append(future.result())
+        return results
+
+    @staticmethod
+    def merge(registry_results: List[List[List[Detection]]], content_count: int) -> List[List[Detection]]:
+        """Concatenate the detections of each content over the registries, in request order"""
+        return [
+            [detection for content_results in registry_results for detection in content_results[index]]
+            for index in range(content_count)
+        ]
+
+    def shutdown(self):
+        with self._lock:
+            threads, processes = self._threads, self._processes
+            self._threads, self._processes, self._process_registries = None, None, None
+        for pool in (threads, processes):
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,132 @@
+import json
+import logging
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import yaml
+
+from config import get_bool_env
+from streaming_validators import STREAMING_CHECKS, STREAMING_THRESHOLD, StreamError, utf8_length
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def load_json_stdlib(text: str) -> Any:
+    return json.loads(text)
+
+
+# orjson reads integers beyond 64 bits as floats, so documents that may hold one are left to the standard library
+LONG_NUMBER_PATTERN = re.compile(r"\d{19}")
+
+
+def load_json_fast(text: str) -> Any:
+    """
+    Parse JSON with orjson, falling back to the standard library for anything orjson refuses. orjson is stricter than
+    `json` (no NaN or Infinity, no lone surrogates, a nesting limit): the fallback keeps the set of valid documents,
+    and their values, exactly those of `json.loads`.
+    """
+    if LONG_NUMBER_PATTERN.search(text):
+        return json.loads(text)
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
+
+
+def load_yaml_stdlib(text: str) -> Any:
+    return yaml.safe_load(text)
+
+
+def load_yaml_fast(text: str) -> Any:
+    """
+    Parse YAML with the libyaml-backed loader, falling back to the pure-Python loader for anything it refuses. libyaml
+    is more lenient than `yaml.safe_load`, e.g. about tabs (`a:\t1`) and byte order marks within the document, so it
+    accepts some documents that the pure-Python loader refuses: unlike the JSON fast path, this changes the verdicts.
+    """
+    try:
+        return yaml.load(text, Loader=yaml.CSafeLoader)
+    except Exception:
+        return yaml.safe_load(text)
+
+
+def load_xml(text: str) -> ET.Element:
+    return ET.fromstring(text)
+
+
+def get_parsers(fast: bool) -> Dict[str, Tuple[Callable[[str], Any], Tuple[type, ...]]]:
+    """
+    The parser of each format, with the exceptions that mean that the content is not valid in that format. Other
+    exceptions are errors of the detector.
+    """
+    load_json, load_yaml = load_json_stdlib, load_yaml_stdlib
+    if fast:
+        if orjson is not None:
+            load_json = load_json_fast
+        else:
+            logger.info("orjson is not installed, parsing JSON with the standard library")
+        if getattr(yaml, "__with_libyaml__", False):
+            load_yaml = load_yaml_fast
+        else:
+            logger.info("PyYAML is built without libyaml, parsing YAML with the pure-Python loader")
+    return {
+        "json": (load_json, (ValueError, TypeError)),
+        "yaml": (load_yaml, (Exception,)),
+        "xml": (load_xml, (Exception,)),
+    }
+
+
+# off by default, since the fast YAML loader does not refuse exactly the documents that `yaml.safe_load` refuses
+PARSERS = get_parsers(fast=get_bool_env("FILE_TYPE_FAST_PARSERS", False))
+
+# stands for the parse result of a content that is not valid in a format
+INVALID = object()
+
+
+class ParsedContent:
+    """
+    The text contents of one request, parsed at most once per format: every file type check of the content (e.g.
+    `json` and `json-with-schema:...`) shares the same parse. Large contents can also be checked by streaming over
+    them, which is likewise done at most once per format.
+    """
+    __slots__ = ("text", "_parsed", "_streamed", "_size")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._parsed: Dict[str, Any] = {}
+        self._streamed: Dict[str, Optional[StreamError]] = {}
+        self._size: Optional[int] = None
+
+    @property
+    def size(self) -> int:
+        """The size of the contents in UTF-8 bytes"""
+        if self._size is None:
+            self._size = utf8_length(self.text)
+        return self._size
+
+    def is_large(self) -> bool:
+        """Whether the validity of the contents is checked by streaming over them, see `FILE_TYPE_STREAMING_THRESHOLD`"""
+        return 0 < STREAMING_THRESHOLD <= self.size
+
+    def stream(self, file_type: str) -> Optional[StreamError]:
+        """Check the contents without building their object tree, returning the first error or None"""
+        if file_type not in self._streamed:
+            self._streamed[file_type] = STREAMING_CHECKS[file_type](self.text)
+        return self._streamed[file_type]
+
+    def parse(self, file_type: str) -> Any:
+        """Return the parsed content, or `INVALID` if the content is not valid in that format"""
+        parsed = self._parsed.get(file_type)
+        if parsed is None and file_type not in self._parsed:
+            parse, invalid_errors = PARSERS[file_type]
+            try:
+                parsed = parse(self.text)
+            except invalid_errors:
+                parsed = INVALID
+            self._parsed[file_type] = parsed
+        return parsed
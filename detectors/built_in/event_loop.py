@@ -0,0 +1,69 @@
+import asyncio
+import threading
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop of its own, running in a daemon thread. Request threads hand it coroutines and block until
+    they are done, so the coroutines of every request of this process share one loop and wait on their I/O
+    concurrently, whichever thread or executor mode the request runs in.
+
+    Inside a server, the loop can instead be the server's own (see `attach`), so that the coroutines awaited by the
+    requests themselves and those handed over by threads share it.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._attached: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Run the coroutines on `loop`, e.g. the server's, until `stop`. `run` must then be called from other threads."""
+        self.stop()
+        with self._lock:
+            self._attached = loop
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._attached is not None:
+                return self._attached
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name=self.name, daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+            return self._loop
+
+    def run(self, coroutine: Awaitable[T]) -> T:
+        """Await the coroutine on the loop, blocking the calling thread until it is done"""
+        loop = self.get_loop()
+        if is_running_in(loop):
+            coroutine.close()
+            raise RuntimeError(f"{self.name} cannot block the thread of its own event loop, await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    def stop(self):
+        """
+        Stop the loop, e.g. on shutdown once the requests are done, or detach from an attached loop, which keeps
+        running. A loop of its own is started again on the next `run`.
+        """
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread, self._attached = None, None, None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def is_running_in(loop: asyncio.AbstractEventLoop) -> bool:
+    """Whether the calling thread is the one running `loop`"""
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
@@ -1,49 +1,108 @@
+import functools
 import json
 import logging
+import os
+import time
 
 from fastapi import HTTPException
 
 import jsonschema
 import xml.etree.ElementTree as ET
 import xmlschema
-import yaml
 
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 
-from base_detector_registry import BaseDetectorRegistry
+from base_detector_registry import BaseDetectorRegistry, DetectorPlan, DetectorStep
+from config import get_int_env
 from detectors.common.scheme import ContentAnalysisResponse
+from document_parsers import INVALID, ParsedContent
+from schema_cache import CompiledSchemaCache
 
 logger = logging.getLogger(__name__)
 
-def is_valid_json(s: str) -> Optional[ContentAnalysisResponse]:
-    """Detect if the text contents is not valid JSON"""
+DEFAULT_SCHEMAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas")
+
+# marks schemas that cannot be compiled, so that they are reported as such without being parsed again
+INVALID_SCHEMA = object()
+
+
+def compile_json_schema(schema: str):
+    """
+    Build a validator for a JSON schema, exactly as `jsonschema.validate` would: the validator class is picked by the
+    schema's `$schema`, and the schema is checked against its metaschema, raising a `SchemaError` if it is invalid.
+    """
     try:
-        json.loads(s)
-        return None
+        schema_data = json.loads(schema)
     except (ValueError, TypeError):
-        return ContentAnalysisResponse(
-            start=0,
-            end=len(s),
-            text=s,
-            detection="invalid_json",
-            detection_type= "file_type",
-            score=1.0
-        )
+        return INVALID_SCHEMA
+    validator_class = jsonschema.validators.validator_for(schema_data)
+    validator_class.check_schema(schema_data)
+    return validator_class(schema_data)
+
 
+# structured-output guardrails send the same few schemas over and over, so keep their validators around
+json_schema_cache = CompiledSchemaCache("json_schemas", compile_json_schema, maxsize=get_int_env("SCHEMA_CACHE_SIZE", 128))
 
-def is_valid_json_schema(s: str, schema: str) -> Optional[ContentAnalysisResponse]:
+
+def as_parsed(s: Union[str, ParsedContent]) -> ParsedContent:
+    """The file type checks accept the text contents, or contents already shared with the other checks of a request"""
+    return s if isinstance(s, ParsedContent) else ParsedContent(s)
+
+
+def check_document(document: ParsedContent, file_type: str) -> Optional[ContentAnalysisResponse]:
+    """
+    Detect if the contents is not valid in a format. Large contents are streamed over rather than parsed, and their
+    detection spans the first error, with its byte offset and reason in the metadata.
+    """
+    if not document.is_large():
+        return check_parsed(document, file_type)
+    error = document.stream(file_type)
+    if error is None:
+        return None
+    end = min(error.position + 1, len(document.text))
+    return ContentAnalysisResponse(
+        start=error.position,
+        end=end,
+        text=document.text[error.position:end],
+        detection=f"invalid_{file_type}",
+        detection_type="file_type",
+        score=1.0,
+        metadata={"byte_offset": error.byte_offset, "reason": error.reason},
+    )
+
+
+def check_parsed(document: ParsedContent, file_type: str) -> Optional[ContentAnalysisResponse]:
+    """Detect if the contents cannot be parsed in a format, as the schema checks need the parsed contents anyway"""
+    if document.parse(file_type) is not INVALID:
+        return None
+    return ContentAnalysisResponse(
+        start=0,
+        end=len(document.text),
+        text=document.text,
+        detection=f"invalid_{file_type}",
+        detection_type="file_type",
+        score=1.0
+    )
+
+
+def is_valid_json(s: Union[str, ParsedContent]) -> Optional[ContentAnalysisResponse]:
+    """Detect if the text contents is not valid JSON"""
+    return check_document(as_parsed(s), "json")
+
+
+def is_valid_json_schema(s: Union[str, ParsedContent], schema: str) -> Optional[ContentAnalysisResponse]:
     """Detect if the text contents does not satisfy a provided JSON schema. To specify a schema, replace $SCHEMA with a JSON schema."""
-    is_valid = is_valid_json(s)
-    if is_valid is None:
-        msg_data = json.loads(s)
-    else:
+    document = as_parsed(s)
+    is_valid = check_parsed(document, "json")
+    if is_valid is not None:
         return is_valid
+    return validate_json_schema(document.text, document.parse("json"), schema, "json_schema_mismatch")
 
 
-    # validate that the schema is valid json
-    try:
-        schema_data = json.loads(schema)
-    except (ValueError, TypeError):
+def validate_json_schema(s: str, msg_data, schema: str, mismatch_detection: str) -> Optional[ContentAnalysisResponse]:
+    """Validate the parsed text contents against a JSON schema, with a cached validator"""
+    validator = json_schema_cache.get(schema)
+    if validator is INVALID_SCHEMA:
         return ContentAnalysisResponse(
             start=0,
             end=len(schema),
@@ -52,109 +111,76 @@ def is_valid_json_schema(s: str, schema: str) -> Optional[ContentAnalysisRespons
             detection_type="file_type",
             score=1.0
         )
+    return check_json_validator(s, msg_data, validator, mismatch_detection)
+
 
+def check_json_validator(s: str, msg_data, validator, mismatch_detection: str) -> Optional[ContentAnalysisResponse]:
     # validate the schema against the message
-    try:
-        jsonschema.validate(instance=msg_data, schema=schema_data)
+    if validator.is_valid(msg_data):
         return None
-    except jsonschema.ValidationError as e:
-        return ContentAnalysisResponse(
-            start=0,
-            end=len(s),
-            text=s,
-            detection="json_schema_mismatch",
-            detection_type="file_type",
-            score=1.0
-        )
+    return ContentAnalysisResponse(
+        start=0,
+        end=len(s),
+        text=s,
+        detection=mismatch_detection,
+        detection_type="file_type",
+        score=1.0
+    )
 
 
-def is_valid_yaml(s: str) -> Optional[ContentAnalysisResponse]:
+def is_valid_yaml(s: Union[str, ParsedContent]) -> Optional[ContentAnalysisResponse]:
     """Detect if the text contents is not valid YAML"""
-    try:
-        yaml.safe_load(s)
-        return None
-    except Exception:
-        return ContentAnalysisResponse(
-            start=0,
-            end=len(s),
-            text=s,
-            detection="invalid_yaml",
-            detection_type="file_type",
-            score=1.0,
-        )
+    return check_document(as_parsed(s), "yaml")
 
-def is_valid_yaml_schema(s: str, schema) -> Optional[ContentAnalysisResponse]:
+def is_valid_yaml_schema(s: Union[str, ParsedContent], schema) -> Optional[ContentAnalysisResponse]:
     """Detect if the text contents does not satisfy a provided schema. To specify a schema, replace $SCHEMA with a JSON schema. That's not a typo, you validate YAML with a JSON schema!"""
-    is_valid = is_valid_yaml(s)
-    if is_valid is None:
-        msg_data = yaml.safe_load(s)
-    else:
+    document = as_parsed(s)
+    is_valid = check_parsed(document, "yaml")
+    if is_valid is not None:
         return is_valid
+    return validate_json_schema(document.text, document.parse("yaml"), schema, "yaml_schema_mismatch")
 
-    # validate that the schema is valid json
-    try:
-        schema_data = json.loads(schema)
-    except (ValueError, TypeError):
-        return ContentAnalysisResponse(
-            start=0,
-            end=len(schema),
-            text=s,
-            detection="invalid_schema",
-            detection_type="file_type",
-            score=1.0
-        )
 
-    # validate the schema against the message
-    try:
-        jsonschema.validate(instance=msg_data, schema=schema_data)
-        return None
-    except jsonschema.ValidationError as e:
-        return ContentAnalysisResponse(
-            start=0,
-            end=len(s),
-            text=s,
-            detection="yaml_schema_mismatch",
-            detection_type="file_type",
-            score=1.0
-        )
+def is_valid_xml(s: Union[str, ParsedContent]) -> Optional[ContentAnalysisResponse]:
+    """Detect if the text contents is not valid XML"""
+    return check_document(as_parsed(s), "xml")
 
 
-def is_valid_xml(s: str) -> Optional[ContentAnalysisResponse]:
-    """Detect if the text contents is not valid XML"""
+def compile_xml_schema(schema: str):
+    """Compile an XSD, which takes far longer than validating a document against it"""
     try:
-        ET.fromstring(s)
-        return None
+        # schema is expected to be a string containing the XSD
+        return xmlschema.XMLSchema(schema)
     except Exception:
-        return ContentAnalysisResponse(
-            start=0,
-            end=len(s),
-            text=s,
-            detection="invalid_xml",
-            detection_type="file_type",
-            score=1.0,
-        )
+        return INVALID_SCHEMA
+
 
+xml_schema_cache = CompiledSchemaCache("xml_schemas", compile_xml_schema, maxsize=get_int_env("SCHEMA_CACHE_SIZE", 128))
 
-def is_valid_xml_schema(s: str, schema) -> Optional[ContentAnalysisResponse]:
+
+def is_valid_xml_schema(s: Union[str, ParsedContent], schema) -> Optional[ContentAnalysisResponse]:
     """Detect if the text contents does not satisfy a provided XML schema. To specify a schema, replace $SCHEMA with an XML Schema Definition (XSD)"""
-    is_valid = is_valid_xml(s)
+    document = as_parsed(s)
+    is_valid = check_parsed(document, "xml")
     if is_valid is not None:
         return is_valid
-    try:
-        # schema is expected to be a string containing the XSD
-        xs = xmlschema.XMLSchema(schema)
-    except Exception:
+    xs = xml_schema_cache.get(schema)
+    if xs is INVALID_SCHEMA:
         return ContentAnalysisResponse(
             start=0,
             end=len(schema),
-            text=s,
+            text=document.text,
             detection="invalid_xml_schema",
             detection_type="file_type",
             score=1.0
         )
+    return check_xml_schema(document.text, document.parse("xml"), xs)
 
+
+def check_xml_schema(s: str, root: ET.Element, xs: xmlschema.XMLSchema) -> Optional[ContentAnalysisResponse]:
     try:
-        xs.validate(s)
+        # validate the tree parsed above, rather than letting xmlschema parse the document again
+        xs.validate(root)
         return None
     except xmlschema.XMLSchemaValidationError:
         return ContentAnalysisResponse(
@@ -167,52 +193,151 @@ def is_valid_xml_schema(s: str, schema) -> Optional[ContentAnalysisResponse]:
         )
 
 
+SCHEMA_FUNCTIONS = {
+    "json-with-schema": is_valid_json_schema,
+    "yaml-with-schema": is_valid_yaml_schema,
+    "xml-with-schema": is_valid_xml_schema,
+}
+
+# prefixes of the file types that refer to the named schemas of the schema directory
+SCHEMA_REF_PREFIXES = ("json-with-schema-ref:", "yaml-with-schema-ref:", "xml-with-schema-ref:")
+
+
+class NamedSchema:
+    """A named schema of the schema directory, compiled once and checked against the text contents as one file type"""
+    def __init__(self, name: str, file_type: str, compiled):
+        self.name = name
+        self.file_type = file_type
+        self.compiled = compiled
+        schema_kind = "XML Schema Definition" if file_type == "xml" else "JSON schema"
+        # picked up by the /registry endpoint, like the docstrings of the other file type functions
+        self.__doc__ = f"Detect if the text contents is not valid {file_type.upper()} or does not satisfy the '{name}' {schema_kind}"
+
+    def __call__(self, s: Union[str, ParsedContent]) -> Optional[ContentAnalysisResponse]:
+        document = as_parsed(s)
+        is_valid = check_parsed(document, self.file_type)
+        if is_valid is not None:
+            return is_valid
+        if self.file_type == "xml":
+            return check_xml_schema(document.text, document.parse("xml"), self.compiled)
+        return check_json_validator(document.text, document.parse(self.file_type), self.compiled, f"{self.file_type}_schema_mismatch")
+
+
+def load_named_schemas(directory: str) -> Dict[str, NamedSchema]:
+    """
+    Load and compile every schema of a directory, keyed by their file type reference. Each schema is named after its
+    file: `.json` files hold JSON schemas, usable for both JSON and YAML contents, and `.xsd` files hold XSDs.
+    """
+    schemas = {}
+    if not os.path.isdir(directory):
+        logger.info(f"Schema directory {directory} does not exist, no named schemas loaded")
+        return schemas
+    for file_name in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(file_name)
+        if extension not in (".json", ".xsd"):
+            continue
+        start_time = time.perf_counter()
+        try:
+            with open(os.path.join(directory, file_name), encoding="utf-8") as f:
+                schema = f.read()
+            compiled = compile_json_schema(schema) if extension == ".json" else compile_xml_schema(schema)
+        except Exception as e:
+            logger.error(f"Failed to compile schema {file_name}: {e}")
+            continue
+        if compiled is INVALID_SCHEMA:
+            logger.error(f"Failed to compile schema {file_name}, skipping it")
+            continue
+        file_types = ["json", "yaml"] if extension == ".json" else ["xml"]
+        for file_type in file_types:
+            schemas[f"{file_type}-with-schema-ref:{name}"] = NamedSchema(name, file_type, compiled)
+        logger.info(f"Loaded schema '{name}' from {file_name} in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+    return schemas
+
 
 class FileTypeDetectorRegistry(BaseDetectorRegistry):
-    def __init__(self):
+    def __init__(self, schemas_dir: Optional[str] = None):
         super().__init__("file_type")
-        self.registry = {
+        self.schemas_dir = schemas_dir or os.environ.get("SCHEMAS_DIR", DEFAULT_SCHEMAS_DIR)
+        # bumped on every reload, so that results cached for a previous version of a schema are not served
+        self.schemas_generation = 0
+        self.registry = self.build_registry(load_named_schemas(self.schemas_dir))
+
+    @staticmethod
+    def build_registry(schemas: Dict[str, NamedSchema]) -> dict:
+        return {
             "json": is_valid_json,
             "xml": is_valid_xml,
             "yaml": is_valid_yaml,
             "json-with-schema:$SCHEMA": is_valid_json_schema,
             "xml-with-schema:$SCHEMA": is_valid_xml_schema,
             "yaml-with-schema:$SCHEMA": is_valid_yaml_schema,
+            **schemas,
         }
 
+    def reload_schemas(self) -> List[str]:
+        """Reload the schema directory, swapping in the new schemas at once. Returns the names of the loaded schemas."""
+        schemas = load_named_schemas(self.schemas_dir)
+        self.registry = self.build_registry(schemas)
+        self.schemas_generation += 1
+        # plans hold the compiled schemas they were built with
+        self.plan_cache.clear()
+        return sorted({schema.name for schema in schemas.values()})
+
+    def get_cache_params(self, detector_params: dict) -> Optional[str]:
+        cache_params = super().get_cache_params(detector_params)
+        return None if cache_params is None else f"{cache_params}@{self.schemas_generation}"
+
+    def set_instruments(self, instruments):
+        super().set_instruments(instruments)
+        json_schema_cache.set_instruments(instruments)
+        xml_schema_cache.set_instruments(instruments)
+
+    def compile_plan(self, detector_params: dict) -> DetectorPlan:
+        steps = []
+        for file_type in self.get_detection_functions_from_params(detector_params):
+            if file_type.startswith(SCHEMA_REF_PREFIXES):
+                if file_type not in self.registry:
+                    raise HTTPException(status_code=400, detail=f"Unrecognized schema reference: {file_type}")
+                # named schemas come from the server's own directory, so they are reported per schema
+                steps.append(DetectorStep(file_type, file_type, self.registry[file_type]))
+                continue
+            # don't publish full schemas to prometheus labels, to limit metric cardinality
+            for prefix, schema_function in SCHEMA_FUNCTIONS.items():
+                if file_type.startswith(prefix):
+                    try:
+                        schema = file_type.split(f"{prefix}:")[1]
+                    except IndexError as e:
+                        self.throw_internal_detector_error(prefix, logger, e, increment_requests=True)
+                    steps.append(DetectorStep(file_type, prefix, functools.partial(schema_function, schema=schema)))
+                    break
+            else:
+                if file_type not in self.registry:
+                    raise HTTPException(status_code=400, detail=f"Unrecognized file type: {file_type}")
+                steps.append(DetectorStep(file_type, file_type, self.registry[file_type]))
+        return DetectorPlan(
+            registry_name=self.registry_name,
+            params=detector_params.get(self.registry_name),
+            steps=tuple(steps),
+            cache_params=self.get_cache_params(detector_params),
+        )
+
     def handle_request(self, content: str, detector_params: dict, headers: dict) -> List[ContentAnalysisResponse]:
+        return self.run_plan(self.get_plan(detector_params), content, headers)
+
+    def run_plan(self, plan: DetectorPlan, content: str, headers: dict) -> List[ContentAnalysisResponse]:
         detections = []
-        for file_type in self.get_detection_functions_from_params(detector_params):
-            file_type_valid, func_name = True, None
+        # every check of the content shares its parse, so that each format is parsed at most once
+        document = ParsedContent(content)
+        for step in plan.steps:
             try:
-                if file_type.startswith("json-with-schema"):
-                    func_name = "json-with-schema"  # don't publish full schema to prometheus labels, to limit metric cardinality
-                    with self.instrument_runtime(func_name):
-                        result = is_valid_json_schema(content, file_type.split("json-with-schema:")[1])
-                elif file_type.startswith("yaml-with-schema"):
-                    func_name = "yaml-with-schema"  # don't publish full schema to prometheus labels, to limit metric cardinality
-                    with self.instrument_runtime(func_name):
-                        result = is_valid_yaml_schema(content, file_type.split("yaml-with-schema:")[1])
-                elif file_type.startswith("xml-with-schema"):
-                    func_name = "xml-with-schema" # as above
-                    with self.instrument_runtime(func_name):
-                        result = is_valid_xml_schema(content, file_type.split("xml-with-schema:")[1])
-                elif file_type in self.registry:
-                    func_name = file_type
-                    with self.instrument_runtime(func_name):
-                        result = self.registry[file_type](content)
-                else:
-                    func_name = "invalid_file_type"
-                    file_type_valid = False
+                with self.instrument_runtime(step.metric_name):
+                    result = step.function(document)
             except Exception as e:
-                self.throw_internal_detector_error(func_name, logger, e, increment_requests=True)
-
-            if not file_type_valid:
-                raise HTTPException(status_code=400, detail=f"Unrecognized file type: {file_type}")
+                self.throw_internal_detector_error(step.metric_name, logger, e, increment_requests=True)
 
             # report results
             is_detection = result is not None
-            self.increment_detector_instruments(func_name, is_detection)
+            self.increment_detector_instruments(step.metric_name, is_detection)
             if is_detection:
                 detections += [result]
         return detections
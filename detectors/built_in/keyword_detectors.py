@@ -0,0 +1,212 @@
+import logging
+import os
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+from fastapi import HTTPException
+
+from base_detector_registry import BaseDetectorRegistry, DetectorPlan, DetectorStep
+from detection_record import DetectionRecord
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEYWORD_LISTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keyword_lists")
+KEYWORD_LIST_EXTENSIONS = (".txt", ".yaml", ".yml")
+
+
+def fold_case(text: str) -> str:
+    """Lowercase a string without changing its length, so that offsets into the folded string are valid in the original"""
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    # a handful of characters (e.g. "İ") lowercase to several characters, leave those untouched
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def is_word_char(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+class AhoCorasickAutomaton:
+    """
+    A pure-Python Aho-Corasick automaton over a fixed set of terms.
+
+    The automaton is built once, in O(total term length). Scanning a string then takes a single pass over its
+    characters, O(n + matches), regardless of how many terms there are. Every occurrence of every term is reported,
+    including overlapping ones.
+    """
+    def __init__(self, terms: List[str]):
+        self.terms = []
+        # node 0 is the root. goto[node] maps a character to the next node, fail[node] is the node of the longest proper
+        # suffix of the node's path that is also a path in the trie, and output[node] lists the indices of the terms
+        # ending at the node (including those inherited through its fail links)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Tuple[int, ...]] = [()]
+
+        seen = set()
+        for term in terms:
+            if not term or term in seen:
+                continue
+            seen.add(term)
+            self.add_term(term)
+        self.build_fail_links()
+
+    def add_term(self, term: str):
+        node = 0
+        for c in term:
+            next_node = self.goto[node].get(c)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][c] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            node = next_node
+        self.output[node] += (len(self.terms),)
+        self.terms.append(term)
+
+    def build_fail_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and c not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(c, 0)
+                self.output[child] += self.output[self.fail[child]]
+
+    def iter_matches(self, text: str):
+        """Yield (start, end, term index) for every occurrence of every term in the text"""
+        goto, fail, output, terms = self.goto, self.fail, self.output, self.terms
+        node = 0
+        for i, c in enumerate(text):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            for term_index in output[node]:
+                yield i + 1 - len(terms[term_index]), i + 1, term_index
+
+    def __len__(self):
+        return len(self.terms)
+
+
+class KeywordList:
+    """A named list of keywords, compiled into an Aho-Corasick automaton"""
+    def __init__(self, name: str, terms: List[str], case_sensitive: bool = False, word_boundaries: bool = True):
+        self.name = name
+        self.case_sensitive = case_sensitive
+        self.word_boundaries = word_boundaries
+        self.automaton = AhoCorasickAutomaton([term if case_sensitive else fold_case(term) for term in terms])
+        # picked up by the /registry endpoint, like the docstrings of the other registries' detector functions
+        self.__doc__ = f"Detect any of the {len(self.automaton)} terms of the '{name}' keyword list in the text contents"
+
+    def is_on_word_boundaries(self, text: str, start: int, end: int) -> bool:
+        """Check that a match is not part of a longer word, following the semantics of a regex `\\b`"""
+        if is_word_char(text[start]) and start > 0 and is_word_char(text[start - 1]):
+            return False
+        if is_word_char(text[end - 1]) and end < len(text) and is_word_char(text[end]):
+            return False
+        return True
+
+    def __call__(self, text: str) -> List[DetectionRecord]:
+        haystack = text if self.case_sensitive else fold_case(text)
+        detections = []
+        for start, end, _ in self.automaton.iter_matches(haystack):
+            if self.word_boundaries and not self.is_on_word_boundaries(haystack, start, end):
+                continue
+            detections.append(
+                DetectionRecord(
+                    start=start,
+                    end=end,
+                    text=text[start:end],
+                    detection=self.name,
+                    detection_type="keyword",
+                    score=1.0,
+                )
+            )
+        # the automaton reports matches by their end offset, report them in reading order instead
+        detections.sort(key=lambda d: (d.start, d.end))
+        return detections
+
+
+def load_keyword_list(path: str) -> Optional[KeywordList]:
+    """
+    Load a keyword list file. The list is named after the file. `.txt` files contain one term per line, with blank lines
+    and lines starting with `#` ignored. `.yaml` files contain a `terms` list and optionally the `case_sensitive`
+    (default false) and `word_boundaries` (default true) options.
+    """
+    name, extension = os.path.splitext(os.path.basename(path))
+    with open(path, encoding="utf-8") as f:
+        if extension == ".txt":
+            terms = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+            return KeywordList(name, terms)
+        config = yaml.safe_load(f) or {}
+    if not isinstance(config, dict) or not isinstance(config.get("terms"), list):
+        logger.warning(f"Keyword list {path} does not define a `terms` list, skipping it")
+        return None
+    return KeywordList(
+        name,
+        [str(term) for term in config["terms"]],
+        case_sensitive=bool(config.get("case_sensitive", False)),
+        word_boundaries=bool(config.get("word_boundaries", True)),
+    )
+
+
+def load_keyword_lists(directory: str) -> Dict[str, KeywordList]:
+    """Load every keyword list file in a directory"""
+    keyword_lists = {}
+    if not os.path.isdir(directory):
+        logger.info(f"Keyword list directory {directory} does not exist, no keyword lists loaded")
+        return keyword_lists
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(KEYWORD_LIST_EXTENSIONS):
+            continue
+        try:
+            keyword_list = load_keyword_list(os.path.join(directory, file_name))
+        except Exception as e:
+            logger.error(f"Failed to load keyword list {file_name}: {e}")
+            continue
+        if keyword_list is not None:
+            keyword_lists[keyword_list.name] = keyword_list
+            logger.info(f"Loaded keyword list '{keyword_list.name}' with {len(keyword_list.automaton)} terms")
+    return keyword_lists
+
+
+class KeywordDetectorRegistry(BaseDetectorRegistry):
+    def __init__(self, keyword_lists_dir: Optional[str] = None):
+        super().__init__("keyword")
+        keyword_lists_dir = keyword_lists_dir or os.environ.get("KEYWORD_LISTS_DIR", DEFAULT_KEYWORD_LISTS_DIR)
+        self.registry = load_keyword_lists(keyword_lists_dir)
+
+    def compile_plan(self, detector_params: dict) -> DetectorPlan:
+        steps = []
+        for list_name in self.get_detection_functions_from_params(detector_params):
+            if list_name not in self.registry:
+                raise HTTPException(status_code=400, detail=f"Unrecognized keyword list: {list_name}")
+            steps.append(DetectorStep(list_name, list_name, self.registry[list_name]))
+        return DetectorPlan(
+            registry_name=self.registry_name,
+            params=detector_params.get(self.registry_name),
+            steps=tuple(steps),
+            cache_params=self.get_cache_params(detector_params),
+        )
+
+    def handle_request(self, content: str, detector_params: dict, headers: dict) -> List[DetectionRecord]:
+        return self.run_plan(self.get_plan(detector_params), content, headers)
+
+    def run_plan(self, plan: DetectorPlan, content: str, headers: dict) -> List[DetectionRecord]:
+        detections = []
+        for step in plan.steps:
+            new_detections = []
+            try:
+                with self.instrument_runtime(step.metric_name):
+                    new_detections = step.function(content)
+            except Exception as e:
+                self.throw_internal_detector_error(step.metric_name, logger, e, increment_requests=True)
+            self.increment_detector_instruments(step.metric_name, len(new_detections) > 0)
+            detections += new_detections
+        return detections
@@ -0,0 +1,219 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from config import get_float_env, get_int_env
+
+logger = logging.getLogger(__name__)
+
+
+class IsolatedCallError(RuntimeError):
+    """Raised when a function fails inside a worker process, carrying the message of the worker's exception"""
+
+
+class IsolatedTimeoutError(IsolatedCallError):
+    """Raised when a function does not finish within its timeout, after which its worker process is killed"""
+
+
+def _worker_main(connection, load_functions: Callable[..., Dict[str, Callable]], load_args: tuple):
+    """Serve (name, args, kwargs) calls of the loaded functions from the parent process, answering with their results"""
+    functions = load_functions(*load_args)
+    connection.send(True)  # ready, so that the start up time is not charged to the first call's timeout
+    while True:
+        try:
+            name, args, kwargs = connection.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            connection.send((True, functions[name](*args, **kwargs)))
+        except Exception as e:
+            connection.send((False, f"{type(e).__name__}: {e}"))
+
+
+class IsolatedWorker:
+    """A single worker process, which counts the calls it served so that it can be recycled"""
+    def __init__(self, context, load_functions: Callable[..., Dict[str, Callable]], load_args: tuple, generation: int):
+        self.context = context
+        self.load_functions = load_functions
+        self.load_args = load_args
+        self.generation = generation
+        self.process = None
+        self.connection = None
+        self.calls = 0
+
+    def start(self):
+        self.connection, child_connection = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main, args=(child_connection, self.load_functions, self.load_args), daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.calls = 0
+
+    def wait_ready(self):
+        try:
+            self.connection.recv()
+        except (EOFError, OSError):
+            self.stop()
+            raise IsolatedCallError("Worker process exited while loading its functions")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+        self.process, self.connection = None, None
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def call(self, name: str, args: tuple, kwargs: dict, timeout: Optional[float]):
+        if not self.is_alive():
+            self.stop()
+            self.start()
+            self.wait_ready()
+        self.calls += 1
+        self.connection.send((name, args, kwargs))
+        try:
+            if not self.connection.poll(timeout):
+                self.stop()
+                raise IsolatedTimeoutError(f"{name} did not finish within {timeout}s")
+            ok, result = self.connection.recv()
+        except (EOFError, OSError):
+            self.stop()
+            raise IsolatedCallError(f"Worker process exited while running {name}")
+        if not ok:
+            raise IsolatedCallError(result)
+        return result
+
+
+class IsolatedProcessPool:
+    """
+    A pool of pre-started worker processes that run functions, e.g. the `@isolated` custom detectors, outside of the
+    server process. A CPU-bound function then runs in parallel with the server's threads instead of holding their GIL,
+    and a call that overruns its timeout (`0` waits forever) is killed together with its worker.
+
+    Workers load their functions themselves, with `load_functions(*load_args)`, since functions are sent to processes by
+    name. A worker that served `max_calls` calls (`0` never), timed out or crashed is replaced in the background.
+
+    The time that calls wait for a free worker and spend running in one, the timeouts and the replaced workers are
+    reported to the `isolated_queue_wait`, `isolated_exec_time`, `isolated_timeouts` and `isolated_recycles` instruments.
+    """
+    def __init__(self, name: str, workers: int = 0, timeout: float = 10.0, max_calls: int = 1000):
+        self.name = name
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_calls = max_calls
+        self.instruments = {}
+        # set in processes that are isolated from the server already, e.g. the worker processes of the detector
+        # executor, whose callers then run their functions themselves rather than starting a pool of their own
+        self.in_process = False
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[IsolatedWorker]" = queue.Queue()
+        self._loader = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str) -> "IsolatedProcessPool":
+        return cls(
+            name,
+            workers=get_int_env("ISOLATED_WORKERS", 0),
+            timeout=get_float_env("ISOLATED_TIMEOUT", 10.0),
+            max_calls=get_int_env("ISOLATED_MAX_CALLS", 1000),
+        )
+
+    def set_instruments(self, instruments: dict):
+        self.instruments = instruments
+
+    @property
+    def started(self) -> bool:
+        return self._loader is not None
+
+    def start(self, load_functions: Callable[..., Dict[str, Callable]], *load_args):
+        """(Re)start the workers with the functions of `load_functions(*load_args)`, waiting until they are ready"""
+        self.shutdown()
+        with self._lock:
+            self._loader = (load_functions, load_args)
+            workers = [IsolatedWorker(self._context, load_functions, load_args, self._generation) for _ in range(self.workers)]
+        # the workers load their functions in parallel
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            try:
+                worker.wait_ready()
+            except IsolatedCallError as e:
+                logger.error(f"{e} in {self.name}")
+            self._idle.put(worker)
+
+    def call(self, name: str, args: tuple, kwargs: dict, timeout: Optional[float] = None):
+        """Run `name(*args, **kwargs)` in a worker, raising an IsolatedTimeoutError if it overruns its timeout"""
+        if not self.started:
+            raise IsolatedCallError(f"{self.name} has not been started, cannot run {name}")
+        timeout = self.timeout if timeout is None else timeout
+        submitted = time.perf_counter()
+        worker = self._idle.get()
+        started = time.perf_counter()
+        self.record_time("isolated_queue_wait", name, started - submitted)
+        timed_out = False
+        try:
+            return worker.call(name, args, kwargs, timeout or None)
+        except IsolatedTimeoutError:
+            timed_out = True
+            if self.instruments.get("isolated_timeouts"):
+                self.instruments["isolated_timeouts"].labels(self.name, name).inc()
+            raise
+        finally:
+            self.record_time("isolated_exec_time", name, time.perf_counter() - started)
+            if worker.generation != self._generation:
+                worker.stop()
+            elif not worker.is_alive():
+                self.replace(worker, "timeout" if timed_out else "crashed")
+            elif self.max_calls and worker.calls >= self.max_calls:
+                self.replace(worker, "max_calls")
+            else:
+                self.release(worker)
+
+    def release(self, worker: IsolatedWorker):
+        """Return the worker to the pool, unless the pool was restarted or shut down since it was started"""
+        if worker.generation != self._generation:
+            worker.stop()
+        else:
+            self._idle.put(worker)
+
+    def replace(self, worker: IsolatedWorker, reason: str):
+        """Start a fresh process for the worker in the background, so that the call that retired it is not held up"""
+        if self.instruments.get("isolated_recycles"):
+            self.instruments["isolated_recycles"].labels(self.name, reason).inc()
+
+        def restart():
+            worker.stop()
+            if worker.generation != self._generation:
+                return
+            worker.start()
+            try:
+                worker.wait_ready()
+            except IsolatedCallError as e:
+                # the worker is started again by its next call, which then reports the error
+                logger.error(f"{e} in {self.name}")
+            self.release(worker)
+        threading.Thread(target=restart, name=f"{self.name}-restart", daemon=True).start()
+
+    def record_time(self, instrument: str, name: str, seconds: float):
+        if self.instruments.get(instrument):
+            self.instruments[instrument].labels(self.name, name).inc(seconds)
+
+    def shutdown(self):
+        """Stop the idle workers. Busy workers are stopped once their call is done."""
+        with self._lock:
+            self._generation += 1
+            self._loader = None
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
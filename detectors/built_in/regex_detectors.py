@@ -1,124 +1,377 @@
+import functools
+import ipaddress
+import os
 import re
+from dataclasses import dataclass, field
+from string import ascii_lowercase
 from time import time
-from http.client import HTTPException
-from typing import List
+from typing import Callable, Dict, List, Optional, Tuple
 import logging
-from base_detector_registry import BaseDetectorRegistry
-from detectors.common.scheme import ContentAnalysisResponse
+from fastapi import HTTPException
+from base_detector_registry import BaseDetectorRegistry, DetectorPlan, DetectorStep
+from detection_record import DetectionRecord
+from cache import LRUCache
+from config import get_bool_env, get_float_env, get_int_env
+from regex_engines import RegexEngine, create_regex_engine
+from regex_sandbox import RegexRejectedError, RegexSandbox, RegexTimeoutError, has_nested_quantifier
+from regex_syntax import get_opcode, parse_pattern, sre
 
 logger = logging.getLogger(__name__)
 
-def email_address_detector(string: str) -> List[ContentAnalysisResponse]:
+# === PATTERNS =====================================================================================
+# All built-in patterns are compiled once, when the module is loaded
+EMAIL_PATTERN = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+
+# Match major card types with separators (space or dash) between groups, not continuous digits.
+# Separators are captured with named groups so that the pattern can be merged into a multi-pattern scan
+CREDIT_CARD_PATTERN = re.compile(
+    r"\b(?:"
+    r"4\d{3}(?P<visa_sep>[- ])\d{4}(?P=visa_sep)\d{4}(?P=visa_sep)\d{4}"                 # Visa 16-digit with separators
+    r"|4\d{15}"                                                                         # Visa 16-digit continuous
+    r"|5[1-5]\d{2}(?P<mc_sep>[- ])\d{4}(?P=mc_sep)\d{4}(?P=mc_sep)\d{4}"                 # MasterCard 16-digit with separators
+    r"|5[1-5]\d{14}"                                                                    # MasterCard 16-digit continuous
+    r"|3[47]\d{2}(?P<amex_sep>[- ])\d{6}(?P=amex_sep)\d{5}"                             # Amex 15-digit with separators
+    r"|3[47]\d{13}"                                                                     # Amex 15-digit continuous
+    r"|6(?:011|5\d{2})(?P<disc_sep>[- ])\d{4}(?P=disc_sep)\d{4}(?P=disc_sep)\d{4}"       # Discover 16-digit with separators
+    r"|6(?:011|5\d{2})\d{12}"                                                           # Discover 16-digit continuous
+    r"|3(?:0[0-5]|[68]\d)\d(?P<diners_sep>[- ])\d{6}(?P=diners_sep)\d{4}"               # Diners Club 14-digit with separators
+    r"|3(?:0[0-5]|[68]\d)\d{11}"                                                        # Diners Club 14-digit continuous
+    r"|35\d{2}(?P<jcb_sep>[- ])\d{4}(?P=jcb_sep)\d{4}(?P=jcb_sep)\d{4}"                 # JCB 16-digit with separators
+    r"|35\d{14}"                                                                        # JCB 16-digit continuous
+    r")\b"
+)
+
+IPV4_PATTERN = re.compile(
+    r"(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)",
+    re.IGNORECASE,
+)
+# IPv6 addresses are found with a scanner rather than a single regex, see `ipv6_detector`. Candidates are maximal runs
+# of hex digits, dots and colons that contain a colon. The lookbehind only lets a candidate start at the beginning of
+# a run and the quantifiers are possessive, so the pattern never backtracks and scans in linear time
+IPV6_CANDIDATE_PATTERN = re.compile(r"(?<![0-9A-Fa-f:.])[0-9A-Fa-f.]*+:[0-9A-Fa-f:.]*+")
+WHITESPACE_PATTERN = re.compile(r"\s*")
+SSN_PATTERN = re.compile(r"\b\d{3}[- ]\d{2}[- ]\d{4}\b")
+US_PHONE_NUMBER_PATTERN = re.compile(r"(?:\+?1[-.\s]?)?(?:\(\d{3}\)|\d{3})[-.\s]+\d{3}[-.\s]?\d{4}\b")
+UK_POST_CODE_PATTERN = re.compile(r"\b([A-Z]{1,2}[0-9][0-9A-Z]? ?[0-9][A-Z]{2})\b")
+
+
+# The engine that runs the regex detectors, selected once for the process by `REGEX_ENGINE`
+_regex_engine = create_regex_engine(os.environ.get("REGEX_ENGINE", RegexEngine.name))
+
+
+def set_regex_engine(engine: RegexEngine):
+    global _regex_engine
+    _regex_engine = engine
+
+
+# === DETECTORS ====================================================================================
+def email_address_detector(string: str) -> List[DetectionRecord]:
     """Detect email addresses in the text contents"""
-    pattern = r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}"
-    return get_regex_detections(string, pattern, "pii", "email_address")
+    return get_regex_detections(string, EMAIL_PATTERN, "pii", "email_address")
 
-def credit_card_detector(string: str) -> List[ContentAnalysisResponse]:
+def credit_card_detector(string: str) -> List[DetectionRecord]:
     """Detect credit cards in the text contents (Visa, MasterCard, Amex, Discover, Diners Club, JCB) with Luhn check"""
-    # Match major card types with separators (space or dash) between groups, not continuous digits
-    pattern = (
-        r"\b(?:"
-        r"4\d{3}([- ])\d{4}\1\d{4}\1\d{4}"                # Visa 16-digit with separators
-        r"|4\d{15}"                                       # Visa 16-digit continuous
-        r"|5[1-5]\d{2}([- ])\d{4}\2\d{4}\2\d{4}"           # MasterCard 16-digit with separators
-        r"|5[1-5]\d{14}"                                  # MasterCard 16-digit continuous
-        r"|3[47]\d{2}([- ])\d{6}\3\d{5}"                   # Amex 15-digit with separators
-        r"|3[47]\d{13}"                                   # Amex 15-digit continuous
-        r"|6(?:011|5\d{2})([- ])\d{4}\4\d{4}\4\d{4}"       # Discover 16-digit with separators
-        r"|6(?:011|5\d{2})\d{12}"                         # Discover 16-digit continuous
-        r"|3(?:0[0-5]|[68]\d)\d([- ])\d{6}\5\d{4}"         # Diners Club 14-digit with separators
-        r"|3(?:0[0-5]|[68]\d)\d{11}"                      # Diners Club 14-digit continuous
-        r"|35\d{2}([- ])\d{4}\6\d{4}\6\d{4}"               # JCB 16-digit with separators
-        r"|35\d{14}"                                      # JCB 16-digit continuous
-        r")\b"
-    )
-    # Find all matches and filter with Luhn check
-    detections = []
-    for match in re.finditer(pattern, string):
-        cc_number = match.group(0).replace(" ", "").replace("-", "")
-        if is_luhn_valid(cc_number):
-            detections.append(
-                ContentAnalysisResponse(
-                    start=match.start(),
-                    end=match.end(),
-                    text=match.group(0),
-                    detection_type="pii",
-                    detection="credit_card",
-                    score=1.0
-                )
-            )
-    return detections
+    return get_regex_detections(string, CREDIT_CARD_PATTERN, "pii", "credit_card", validator=are_valid_card_matches)
+
+# A digit doubled by the Luhn algorithm, with the digits of the product summed: 5 -> 10 -> 1
+_LUHN_DOUBLED_DIGITS = bytes.maketrans(b"0123456789", bytes([0, 2, 4, 6, 8, 1, 3, 5, 7, 9]))
+_NON_DIGIT_BYTES = bytes(b for b in range(256) if not ord("0") <= b <= ord("9"))
 
-def luhn_checksum(card_number: str):
-    card_number = "".join(c for c in card_number if c in "0123456789")
-    def digits_of(n):
-        return [int(d) for d in str(n)]
-    digits = digits_of(card_number)
-    odd_digits = digits[-1::-2]
-    even_digits = digits[-2::-2]
-    checksum = 0
-    checksum += sum(odd_digits)
-    for d in even_digits:
-        checksum += sum(digits_of(d*2))
-    return checksum % 10
+def luhn_checksum(card_number: str) -> int:
+    # only ASCII digits count, separators and anything else are dropped
+    digits = card_number.encode("ascii", "ignore").translate(None, _NON_DIGIT_BYTES)
+    # every other digit from the right is summed as is, the others through the doubling table. Both sums run over byte
+    # strings, so there is no per-digit work in Python: the ASCII code of each undoubled digit is offset by ord("0")
+    undoubled = digits[-1::-2]
+    return (sum(undoubled) - ord("0") * len(undoubled) + sum(digits[-2::-2].translate(_LUHN_DOUBLED_DIGITS))) % 10
 
 def is_luhn_valid(card_number):
     return luhn_checksum(card_number) == 0
 
+def are_valid_card_matches(texts: List[str]) -> List[bool]:
+    """Run the Luhn check on all the matched card numbers of a content at once"""
+    return [luhn_checksum(text) == 0 for text in texts]
+
 
-def ipv4_detector(string: str) -> List[ContentAnalysisResponse]:
+def ipv4_detector(string: str) -> List[DetectionRecord]:
     """Detect IPv4 addresses in the text contents"""
-    pattern = re.compile(
-        u"(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)",
-        re.IGNORECASE,
-    )
-    return get_regex_detections(string, pattern, "pii", "ipv4")
+    return get_regex_detections(string, IPV4_PATTERN, "pii", "ipv4")
 
-def ipv6_detector(string: str) -> List[ContentAnalysisResponse]:
+def ipv6_detector(string: str) -> List[DetectionRecord]:
     """Detect IPv6 addresses in the text contents"""
-    pattern = re.compile(
-        u"\s*(?!.*::.*::)(?:(?!:)|:(?=:))(?:[0-9a-f]{0,4}(?:(?<=::)|(?<!::):)){6}(?:[0-9a-f]{0,4}(?:(?<=::)|(?<!::):)[0-9a-f]{0,4}(?:(?<=::)|(?<!:)|(?<=:)(?<!::):)|(?:25[0-4]|2[0-4]\d|1\d\d|[1-9]?\d)(?:\.(?:25[0-4]|2[0-4]\d|1\d\d|[1-9]?\d)){3})\s*",
-        re.VERBOSE | re.IGNORECASE | re.DOTALL,
-    )
-    return get_regex_detections(string, pattern, "pii", "ipv6")
+    detections = []
+    previous_end = 0
+    for candidate in IPV6_CANDIDATE_PATTERN.finditer(string):
+        found = get_ipv6_address(string, *candidate.span())
+        if found is None:
+            continue
+        start, address = found
+        end = start + len(address)
+        # like the regex this detector replaced, report the whitespace around the address as part of the match
+        gap = string[previous_end:start]
+        start -= len(gap) - len(gap.rstrip())
+        end = WHITESPACE_PATTERN.match(string, end).end()
+        previous_end = end
+        detections.append(
+            DetectionRecord(
+                start=start,
+                end=end,
+                text=string[start:end],
+                detection_type="pii",
+                detection="ipv6",
+                score=1.0
+            ))
+    return detections
+
+def get_ipv6_address(string: str, start: int, end: int) -> Optional[Tuple[int, str]]:
+    """
+    Return the start and the IPv6 address of the candidate run string[start:end], or None if it does not hold one
+    """
+    # the run must not run into a word, like "std::vector"
+    if end < len(string) and is_word_char(string[end]):
+        return None
+    # a run that starts inside a word can only hold an address after the word's colon, e.g. in "addr:fe80::1"
+    if start > 0 and is_word_char(string[start - 1]):
+        start = string.index(":", start) + 1
+    candidate = string[start:end].rstrip(".")  # e.g. the full stop of "connect to ::1."
+    if candidate.endswith(":") and not candidate.endswith("::"):
+        candidate = candidate[:-1]  # e.g. a trailing port separator, "fe80::1:"
+    if candidate.count(":") < 2:
+        return None
+    try:
+        ipaddress.IPv6Address(candidate)
+    except ValueError:
+        return None
+    return start, candidate
+
+def is_word_char(c: str) -> bool:
+    return c.isalnum() or c == "_"
 
 # === USA Specific =================================================================================
-def ssn_detector(string: str) -> List[ContentAnalysisResponse]:
+def ssn_detector(string: str) -> List[DetectionRecord]:
     """Detect social security numbers in the text contents"""
-    pattern = r"\b\d{3}[- ]\d{2}[- ]\d{4}\b"
-    return get_regex_detections(string, pattern, "pii", "social_security_number")
+    return get_regex_detections(string, SSN_PATTERN, "pii", "social_security_number")
 
-def us_phone_number_detector(string: str) -> List[ContentAnalysisResponse]:
+def us_phone_number_detector(string: str) -> List[DetectionRecord]:
     """Detect US phone numbers in the text contents"""
-    pattern = r"(?:\+?1[-.\s]?)?(?:\(\d{3}\)|\d{3})[-.\s]+\d{3}[-.\s]?\d{4}\b"
-    return get_regex_detections(string, pattern, "pii", "us-phone-number")
+    return get_regex_detections(string, US_PHONE_NUMBER_PATTERN, "pii", "us-phone-number")
 
 # === UK Specific =================================================================================
-def uk_post_code_detector(string: str) -> List[ContentAnalysisResponse]:
+def uk_post_code_detector(string: str) -> List[DetectionRecord]:
     """Detect UK post codes in the text contents"""
-    pattern = r"\b([A-Z]{1,2}[0-9][0-9A-Z]? ?[0-9][A-Z]{2})\b"
-    return get_regex_detections(string, pattern, "pii", "uk-post-code")
+    return get_regex_detections(string, UK_POST_CODE_PATTERN, "pii", "uk-post-code")
 
 
-def get_regex_detections(string, pattern, detection_type, detection) -> List[ContentAnalysisResponse]:
-    detections = []
-    for match in re.finditer(pattern, string):
-        detections.append(
-            ContentAnalysisResponse(
-                start=match.start(),
-                end=match.end(),
-                text=match.string[match.start():match.end()],
-                detection_type=detection_type,
-                detection=detection,
-                score=1.0
-            ))
-    return detections
+def get_regex_detections(string: str, pattern: re.Pattern, detection_type: str, detection: str, validator=None) -> List[DetectionRecord]:
+    """Run a regex over the string. The optional validator receives the texts of all matches at once, and returns which to keep"""
+    spans = [(match.start(), match.end()) for match in _regex_engine.compile(pattern).finditer(string)]
+    return make_detections(string, spans, detection_type, detection, validator)
+
+def make_detections(string: str, spans: List[Tuple[int, int]], detection_type: str, detection: str, validator=None) -> List[DetectionRecord]:
+    if validator is not None and spans:
+        spans = [span for span, is_valid in zip(spans, validator([string[start:end] for start, end in spans])) if is_valid]
+    return [
+        DetectionRecord(
+            start=start,
+            end=end,
+            text=string[start:end],
+            detection_type=detection_type,
+            detection=detection,
+            score=1.0
+        )
+        for start, end in spans
+    ]
+
+# === PREFILTERS ===================================================================================
+# Cheap necessary conditions for the built-in detectors: if a condition fails, the detector's regex cannot match, so it
+# is not run at all. They only use fast `str` operations, so on text without any candidates the regexes cost nothing
+_ASCII_DIGITS = "0123456789"
+_DIGIT_PATTERN = re.compile(r"\d")
+
+
+def has_min_digits(string: str, minimum: int) -> bool:
+    """Check if a string contains at least `minimum` digits, as matched by `\\d`"""
+    if string.isascii():
+        return sum(map(string.count, _ASCII_DIGITS)) >= minimum
+    # `\d` also matches non-ASCII decimal digits
+    return len(_DIGIT_PATTERN.findall(string)) >= minimum
+
+
+PREFILTERS: Dict[str, Callable[[str], bool]] = {
+    "credit-card": lambda s: has_min_digits(s, 14),  # Diners Club numbers are the shortest, with 14 digits
+    "email": lambda s: "@" in s and "." in s,
+    "ipv4": lambda s: s.count(".") >= 3 and has_min_digits(s, 4),
+    "ipv6": lambda s: s.count(":") >= 2,  # the shortest address, "::", has two colons
+    "us-phone-number": lambda s: has_min_digits(s, 10),
+    "us-social-security-number": lambda s: has_min_digits(s, 9),
+    "uk-post-code": lambda s: has_min_digits(s, 2),
+}
+
 
 # dummy function to add documention on the custom regex detector to the registr
 def custom_regex_documenter():
     """Replace $CUSTOM_REGEX with a custom regex to define your own regex detector"""
 
 
+# === MULTI-PATTERN SCANNING =======================================================================
+@dataclass(frozen=True)
+class RegexDetectorSpec:
+    """Everything needed to run a regex detector as part of a multi-pattern scan"""
+    pattern: re.Pattern
+    detection_type: str
+    detection: str
+    validator: Optional[Callable[[List[str]], List[bool]]] = None
+    scan_guard: Optional[str] = field(init=False, default=None)
+
+    def __post_init__(self):
+        object.__setattr__(self, "scan_guard", get_scan_guard(self.pattern))
+
+
+_INLINE_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.VERBOSE, "x"))
+_NUMBERED_GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?\(")
+_GLOBAL_INLINE_FLAGS = re.compile(r"\(\?[aiLmsux]+\)")
+_CATEGORIES = {
+    get_opcode("CATEGORY_DIGIT"): r"\d", get_opcode("CATEGORY_NOT_DIGIT"): r"\D",
+    get_opcode("CATEGORY_SPACE"): r"\s", get_opcode("CATEGORY_NOT_SPACE"): r"\S",
+    get_opcode("CATEGORY_WORD"): r"\w", get_opcode("CATEGORY_NOT_WORD"): r"\W",
+} if sre is not None else {}
+# possessive repeats and atomic groups only exist from Python 3.11 on
+_POSSESSIVE_REPEAT, _ATOMIC_GROUP = get_opcode("POSSESSIVE_REPEAT"), get_opcode("ATOMIC_GROUP")
+
+
+def _first_chars(items, ignorecase: bool, cased: set, folded: set) -> Optional[bool]:
+    """
+    Collect the character class items that a parsed pattern sequence can start with into `cased` and `folded`.
+    Returns whether the sequence can match the empty string, or None if the first characters cannot be determined
+    """
+    for op, av in items:
+        if op in (sre.AT, sre.ASSERT, sre.ASSERT_NOT):
+            continue  # zero-width, the next item decides the first character
+        target = folded if ignorecase else cased
+        if op is sre.LITERAL:
+            target.add(re.escape(chr(av)))
+            return False
+        elif op is sre.IN:
+            for item_op, item_av in av:
+                if item_op is sre.LITERAL:
+                    target.add(re.escape(chr(item_av)))
+                elif item_op is sre.RANGE:
+                    target.add(f"{re.escape(chr(item_av[0]))}-{re.escape(chr(item_av[1]))}")
+                elif item_op is sre.CATEGORY and item_av in _CATEGORIES:
+                    target.add(_CATEGORIES[item_av])
+                else:
+                    return None
+            return False
+        elif op is sre.BRANCH:
+            nullable = False
+            for branch in av[1]:
+                branch_nullable = _first_chars(branch.data, ignorecase, cased, folded)
+                if branch_nullable is None:
+                    return None
+                nullable = nullable or branch_nullable
+        elif op is sre.SUBPATTERN:
+            _, add_flags, del_flags, subpattern = av
+            sub_ignorecase = (ignorecase or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+            nullable = _first_chars(subpattern.data, sub_ignorecase, cased, folded)
+        elif op in (sre.MAX_REPEAT, sre.MIN_REPEAT) or (_POSSESSIVE_REPEAT is not None and op is _POSSESSIVE_REPEAT):
+            nullable = _first_chars(av[2].data, ignorecase, cased, folded)
+            if nullable is not None:
+                nullable = nullable or av[0] == 0
+        elif _ATOMIC_GROUP is not None and op is _ATOMIC_GROUP:
+            nullable = _first_chars(av.data, ignorecase, cased, folded)
+        else:
+            return None
+        if not nullable:
+            return nullable
+    return True
+
+
+def get_scan_guard(pattern: re.Pattern) -> Optional[str]:
+    """
+    Build a character class matching every character that a match of the pattern can start with. Returns None if the
+    pattern is not worth merging into a multi-pattern scan: it can match the empty string, its first characters cannot
+    be determined or include lowercase letters (so almost every position of natural text is a candidate), or it uses
+    numbered backreferences or global inline flags that do not survive being embedded into a larger pattern. Without the
+    parser of `re` every pattern is scanned separately.
+    """
+    if _NUMBERED_GROUP_REFERENCE.search(pattern.pattern) or _GLOBAL_INLINE_FLAGS.match(pattern.pattern):
+        return None
+    cased, folded = set(), set()
+    try:
+        items = parse_pattern(pattern)
+        if items is None:
+            return None
+        nullable = _first_chars(items, bool(pattern.flags & re.IGNORECASE), cased, folded)
+    except Exception:
+        return None
+    if nullable is not False:
+        return None
+    classes = ([f"[{''.join(sorted(cased))}]"] if cased else []) + ([f"(?i:[{''.join(sorted(folded))}])"] if folded else [])
+    guard = "|".join(classes)
+    if re.search(guard, ascii_lowercase):
+        return None
+    return guard
+
+
+# built-in detectors that are candidates for a multi-pattern scan, `get_scan_guard` decides which ones are merged.
+# The ipv6 detector is a scanner rather than a regex, so it always runs as its own pass
+MULTI_PATTERN_SPECS = {
+    "credit-card": RegexDetectorSpec(CREDIT_CARD_PATTERN, "pii", "credit_card", validator=are_valid_card_matches),
+    "email": RegexDetectorSpec(EMAIL_PATTERN, "pii", "email_address"),
+    "ipv4": RegexDetectorSpec(IPV4_PATTERN, "pii", "ipv4"),
+    "us-phone-number": RegexDetectorSpec(US_PHONE_NUMBER_PATTERN, "pii", "us-phone-number"),
+    "us-social-security-number": RegexDetectorSpec(SSN_PATTERN, "pii", "social_security_number"),
+    "uk-post-code": RegexDetectorSpec(UK_POST_CODE_PATTERN, "pii", "uk-post-code"),
+}
+
+
+class MultiPatternScanner:
+    """
+    Scan a string for several regexes with a single merged program.
+
+    The patterns are folded into one alternation, guarded by a lookahead over the characters that any of them can
+    start with. One pass of this program finds the first position at which any pattern matches: on clean text that
+    single pass is all the work there is. Otherwise no pattern can match before that position, so each pattern only
+    runs from there on, and its matches are routed back under its own name. The results are identical to running
+    `re.finditer` separately for each pattern.
+
+    The merged program is only used to find that first position: `re` is a backtracking engine that tries every
+    alternative at every candidate position, so a merged `finditer` is slower than separate passes on PII-dense text.
+    """
+    def __init__(self, specs: Dict[str, "RegexDetectorSpec"]):
+        self.patterns = {name: spec.pattern for name, spec in specs.items()}
+        guards, alternatives = [], []
+        for spec in specs.values():
+            letters = "".join(letter for flag, letter in _INLINE_FLAGS if spec.pattern.flags & flag)
+            guards.append(spec.scan_guard)
+            alternatives.append(f"(?{letters}:{spec.pattern.pattern})")
+        self.program = re.compile(f"(?={'|'.join(guards)})(?:{'|'.join(alternatives)})")
+
+    def scan(self, string: str) -> Dict[str, List[Tuple[int, int]]]:
+        """Return the (start, end) spans of every pattern, exactly as `finditer` would report them"""
+        first = self.program.search(string)
+        if first is None:
+            return {name: [] for name in self.patterns}
+        return {name: [match.span() for match in pattern.finditer(string, first.start())]
+                for name, pattern in self.patterns.items()}
+
+
+@functools.lru_cache(maxsize=256)
+def get_multi_pattern_scanner(specs: Tuple[Tuple[str, "RegexDetectorSpec"], ...]) -> MultiPatternScanner:
+    """Build (or fetch a previously built) scanner for a set of (name, spec) pairs"""
+    return MultiPatternScanner(dict(specs))
+
+
+def get_multi_pattern_detections(string: str, specs: Dict[str, RegexDetectorSpec]) -> Dict[str, List[DetectionRecord]]:
+    """Run every spec over the string in a single pass, returning the detections of each spec by name"""
+    scanner = get_multi_pattern_scanner(tuple(sorted(specs.items(), key=lambda item: item[0])))
+    detections = {}
+    for name, spans in scanner.scan(string).items():
+        spec = specs[name]
+        detections[name] = make_detections(string, spans, spec.detection_type, spec.detection, spec.validator)
+    return detections
+
+
 # === ROUTER =======================================================================================
 class RegexDetectorRegistry(BaseDetectorRegistry):
     def __init__(self):
@@ -133,25 +386,153 @@ class RegexDetectorRegistry(BaseDetectorRegistry):
             "uk-post-code": uk_post_code_detector,
             "$CUSTOM_REGEX": custom_regex_documenter,
         }
+        # custom regexes arrive with every request, so keep their compiled form in an explicitly sized cache rather
+        # than relying on the small internal cache of the `re` module
+        self.regex_cache = LRUCache("custom_regex", maxsize=get_int_env("REGEX_CACHE_SIZE", 1024))
+        # custom regexes are arbitrary caller input: optionally run them in killable worker processes under a
+        # wall-clock budget, and/or refuse patterns with nested quantifiers before running them at all
+        self.regex_timeout = get_float_env("CUSTOM_REGEX_TIMEOUT", 0.0)
+        self.regex_sandbox = None
+        if self.regex_timeout > 0:
+            self.regex_sandbox = RegexSandbox(self.regex_timeout, workers=get_int_env("CUSTOM_REGEX_WORKERS", 2, minimum=1))
+        self.reject_nested_quantifiers = get_bool_env("CUSTOM_REGEX_REJECT_NESTED_QUANTIFIERS", False)
+
+    def set_instruments(self, instruments):
+        super().set_instruments(instruments)
+        self.regex_cache.set_instruments(instruments)
 
-    def handle_request(self, content: str, detector_params: dict, headers: dict) -> List[ContentAnalysisResponse]:
+    def close(self):
+        if self.regex_sandbox is not None:
+            self.regex_sandbox.shutdown()
+
+    def get_custom_regex_spec(self, regex: str) -> RegexDetectorSpec:
+        """Compile a custom regex, or fetch it from the compile cache"""
+        return self.regex_cache.get_or_create(regex, lambda: RegexDetectorSpec(re.compile(regex), "regex", "custom-regex"))
+
+    def check_custom_regex(self, spec: RegexDetectorSpec):
+        """Refuse a custom regex up front, if it could backtrack catastrophically and such regexes are rejected"""
+        if _regex_engine.is_native(_regex_engine.compile(spec.pattern)):
+            return  # the regex runs on a linear-time engine, it cannot backtrack catastrophically
+        if self.reject_nested_quantifiers and has_nested_quantifier(spec.pattern):
+            raise RegexRejectedError("Custom regex rejected: nested quantifiers can cause catastrophic backtracking")
+
+    def get_custom_regex_detections(self, content: str, spec: RegexDetectorSpec) -> List[DetectionRecord]:
+        """Run a custom regex that passed `check_custom_regex`, within the configured execution budget"""
+        if self.regex_sandbox is None or _regex_engine.is_native(_regex_engine.compile(spec.pattern)):
+            return get_regex_detections(content, spec.pattern, spec.detection_type, spec.detection)
+        try:
+            spans = self.regex_sandbox.finditer_spans(spec.pattern, content)
+        except RegexTimeoutError:
+            raise RegexTimeoutError(f"Custom regex exceeded its execution budget of {self.regex_timeout}s")
+        return make_detections(content, spans, spec.detection_type, spec.detection)
+
+    def throw_regex_rejected_error(self, function_name: str, exception: RegexRejectedError):
+        """Report a refused custom regex as a client error, rather than as an internal detector error"""
+        if isinstance(exception, RegexTimeoutError) and self.instruments.get("regex_timeouts"):
+            self.instruments["regex_timeouts"].labels(self.registry_name, function_name).inc()
+        if self.instruments.get("requests"):
+            self.instruments["requests"].labels(self.registry_name, function_name).inc()
+        self.increment_error_instruments(function_name)
+        logger.warning(exception)
+        raise HTTPException(status_code=422, detail=str(exception))
+
+    def get_metric_name(self, regex: str) -> str:
+        # don't publish custom regexes to prometheus labels, to limit metric cardinality
+        return regex if regex in self.registry else "custom_regex"
+
+    def get_skipped_regexes(self, content: str, regexes: List[str]) -> set:
+        """Find the requested built-in regexes whose prefilter shows that they cannot match the content"""
+        skipped = set()
+        for regex in regexes:
+            if isinstance(regex, str) and regex in PREFILTERS and not PREFILTERS[regex](content):
+                skipped.add(regex)
+        return skipped
+
+    def get_multi_pattern_specs(self, regexes: List[str]) -> Dict[str, RegexDetectorSpec]:
+        """Select the requested regexes that can share a single multi-pattern scan"""
+        specs = {}
+        # the merged program runs on `re`, which would defeat the worst-case guarantees of any other engine
+        if len(regexes) < 2 or _regex_engine.name != RegexEngine.name:
+            return specs
+        for regex in regexes:
+            if regex in MULTI_PATTERN_SPECS:
+                spec = MULTI_PATTERN_SPECS[regex]
+            elif regex not in self.registry and isinstance(regex, str):
+                if self.regex_sandbox is not None or self.reject_nested_quantifiers:
+                    continue  # custom regexes must go through their execution budget checks
+                try:
+                    spec = self.get_custom_regex_spec(regex)
+                except re.error:
+                    continue  # invalid regexes run on their own, so that they error exactly as before
+                # named groups of custom regexes could collide with those of other patterns
+                if spec.pattern.groupindex:
+                    continue
+            else:
+                continue
+            if spec.scan_guard is not None:
+                specs[regex] = spec
+        # a single pattern gains nothing from merging
+        return specs if len(specs) > 1 else {}
+
+    def compile_plan(self, detector_params: dict) -> "RegexDetectorPlan":
+        """Resolve the built-in detectors, and compile and check the custom regexes, before any content is scanned"""
+        regexes = [regex for regex in self.get_detection_functions_from_params(detector_params) if regex != "$CUSTOM_REGEX"]
+        steps = []
+        for regex in regexes:
+            func_name = self.get_metric_name(regex)
+            if regex in self.registry:
+                steps.append(DetectorStep(regex, func_name, self.registry[regex]))
+                continue
+            try:
+                spec = self.get_custom_regex_spec(regex)
+                self.check_custom_regex(spec)
+            except RegexRejectedError as e:
+                self.throw_regex_rejected_error(func_name, e)
+            except Exception as e:
+                self.throw_internal_detector_error(func_name, logger, e, increment_requests=True)
+            steps.append(DetectorStep(regex, func_name, functools.partial(self.get_custom_regex_detections, spec=spec)))
+        return RegexDetectorPlan(
+            registry_name=self.registry_name,
+            params=detector_params.get(self.registry_name),
+            steps=tuple(steps),
+            cache_params=self.get_cache_params(detector_params),
+            multi_pattern_specs=self.get_multi_pattern_specs(regexes),
+        )
+
+    def handle_request(self, content: str, detector_params: dict, headers: dict) -> List[DetectionRecord]:
+        return self.run_plan(self.get_plan(detector_params), content, headers)
+
+    def run_plan(self, plan: "RegexDetectorPlan", content: str, headers: dict) -> List[DetectionRecord]:
         detections = []
-        for regex in self.get_detection_functions_from_params(detector_params):
+        skipped_regexes = self.get_skipped_regexes(content, [step.name for step in plan.steps])
+        multi_pattern_specs = {regex: spec for regex, spec in plan.multi_pattern_specs.items() if regex not in skipped_regexes}
+        if len(multi_pattern_specs) < 2:
+            multi_pattern_specs = {}  # a single pattern gains nothing from merging
+        multi_pattern_detections = None
+        for step in plan.steps:
             new_detections = []
             try:
-                if regex == "$CUSTOM_REGEX":
-                    continue
-                elif regex in self.registry:
-                    func_name = regex
-                    with self.instrument_runtime(func_name):
-                        new_detections = self.registry[regex](content)
+                if step.name in skipped_regexes:
+                    if self.instruments.get("prefilter_skips"):
+                        self.instruments["prefilter_skips"].labels(self.registry_name, step.metric_name).inc()
+                elif step.name in multi_pattern_specs:
+                    if multi_pattern_detections is None:
+                        with self.instrument_shared_runtime([self.get_metric_name(r) for r in multi_pattern_specs]):
+                            multi_pattern_detections = get_multi_pattern_detections(content, multi_pattern_specs)
+                    new_detections = list(multi_pattern_detections[step.name])
                 else:
-                    func_name = "custom_regex" # don't publish custom regexes to prometheus labels, to limit metric cardinality
-                    with self.instrument_runtime(func_name):
-                        new_detections += get_regex_detections(content, regex, "regex", "custom-regex")
+                    with self.instrument_runtime(step.metric_name):
+                        new_detections = step.function(content)
+            except RegexRejectedError as e:
+                self.throw_regex_rejected_error(step.metric_name, e)
             except Exception as e:
-                print(e)
-                self.throw_internal_detector_error(func_name, logger, e, increment_requests=True)
-            self.increment_detector_instruments(func_name, len(new_detections) > 0)
+                self.throw_internal_detector_error(step.metric_name, logger, e, increment_requests=True)
+            self.increment_detector_instruments(step.metric_name, len(new_detections) > 0)
             detections += new_detections
         return detections
+
+
+@dataclass(frozen=True)
+class RegexDetectorPlan(DetectorPlan):
+    """A regex plan, with the requested detectors that may share a multi-pattern scan when their prefilters pass"""
+    multi_pattern_specs: Dict[str, RegexDetectorSpec] = field(default_factory=dict)
@@ -0,0 +1,129 @@
+import functools
+import logging
+import re
+import sys
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RegexEngine:
+    """
+    The engine that runs the regex detectors. Patterns are always written and compiled for the standard library `re`
+    module; an engine translates them into its own compiled form, whose `finditer(string, pos)` yields match objects with
+    `start()` and `end()` methods. This default engine runs the `re` patterns as they are.
+    """
+    name = "re"
+
+    def compile(self, pattern: re.Pattern) -> Any:
+        return pattern
+
+    def is_native(self, compiled: Any) -> bool:
+        """Whether a compiled pattern runs on this engine, rather than falling back to `re`"""
+        return not isinstance(compiled, re.Pattern)
+
+
+class Re2Engine(RegexEngine):
+    """
+    Runs patterns on RE2 (the `google-re2` package), which matches in time linear in the size of the input.
+    RE2 does not support backreferences, lookarounds, possessive quantifiers or the VERBOSE flag: patterns using them
+    fall back to `re`, one pattern at a time.
+
+    RE2's `\\d`, `\\w`, `\\s` and `\\b` only consider ASCII characters, and its `$` does not match before a final
+    newline. So that both engines find the same matches, `\\d`, `\\w` and `\\s` are translated into the Unicode classes
+    that `re` uses, and the patterns that cannot be translated, e.g. with `\\b` or a `$` outside of MULTILINE mode,
+    fall back to `re` too.
+    """
+    name = "re2"
+    INLINE_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"))
+    UNSUPPORTED_FLAGS = re.VERBOSE | re.ASCII | re.LOCALE
+
+    def __init__(self):
+        import re2
+        self.re2 = re2
+        self.compile = functools.lru_cache(maxsize=1024)(self._compile)
+        # the characters of `\s`, spelled out, as RE2 has no Unicode property for them
+        spaces = "".join(f"\\x{{{ord(c):x}}}" for c in map(chr, range(sys.maxunicode + 1)) if c.isspace())
+        # the translation of each escape outside of a character class, and inside of one. None cannot be translated
+        self.escapes = {
+            "d": (r"\p{Nd}", r"\p{Nd}"),
+            "D": (r"\P{Nd}", r"\P{Nd}"),
+            "w": (r"[\p{L}\p{N}_]", r"\p{L}\p{N}_"),
+            "W": (r"[^\p{L}\p{N}_]", None),
+            "s": (f"[{spaces}]", spaces),
+            "S": (f"[^{spaces}]", None),
+            "b": (None, None),
+            "B": (None, None),
+        }
+
+    def _compile(self, pattern: re.Pattern) -> Any:
+        if pattern.flags & self.UNSUPPORTED_FLAGS:
+            logger.info(f"Regex uses flags that RE2 does not support, falling back to re: {pattern.pattern!r}")
+            return pattern
+        translated = self.translate(pattern.pattern, pattern.flags)
+        if translated is None:
+            logger.info(f"Regex matches differently on RE2, falling back to re: {pattern.pattern!r}")
+            return pattern
+        letters = "".join(letter for flag, letter in self.INLINE_FLAGS if pattern.flags & flag)
+        try:
+            return self.re2.compile(f"(?{letters}){translated}" if letters else translated)
+        except Exception:
+            logger.info(f"Regex uses features that RE2 does not support, falling back to re: {pattern.pattern!r}")
+            return pattern
+
+    def translate(self, pattern: str, flags: int) -> Optional[str]:
+        """Translate the escapes of `pattern` whose meaning differs on RE2, or return None if one cannot be translated"""
+        if not isinstance(pattern, str):
+            return None
+        translated = []
+        in_class = False
+        index = 0
+        while index < len(pattern):
+            char = pattern[index]
+            if char == "\\" and index + 1 < len(pattern):
+                escape = pattern[index + 1]
+                if escape in self.escapes:
+                    char = self.escapes[escape][in_class]
+                    if char is None:
+                        return None
+                else:
+                    char = pattern[index:index + 2]
+                index += 2
+                translated.append(char)
+                continue
+            if in_class:
+                if char == "[":
+                    return None  # a literal `[` in `re`, but the start of e.g. `[:alpha:]` in RE2
+                if char == "]":
+                    in_class = False
+            elif char == "[":
+                in_class = True
+                # a `]` right after the opening bracket (or its negation) is a literal
+                closing = index + 2 if pattern.startswith("[^", index) else index + 1
+                if pattern.startswith("]", closing):
+                    translated.append(pattern[index:closing + 1])
+                    index = closing + 1
+                    continue
+            elif char == "$" and not flags & re.MULTILINE:
+                return None  # `re` also matches before a final newline
+            translated.append(char)
+            index += 1
+        return "".join(translated)
+
+
+REGEX_ENGINES = {
+    RegexEngine.name: RegexEngine,
+    Re2Engine.name: Re2Engine,
+}
+
+
+def create_regex_engine(name: str) -> RegexEngine:
+    """Create the named regex engine, falling back to the `re` engine if it is unknown or its package is not installed"""
+    if name not in REGEX_ENGINES:
+        logger.warning(f"Unknown regex engine {name}, defaulting to re. Available engines: {list(REGEX_ENGINES)}")
+        return RegexEngine()
+    try:
+        return REGEX_ENGINES[name]()
+    except ImportError as e:
+        logger.warning(f"Regex engine {name} is not installed ({e}), defaulting to re.")
+        return RegexEngine()
@@ -0,0 +1,157 @@
+import functools
+import multiprocessing
+import queue
+import re
+from typing import List, Tuple
+
+from regex_syntax import parse_pattern, sre
+
+# the standard library `re` engine cannot be interrupted once a match is running, so the only way to bound the time a
+# custom regex can take is to run it in a separate process that can be killed
+
+
+class RegexRejectedError(Exception):
+    """Raised when a custom regex is refused, either up front or because it overran its execution budget"""
+
+
+class RegexTimeoutError(RegexRejectedError):
+    """Raised when a regex does not finish within its execution budget"""
+
+
+@functools.lru_cache(maxsize=1024)
+def has_nested_quantifier(pattern: re.Pattern) -> bool:
+    """
+    Check for a quantified group that contains another unbounded quantifier, like `(a+)+` or `(\\w*\\s?)*`, the classic
+    shape of catastrophic backtracking. Possessive quantifiers and atomic groups cannot backtrack, so they are allowed.
+    Without the parser of `re` nothing is rejected up front, and the execution budget alone bounds the regex
+    """
+    items = parse_pattern(pattern)
+    return items is not None and _has_nested_quantifier(items)
+
+
+def _children(op, av) -> list:
+    """The parsed sub-sequences of a parse tree node, atomic groups and possessive repeats excluded"""
+    if op in (sre.MAX_REPEAT, sre.MIN_REPEAT):
+        return [av[2]]
+    if op == sre.SUBPATTERN:
+        return [av[3]]
+    if op == sre.BRANCH:
+        return av[1]
+    if op in (sre.ASSERT, sre.ASSERT_NOT):
+        return [av[1]]
+    return []
+
+
+def _contains_unbounded_repeat(items) -> bool:
+    for op, av in items:
+        if op in (sre.MAX_REPEAT, sre.MIN_REPEAT) and av[1] == sre.MAXREPEAT:
+            return True
+        if any(_contains_unbounded_repeat(child) for child in _children(op, av)):
+            return True
+    return False
+
+
+def _has_nested_quantifier(items) -> bool:
+    for op, av in items:
+        if op in (sre.MAX_REPEAT, sre.MIN_REPEAT) and av[1] > 1 and _contains_unbounded_repeat(av[2]):
+            return True
+        if any(_has_nested_quantifier(child) for child in _children(op, av)):
+            return True
+    return False
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(pattern: str, flags: int) -> re.Pattern:
+    return re.compile(pattern, flags)
+
+
+def _worker_main(connection):
+    """Serve (pattern, flags, string) requests from the parent process, answering with match spans or an error message"""
+    connection.send(True)  # ready, so that the process start up time is not charged to the first regex's budget
+    while True:
+        try:
+            pattern, flags, string = connection.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            spans = [match.span() for match in _compile(pattern, flags).finditer(string)]
+            connection.send((True, spans))
+        except Exception as e:
+            connection.send((False, f"{type(e).__name__}: {e}"))
+
+
+class RegexWorker:
+    """A single child process running regexes, restarted whenever a regex overruns its budget"""
+    def __init__(self, context):
+        self.context = context
+        self.process = None
+        self.connection = None
+
+    def start(self):
+        self.connection, child_connection = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_main, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.connection.recv()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+        self.process, self.connection = None, None
+
+    def finditer_spans(self, pattern: re.Pattern, string: str, timeout: float) -> List[Tuple[int, int]]:
+        if self.process is None or not self.process.is_alive():
+            self.stop()
+            self.start()
+        self.connection.send((pattern.pattern, pattern.flags, string))
+        if not self.connection.poll(timeout):
+            self.stop()
+            raise RegexTimeoutError(f"Regex did not finish within {timeout}s")
+        ok, result = self.connection.recv()
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+
+class RegexSandbox:
+    """
+    A pool of worker processes that run regexes under a wall-clock budget. A worker whose regex overruns the budget is
+    killed and replaced, so a catastrophic pattern costs at most `timeout` seconds instead of pinning a server worker.
+    """
+    def __init__(self, timeout: float, workers: int = 2):
+        self.timeout = timeout
+        context = multiprocessing.get_context("spawn")
+        self.workers = [RegexWorker(context) for _ in range(max(workers, 1))]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.closed = False
+
+    def finditer_spans(self, pattern: re.Pattern, string: str) -> List[Tuple[int, int]]:
+        """The (start, end) spans of `pattern.finditer(string)`, raising a RegexTimeoutError if the budget is exceeded"""
+        worker = self.idle.get()
+        try:
+            if self.closed:
+                raise RuntimeError("The regex sandbox has been shut down")
+            return worker.finditer_spans(pattern, string, self.timeout)
+        finally:
+            # a worker that was busy during the shutdown is stopped once its regex is done
+            if self.closed:
+                worker.stop()
+            # stopped workers are returned too, so that the calls waiting for one wake up and fail
+            self.idle.put(worker)
+
+    def shutdown(self):
+        """Stop every worker, and refuse the regexes that come after"""
+        self.closed = True
+        idle = []
+        while True:
+            try:
+                idle.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        for worker in idle:
+            worker.stop()
+            self.idle.put(worker)
@@ -0,0 +1,26 @@
+import re
+from typing import Optional
+
+# the parser of `re` is private: it moved from `sre_parse`/`sre_constants` into `re._parser`/`re._constants` in Python
+# 3.11, and may move again. The pattern analyses built on it are optimizations and safety checks, so when the parser
+# cannot be found they are skipped, rather than breaking the import of the server
+try:
+    from re import _constants as sre, _parser as sre_parse
+except ImportError:
+    try:
+        import sre_constants as sre
+        import sre_parse
+    except ImportError:
+        sre, sre_parse = None, None
+
+
+def get_opcode(name: str):
+    """The opcode `name` of the parser, or None if this Python version does not have it, e.g. `ATOMIC_GROUP` before 3.11"""
+    return getattr(sre, name, None)
+
+
+def parse_pattern(pattern: re.Pattern) -> Optional[list]:
+    """The parsed items of a compiled pattern, or None if the parser of `re` is not available"""
+    if sre_parse is None:
+        return None
+    return sre_parse.parse(pattern.pattern, pattern.flags).data
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from base_detector_registry import BaseDetectorRegistry, DetectorPlan
+from cache import LRUCache
+from config import get_float_env, get_int_env
+from detection_record import Detection
+
+logger = logging.getLogger(__name__)
+
+# rough memory cost of a cache entry and of each cached detection, on top of the detection texts
+ENTRY_OVERHEAD_BYTES = 512
+DETECTION_OVERHEAD_BYTES = 400
+
+
+def content_digest(content: str) -> bytes:
+    """Address contents by a hash, so that the cache does not hold on to the contents themselves"""
+    return hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def estimate_result_size(result: Tuple[Tuple[Detection, ...], Tuple[Tuple[str, bool], ...]]) -> int:
+    detections, _ = result
+    return ENTRY_OVERHEAD_BYTES + sum(DETECTION_OVERHEAD_BYTES + sys.getsizeof(detection.text) for detection in detections)
+
+
+class ResultCache:
+    """
+    A content-addressed cache in front of `BaseDetectorRegistry.run_plan_contents`.
+
+    Results are keyed by the registry, the cache parameters of its plan and a hash of the content. Registries decide
+    which requests are cacheable through `get_cache_params`. The detector metrics that a request updated are recorded
+    with its result and replayed on every hit, so request and detection counts do not depend on whether the cache
+    served a request. Runtimes are not replayed: a hit adds no detector latency.
+    """
+    def __init__(self, maxsize: int, ttl: float = 0, max_bytes: int = 0):
+        self.cache = LRUCache("results", maxsize, ttl=ttl or None, max_bytes=max_bytes or None, sizeof=estimate_result_size)
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        return cls(
+            maxsize=get_int_env("RESULT_CACHE_SIZE", 0),
+            ttl=get_float_env("RESULT_CACHE_TTL", 300.0),
+            max_bytes=get_int_env("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache.maxsize > 0
+
+    def set_instruments(self, instruments: dict):
+        self.cache.set_instruments(instruments)
+
+    def handle_request(self, registry: BaseDetectorRegistry, content: str, detector_params: dict, headers: dict) -> List[Detection]:
+        return self.run_plan(registry, registry.get_plan(detector_params), content, headers)
+
+    def run_plan(self, registry: BaseDetectorRegistry, plan: DetectorPlan, content: str, headers: dict) -> List[Detection]:
+        return self.run_plan_contents(registry, plan, [content], headers)[0]
+
+    def run_plan_contents(self, registry: BaseDetectorRegistry, plan: DetectorPlan, contents: List[str], headers: dict) -> List[List[Detection]]:
+        """Serve the contents that are cached, and run the registry on the others, all at once"""
+        if not self.enabled or plan.cache_params is None:
+            return registry.run_plan_contents(plan, contents, headers)
+        results, missing = self.lookup(registry, plan, contents)
+        if not missing:
+            return results
+        first_indices = [indices[0] for indices in missing.values()]
+        recordings = [None] * len(first_indices)
+        # errors propagate before anything is stored, so failed requests are never cached
+        detections = registry.run_plan_contents(plan, [contents[index] for index in first_indices], headers, recordings)
+        return self.store(registry, results, missing, detections, recordings)
+
+    async def run_plan_contents_async(self, registry: BaseDetectorRegistry, plan: DetectorPlan, contents: List[str], headers: dict) -> List[List[Detection]]:
+        """`run_plan_contents` for the server's event loop, see `BaseDetectorRegistry.run_plan_contents_async`"""
+        if not self.enabled or plan.cache_params is None:
+            return await registry.run_plan_contents_async(plan, contents, headers)
+        results, missing = self.lookup(registry, plan, contents)
+        if not missing:
+            return results
+        first_indices = [indices[0] for indices in missing.values()]
+        recordings = [None] * len(first_indices)
+        detections = await registry.run_plan_contents_async(plan, [contents[index] for index in first_indices], headers, recordings)
+        return self.store(registry, results, missing, detections, recordings)
+
+    def lookup(self, registry: BaseDetectorRegistry, plan: DetectorPlan, contents: List[str]) -> Tuple[list, Dict[tuple, List[int]]]:
+        """
+        The results of the cached contents, and the indices of each uncached content, so that repeated contents of a
+        request are only run once
+        """
+        keys = [(registry.registry_name, plan.cache_params, content_digest(content)) for content in contents]
+        results: List[Optional[List[Detection]]] = [None] * len(contents)
+        missing: Dict[tuple, List[int]] = {}
+        for index, key in enumerate(keys):
+            if key in missing:
+                missing[key].append(index)
+                continue
+            cached = self.cache.get(key)
+            if cached is None:
+                missing[key] = [index]
+            else:
+                results[index] = self.replay(registry, cached)
+        return results, missing
+
+    def store(self, registry: BaseDetectorRegistry, results: list, missing: Dict[tuple, List[int]], detections, recordings) -> List[List[Detection]]:
+        """Cache the detections of the uncached contents, and fill them into the results"""
+        for (key, indices), content_detections, recorded_instruments in zip(missing.items(), detections, recordings):
+            entry = (tuple(content_detections), tuple(recorded_instruments))
+            self.cache.put(key, entry)
+            results[indices[0]] = content_detections
+            # repeated contents are served as hits, exactly as if they had come in a later request
+            for index in indices[1:]:
+                results[index] = self.replay(registry, self.cache.get(key) or entry)
+        return results
+
+    @staticmethod
+    def replay(registry: BaseDetectorRegistry, cached) -> List[Detection]:
+        detections, recorded_instruments = cached
+        for function_name, is_detection in recorded_instruments:
+            registry.increment_detector_instruments(function_name, is_detection)
+        return list(detections)
@@ -0,0 +1,43 @@
+import hashlib
+import time
+from typing import Any, Callable
+
+from cache import LRUCache
+
+
+def schema_digest(schema: str) -> bytes:
+    """Key schemas by a hash, so that the cache keys do not hold on to the (possibly large) schema strings"""
+    return hashlib.blake2b(schema.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class CompiledSchemaCache:
+    """
+    A bounded cache from schema strings to their compiled form, e.g. a prebuilt validator.
+
+    `compile(schema)` builds the compiled form. Schemas that are deterministically invalid can be cached as whatever
+    the compile function returns for them, exceptions are not cached. Hits and misses are reported by the underlying
+    `LRUCache`, the time spent compiling to the `schema_compile_time` instrument, labelled with the cache name.
+    """
+    def __init__(self, name: str, compile: Callable[[str], Any], maxsize: int):
+        self.name = name
+        self.compile = compile
+        self.cache = LRUCache(name, maxsize)
+        self.instruments = {}
+
+    def set_instruments(self, instruments: dict):
+        self.instruments = instruments
+        self.cache.set_instruments(instruments)
+
+    def timed_compile(self, schema: str) -> Any:
+        start_time = time.perf_counter()
+        try:
+            return self.compile(schema)
+        finally:
+            if self.instruments.get("schema_compile_time"):
+                self.instruments["schema_compile_time"].labels(self.name).inc(time.perf_counter() - start_time)
+
+    def get(self, schema: str) -> Any:
+        return self.cache.get_or_create(schema_digest(schema), lambda: self.timed_compile(schema))
+
+    def clear(self):
+        self.cache.clear()
@@ -0,0 +1,248 @@
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+from xml.parsers import expat
+
+import yaml
+
+from config import get_int_env
+
+# contents of at least this many UTF-8 bytes are checked by streaming over them, rather than by building their object
+# tree. 0, the default, disables streaming: the streamed checks accept some documents that the parsers refuse, e.g.
+# YAML scalars with a tag their value does not fit (`a: !!int abc`), so a document's verdict could depend on its size
+STREAMING_THRESHOLD = get_int_env("FILE_TYPE_STREAMING_THRESHOLD", 0)
+# limits of the streamed documents. A max size of 0 removes the size limit.
+STREAMING_MAX_DEPTH = get_int_env("FILE_TYPE_STREAMING_MAX_DEPTH", 512, minimum=1)
+STREAMING_MAX_BYTES = get_int_env("FILE_TYPE_STREAMING_MAX_BYTES", 0)
+
+# the size of the pieces that XML documents are handed to expat in, so that expat never holds a full encoded copy
+XML_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True)
+class StreamError:
+    """The first error of a streamed document: its character position, its UTF-8 byte offset, and what went wrong"""
+    position: int
+    byte_offset: int
+    reason: str
+
+
+def utf8_length(text: str) -> int:
+    # ASCII text, by far the most common, is measured without encoding it
+    return len(text) if text.isascii() else len(text.encode("utf-8", "surrogatepass"))
+
+
+def error_at(text: str, position: int, reason: str) -> StreamError:
+    position = max(0, min(position, len(text)))
+    return StreamError(position, utf8_length(text[:position]), reason)
+
+
+def error_at_byte(text: str, byte_offset: int, reason: str) -> StreamError:
+    byte_offset = max(0, byte_offset)
+    prefix = text.encode("utf-8", "surrogatepass")[:byte_offset]
+    return StreamError(len(prefix.decode("utf-8", "ignore")), byte_offset, reason)
+
+
+def check_size(text: str, max_bytes: int) -> Optional[StreamError]:
+    if max_bytes and utf8_length(text) > max_bytes:
+        return error_at_byte(text, max_bytes, f"Document exceeds the maximum size of {max_bytes} bytes")
+    return None
+
+
+# the JSON tokens, each after optional whitespace, exactly as `json.loads` reads them: its C scanner only accepts ASCII
+# digits, and strict strings without control characters. Strings are matched without backtracking.
+JSON_TOKEN = re.compile(r"""
+    [ \t\n\r]*
+    (?:
+        ([{\[])
+        | ([}\]])
+        | (,)
+        | (:)
+        | ("[^"\\\x00-\x1f]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*)*")
+        | (-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?|null|true|false|NaN|Infinity|-Infinity)
+    )
+""", re.VERBOSE)
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+JSON_OPEN, JSON_CLOSE, JSON_COMMA, JSON_COLON, JSON_STRING, JSON_SCALAR = range(1, 7)
+JSON_CLOSERS = {"{": "}", "[": "]"}
+
+# what the scanner expects next
+EXPECT_VALUE, EXPECT_FIRST_VALUE, EXPECT_KEY, EXPECT_FIRST_KEY, EXPECT_COLON, EXPECT_END = range(6)
+JSON_EXPECTATIONS = {
+    EXPECT_VALUE: "Expecting value",
+    EXPECT_FIRST_VALUE: "Expecting value",
+    EXPECT_KEY: "Expecting property name enclosed in double quotes",
+    EXPECT_FIRST_KEY: "Expecting property name enclosed in double quotes",
+    EXPECT_COLON: "Expecting ':' delimiter",
+    EXPECT_END: "Expecting ',' delimiter",
+}
+
+
+def check_json_stream(text: str, max_depth: int = STREAMING_MAX_DEPTH, max_bytes: int = STREAMING_MAX_BYTES) -> Optional[StreamError]:
+    """
+    Check that the text is valid JSON token by token, without building its objects: it accepts exactly the documents
+    that `json.loads` accepts, up to the depth and size limits. Returns the first error, or None.
+    """
+    error = check_size(text, max_bytes)
+    if error is not None:
+        return error
+    match = JSON_TOKEN.match
+    # the open containers, as their opening brackets
+    stack = []
+    expect = EXPECT_VALUE
+    position = 0
+    while True:
+        token = match(text, position)
+        if token is None:
+            break
+        kind = token.lastindex
+        if expect == EXPECT_END:
+            if not stack:
+                return error_at(text, token.start(kind), "Extra data")
+            if kind == JSON_COMMA:
+                expect = EXPECT_KEY if stack[-1] == "{" else EXPECT_VALUE
+            elif kind == JSON_CLOSE and token.group(kind) == JSON_CLOSERS[stack.pop()]:
+                pass
+            else:
+                return error_at(text, token.start(kind), JSON_EXPECTATIONS[expect])
+        elif expect <= EXPECT_FIRST_VALUE:
+            if kind == JSON_STRING or kind == JSON_SCALAR:
+                expect = EXPECT_END
+            elif kind == JSON_OPEN:
+                bracket = token.group(kind)
+                stack.append(bracket)
+                if len(stack) > max_depth:
+                    return error_at(text, token.start(kind), f"Document exceeds the maximum depth of {max_depth}")
+                expect = EXPECT_FIRST_KEY if bracket == "{" else EXPECT_FIRST_VALUE
+            elif expect == EXPECT_FIRST_VALUE and token.group(kind) == "]":
+                stack.pop()
+                expect = EXPECT_END
+            else:
+                return error_at(text, token.start(kind), JSON_EXPECTATIONS[expect])
+        elif expect == EXPECT_COLON:
+            if kind != JSON_COLON:
+                return error_at(text, token.start(kind), JSON_EXPECTATIONS[expect])
+            expect = EXPECT_VALUE
+        else:
+            if kind == JSON_STRING:
+                expect = EXPECT_COLON
+            elif expect == EXPECT_FIRST_KEY and token.group(kind) == "}":
+                stack.pop()
+                expect = EXPECT_END
+            else:
+                return error_at(text, token.start(kind), JSON_EXPECTATIONS[expect])
+        position = token.end()
+
+    position = JSON_WHITESPACE.match(text, position).end()
+    if position == len(text) and expect == EXPECT_END and not stack:
+        return None
+    if expect == EXPECT_END and not stack:
+        return error_at(text, position, "Extra data")
+    if text.startswith('"', position):
+        return error_at(text, position, "Unterminated string or invalid character in string")
+    return error_at(text, position, JSON_EXPECTATIONS[expect])
+
+
+# the tags that `yaml.safe_load` can construct, besides the implicit ones
+YAML_SAFE_TAGS = frozenset(tag for tag in yaml.SafeLoader.yaml_constructors if tag is not None) | {"!"}
+
+
+def check_yaml_stream(text: str, max_depth: int = STREAMING_MAX_DEPTH, max_bytes: int = STREAMING_MAX_BYTES) -> Optional[StreamError]:
+    """
+    Check that the text is a valid YAML document from its parse events, without composing or constructing it. Besides
+    the syntax, this checks what `yaml.safe_load` would refuse before building values: several documents, unknown
+    aliases and tags that it cannot construct. Values that the safe constructor rejects, e.g. an impossible
+    `!!timestamp`, are not checked. Returns the first error, or None.
+    """
+    error = check_size(text, max_bytes)
+    if error is not None:
+        return error
+    # the events come from the pure-Python loader: libyaml does not refuse the same documents as `yaml.safe_load`, e.g.
+    # it accepts tabs around values, and a streamed content must get the same verdict as a parsed one
+    depth, documents, anchors = 0, 0, set()
+    try:
+        for event in yaml.parse(text, Loader=yaml.SafeLoader):
+            if isinstance(event, yaml.DocumentStartEvent):
+                documents += 1
+                if documents > 1:
+                    return error_at(text, event.start_mark.index, "Expected a single document in the stream")
+                anchors.clear()
+            elif isinstance(event, yaml.AliasEvent):
+                if event.anchor not in anchors:
+                    return error_at(text, event.start_mark.index, f"Found undefined alias {event.anchor}")
+            elif isinstance(event, yaml.NodeEvent):
+                if event.anchor is not None:
+                    if event.anchor in anchors:
+                        return error_at(text, event.start_mark.index, f"Found duplicate anchor {event.anchor}")
+                    anchors.add(event.anchor)
+                tag = getattr(event, "tag", None)
+                if tag is not None and tag not in YAML_SAFE_TAGS:
+                    return error_at(text, event.start_mark.index, f"Could not determine a constructor for the tag {tag}")
+                if isinstance(event, yaml.CollectionStartEvent):
+                    depth += 1
+                    if depth > max_depth:
+                        return error_at(text, event.start_mark.index, f"Document exceeds the maximum depth of {max_depth}")
+            elif isinstance(event, yaml.CollectionEndEvent):
+                depth -= 1
+    except yaml.MarkedYAMLError as e:
+        mark = e.problem_mark or e.context_mark
+        return error_at(text, mark.index if mark is not None else 0, e.problem or str(e))
+    except yaml.reader.ReaderError as e:
+        return error_at(text, e.position, e.reason)
+    except yaml.YAMLError as e:
+        return error_at(text, 0, str(e))
+    return None
+
+
+class XMLDepthExceeded(Exception):
+    def __init__(self, byte_offset: int):
+        super().__init__(byte_offset)
+        self.byte_offset = byte_offset
+
+
+def check_xml_stream(text: str, max_depth: int = STREAMING_MAX_DEPTH, max_bytes: int = STREAMING_MAX_BYTES) -> Optional[StreamError]:
+    """
+    Check that the text is well-formed XML from expat's events, without building its element tree: it accepts exactly
+    the documents that `xml.etree.ElementTree.fromstring` accepts, up to the depth and size limits. Returns the first
+    error, or None.
+    """
+    error = check_size(text, max_bytes)
+    if error is not None:
+        return error
+    # set up as ElementTree sets up its parser, as namespace processing rejects e.g. unbound prefixes
+    parser = expat.ParserCreate(None, "}")
+    depth = 0
+
+    def start_element(name, attributes):
+        nonlocal depth
+        depth += 1
+        if depth > max_depth:
+            # expat moves on once the handler raises, so the offset of the element is taken here
+            raise XMLDepthExceeded(parser.CurrentByteIndex)
+
+    def end_element(name):
+        nonlocal depth
+        depth -= 1
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    start = 0
+    try:
+        for start in range(0, len(text), XML_CHUNK_SIZE):
+            parser.Parse(text[start:start + XML_CHUNK_SIZE], False)
+        parser.Parse("", True)
+    except UnicodeEncodeError as e:
+        # lone surrogates, which cannot be handed to expat
+        return error_at(text, start + e.start, "Invalid character")
+    except XMLDepthExceeded as e:
+        return error_at_byte(text, e.byte_offset, f"Document exceeds the maximum depth of {max_depth}")
+    except expat.ExpatError as e:
+        return error_at_byte(text, parser.ErrorByteIndex, expat.ErrorString(e.code))
+    return None
+
+
+STREAMING_CHECKS: Dict[str, Callable[[str], Optional[StreamError]]] = {
+    "json": check_json_stream,
+    "yaml": check_yaml_stream,
+    "xml": check_xml_stream,
+}
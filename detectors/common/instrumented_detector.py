@@ -1,5 +1,6 @@
 import contextlib
 import time
+from typing import List
 
 
 class InstrumentedDetector:
@@ -17,6 +18,16 @@ class InstrumentedDetector:
         finally:
             pass
 
+    @contextlib.contextmanager
+    def instrument_shared_runtime(self, function_names: List[str]):
+        """Time work that is shared by several detector functions, splitting the runtime evenly between them"""
+        start_time = time.time()
+        yield
+        if self.instruments.get("runtime") and function_names:
+            share = (time.time() - start_time) / len(function_names)
+            for function_name in function_names:
+                self.instruments["runtime"].labels(self.registry_name, function_name).inc(share)
+
     def set_instruments(self, instruments):
         self.instruments = instruments
 
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from tests.detectors.builtIn.test_result_cache import RecordingInstrument
+
+
+@pytest.fixture
+def instruments():
+    return {name: RecordingInstrument() for name in ["background_queue_depth", "background_tasks", "background_task_time", "background_task_drops"]}
+
+
+def make_queue(instruments, **kwargs):
+    from detectors.built_in.background_tasks import BackgroundTaskQueue
+    queue = BackgroundTaskQueue("test", **kwargs)
+    queue.set_instruments(instruments)
+    return queue
+
+
+def block_workers(queue, workers=1):
+    """Occupy every worker of the queue until the returned event is set"""
+    release, started = threading.Event(), threading.Semaphore(0)
+
+    def blocker():
+        started.release()
+        release.wait()
+    for _ in range(workers):
+        queue.submit("blocker", blocker)
+    for _ in range(workers):
+        started.acquire()
+    return release
+
+
+class TestBackgroundTaskQueue:
+    def test_unknown_overflow_policy_defaults_to_drop_oldest(self):
+        from detectors.built_in.background_tasks import BackgroundTaskQueue
+        assert BackgroundTaskQueue("test", overflow="drop_everything").overflow == "drop_oldest"
+
+    def test_from_env(self, monkeypatch):
+        from detectors.built_in.background_tasks import BackgroundTaskQueue
+        monkeypatch.setenv("NON_BLOCKING_WORKERS", "2")
+        monkeypatch.setenv("NON_BLOCKING_MAX_QUEUE", "5")
+        monkeypatch.setenv("NON_BLOCKING_OVERFLOW", "Run_Inline")
+        monkeypatch.setenv("NON_BLOCKING_DRAIN_TIMEOUT", "1.5")
+        queue = BackgroundTaskQueue.from_env("test")
+        assert (queue.workers, queue.max_queue, queue.overflow, queue.drain_timeout) == (2, 5, "run_inline", 1.5)
+
+    def test_runs_tasks_in_the_background(self, instruments):
+        queue = make_queue(instruments, workers=2)
+        done = threading.Event()
+        queue.submit("task", done.set)
+        assert done.wait(1)
+        queue.drain()
+        assert instruments["background_tasks"].values[("test", "task")] == 1
+        assert instruments["background_task_time"].values[("test", "task")] > 0
+
+    @pytest.mark.parametrize("overflow, expected_runs, expected_drops", [
+        ("drop_oldest", ["c", "d"], {("test", "a", "queue_full"): 1, ("test", "b", "queue_full"): 1}),
+        ("drop_new", ["a", "b"], {("test", "c", "queue_full"): 1, ("test", "d", "queue_full"): 1}),
+    ])
+    def test_overflow_drops(self, instruments, overflow, expected_runs, expected_drops):
+        queue = make_queue(instruments, workers=1, max_queue=2, overflow=overflow)
+        release = block_workers(queue)
+        runs = []
+        for name in ["a", "b", "c", "d"]:
+            queue.submit(name, lambda name=name: runs.append(name))
+        assert len(queue) == 2
+        assert instruments["background_queue_depth"].values[("test",)] == 2
+        release.set()
+        queue.drain()
+        assert runs == expected_runs
+        assert dict(instruments["background_task_drops"].values) == expected_drops
+        assert instruments["background_queue_depth"].values[("test",)] == 0
+
+    def test_overflow_runs_inline(self, instruments):
+        queue = make_queue(instruments, workers=1, max_queue=1, overflow="run_inline")
+        release = block_workers(queue)
+        threads = {}
+        for name in ["queued", "inline"]:
+            queue.submit(name, lambda name=name: threads.update({name: threading.get_ident()}))
+        assert threads == {"inline": threading.get_ident()}
+        release.set()
+        queue.drain()
+        assert threads["queued"] != threading.get_ident()
+        assert not instruments["background_task_drops"].values
+
+    def test_drain_waits_for_waiting_tasks(self, instruments):
+        queue = make_queue(instruments, workers=1)
+        runs = []
+        for i in range(5):
+            queue.submit("slow", lambda i=i: time.sleep(0.05) or runs.append(i))
+        queue.drain(timeout=5)
+        assert runs == [0, 1, 2, 3, 4]
+        # the queue takes tasks again after a drain
+        done = threading.Event()
+        queue.submit("again", done.set)
+        assert done.wait(1)
+        queue.drain()
+
+    def test_drain_drops_the_tasks_left_after_its_timeout(self, instruments):
+        queue = make_queue(instruments, workers=1)
+        release = block_workers(queue)
+        queue.submit("late", lambda: None)
+        start = time.time()
+        queue.drain(timeout=0.2)
+        assert time.time() - start < 1
+        assert instruments["background_task_drops"].values[("test", "late", "shutdown")] == 1
+        release.set()
+
+    def test_errors_are_contained(self, instruments, caplog):
+        queue = make_queue(instruments, workers=1)
+
+        def fail():
+            raise ValueError("boom")
+        queue.submit("failing", fail)
+        queue.drain()
+        assert "Exception in background task failing of test: boom" in caplog.text
+        assert instruments["background_tasks"].values[("test", "failing")] == 1
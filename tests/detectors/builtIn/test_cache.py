@@ -0,0 +1,70 @@
+import pytest
+
+
+class TestLRUCache:
+    @pytest.fixture
+    def cache(self):
+        from detectors.built_in.cache import LRUCache
+        return LRUCache("test", maxsize=2)
+
+    def test_get_or_create(self, cache):
+        calls = []
+        factory = lambda: calls.append(1) or "value"
+        assert cache.get_or_create("key", factory) == "value"
+        assert cache.get_or_create("key", factory) == "value"
+        assert len(calls) == 1
+
+    def test_evicts_least_recently_used(self, cache):
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+        assert len(cache) == 2
+
+    def test_factory_errors_are_not_cached(self, cache):
+        def factory():
+            raise ValueError("boom")
+        with pytest.raises(ValueError):
+            cache.get_or_create("key", factory)
+        assert "key" not in cache
+
+    def test_zero_size_cache_stores_nothing(self):
+        from detectors.built_in.cache import LRUCache
+        cache = LRUCache("test", maxsize=0)
+        cache.put("key", "value")
+        assert len(cache) == 0
+
+    def test_custom_regex_cache_size_from_env(self, monkeypatch):
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry
+        monkeypatch.setenv("REGEX_CACHE_SIZE", "3")
+        assert RegexDetectorRegistry().regex_cache.maxsize == 3
+        monkeypatch.setenv("REGEX_CACHE_SIZE", "not-a-number")
+        assert RegexDetectorRegistry().regex_cache.maxsize == 1024
+
+    def test_ttl_expiry(self, monkeypatch):
+        from detectors.built_in import cache as cache_module
+        from detectors.built_in.cache import LRUCache
+        now = [100.0]
+        monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+        cache = LRUCache("test", maxsize=10, ttl=5)
+        cache.put("key", "value")
+        now[0] += 4
+        assert cache.get("key") == "value"
+        now[0] += 2
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+    def test_memory_cap(self):
+        from detectors.built_in.cache import LRUCache
+        cache = LRUCache("test", maxsize=10, max_bytes=10, sizeof=len)
+        cache.put("a", "12345")
+        cache.put("b", "12345")
+        cache.put("c", "1234")
+        assert "a" not in cache
+        assert cache.current_bytes == 9
+        # values larger than the whole cache are not stored at all
+        cache.put("d", "12345678901")
+        assert "d" not in cache and "b" in cache
@@ -1,5 +1,6 @@
 import importlib
 import sys
+import time
 from http.client import HTTPException
 
 import pytest
@@ -34,6 +35,195 @@ def func(text: str) -> bool:
     return True
 '''
 
+ASYNC_CODE = '''
+import asyncio
+
+async def slow_lookup(text: str) -> bool:
+    await asyncio.sleep(0.2)
+    return "apple" in text
+
+async def slow_report(text: str, headers: dict) -> dict:
+    await asyncio.sleep(0.2)
+    if headers.get("magic-key") == "wrong":
+        return {"start": 0, "end": 1, "text": text[:1], "detection_type": "async", "detection": "bad_key", "score": 0.5}
+    return {}
+
+async def async_failure(text: str) -> bool:
+    raise ValueError("lookup failed")
+
+def sync_check(text: str) -> bool:
+    return "banana" in text
+
+@use_instruments(instruments=[])
+async def decorated_lookup(text: str) -> bool:
+    await asyncio.sleep(0)
+    return "apple" in text
+'''
+
+ISOLATED_CODE = '''
+import time
+
+@isolated()
+def count_vowels(text: str) -> dict:
+    vowels = sum(text.count(vowel) for vowel in "aeiou")
+    if vowels > 4:
+        return {"start": 0, "end": len(text), "text": text, "detection_type": "isolated", "detection": f"vowels: {vowels}", "score": 1.0}
+    return {}
+
+@isolated()
+def needs_headers(text: str, headers: dict) -> bool:
+    return headers.get("magic-key") == "wrong"
+
+@isolated(timeout=0.5)
+def too_slow(text: str) -> bool:
+    time.sleep(5)
+    return True
+
+@non_cacheable
+@isolated()
+def decorated(text: str) -> bool:
+    return "apple" in text
+
+def in_process(text: str) -> bool:
+    return "banana" in text
+'''
+
+CACHED_CODE = '''
+import asyncio
+
+calls = {"expensive": 0, "with_kwargs": 0, "small": 0, "short_lived": 0, "async_lookup": 0, "stacked": 0, "failing": 0}
+
+@cached()
+def expensive(text: str) -> bool:
+    calls["expensive"] += 1
+    return "apple" in text
+
+@cached()
+def with_kwargs(text: str, **kwargs: dict) -> bool:
+    calls["with_kwargs"] += 1
+    return kwargs.get("word", "") in text
+
+@cached(maxsize=1)
+def small(text: str) -> bool:
+    calls["small"] += 1
+    return False
+
+@cached(ttl=0.1)
+def short_lived(text: str) -> bool:
+    calls["short_lived"] += 1
+    return False
+
+@cached()
+async def async_lookup(text: str) -> bool:
+    calls["async_lookup"] += 1
+    await asyncio.sleep(0)
+    return "apple" in text
+
+@non_cacheable
+@use_instruments(instruments=[])
+@cached()
+def stacked(text: str) -> bool:
+    calls["stacked"] += 1
+    return "apple" in text
+
+@cached()
+def failing(text: str) -> bool:
+    calls["failing"] += 1
+    raise ValueError("not cached")
+'''
+
+BATCHED_CODE = '''
+import asyncio
+
+batches = []
+
+@batched
+def classify(texts: list) -> list:
+    batches.append(list(texts))
+    return ["apple" in text for text in texts]
+
+@batched
+def classify_with_kwargs(texts: list, headers: dict, **kwargs: dict) -> list:
+    batches.append(list(texts))
+    return [
+        {"start": 0, "end": 1, "text": text[:1], "detection_type": "batched", "detection": kwargs["label"], "score": 0.5}
+        if headers.get("magic-key") in text else {}
+        for text in texts
+    ]
+
+@batched
+async def classify_async(texts: list) -> list:
+    batches.append(list(texts))
+    await asyncio.sleep(0)
+    return ["banana" in text for text in texts]
+
+@batched
+def wrong_length(texts: list) -> list:
+    return [True]
+
+def per_content(text: str) -> bool:
+    return "cherry" in text
+'''
+
+LIFECYCLE_CODE = '''
+import asyncio
+
+events = []
+resources = {}
+
+@on_startup
+def load_table():
+    events.append("load_table")
+    resources["table"] = {"apple", "banana"}
+
+@on_startup
+async def open_session():
+    await asyncio.sleep(0)
+    events.append("open_session")
+    resources["session"] = asyncio.get_running_loop()
+
+@on_shutdown
+async def close_session():
+    events.append("close_session")
+    resources["session_closed"] = resources["session"] is asyncio.get_running_loop()
+
+@on_shutdown
+def drop_table():
+    events.append("drop_table")
+    resources.pop("table")
+
+def in_table(text: str) -> bool:
+    return any(word in resources["table"] for word in text.split())
+
+@isolated()
+def in_table_isolated(text: str) -> bool:
+    return any(word in resources["table"] for word in text.split())
+'''
+
+FAILING_STARTUP_CODE = '''
+@on_startup
+def load_model():
+    raise RuntimeError("model not found")
+
+def detector(text: str) -> bool:
+    return True
+'''
+
+RELOAD_CODE = '''
+import time
+
+events = []
+
+@on_shutdown
+def release():
+    events.append("released")
+
+def version(text: str) -> dict:
+    if "slow" in text:
+        time.sleep(0.5)
+    return {"start": 0, "end": 1, "text": text[:1], "detection_type": "version", "detection": "VERSION", "score": 1.0}
+'''
+
 def write_code_to_custom_detectors(code: str):
     with open(CUSTOM_DETECTORS_PATH, "w") as f:
         f.write(code)
@@ -162,6 +352,28 @@ class TestCustomDetectors:
         assert True
 
 
+    def test_calls_do_not_introspect_functions(self, client, monkeypatch):
+        from detectors.built_in.app import app
+        registry = app.get_detector("custom")
+        plan = registry.get_plan({"custom": ["over_100_characters", "contains_word"]})
+        assert [step.function for step in plan.steps] == [registry.adapters["over_100_characters"], registry.adapters["contains_word"]]
+
+        import inspect
+
+        def fail(*args, **kwargs):
+            raise AssertionError("custom functions are only introspected when they are registered")
+        monkeypatch.setattr(inspect, "signature", fail)
+        payload = {
+            "contents": ["What is an apple?" * 10, "What is a banana?"],
+            "detector_params": {"custom": {"over_100_characters": {}, "contains_word": {}, "function_that_needs_kwargs": {"magic-key": "345"}}},
+        }
+        resp = client.post("/api/v1/text/contents", json=payload, headers={"magic-key": "123"})
+        assert resp.status_code == 200
+        assert [[d["detection"] for d in detections] for detections in resp.json()] == [
+            ["over_100_characters", "forbidden_word: apple", "function_that_needs_kwargs"],
+            ["function_that_needs_kwargs"],
+        ]
+
     def test_custom_detectors_func_doesnt_exist(self, client):
         payload = {
             "contents": ["What is an apple?"],
@@ -169,3 +381,485 @@ class TestCustomDetectors:
         }
         resp = client.post("/api/v1/text/contents", json=payload)
         assert resp.status_code == 400 and "Unrecognized custom function: abc" in resp.text
+
+
+class TestAsyncCustomDetectors:
+    @pytest.fixture
+    def client(self):
+        write_code_to_custom_detectors(ASYNC_CODE)
+        from detectors.built_in.app import app
+
+        import prometheus_client
+        prometheus_client.REGISTRY._names_to_collectors.clear()
+
+        from detectors.built_in.custom_detectors_wrapper import CustomDetectorRegistry
+        app.set_detector(CustomDetectorRegistry(), "custom")
+        return TestClient(app)
+
+    @pytest.fixture(autouse=True)
+    def cleanup_custom_detectors(self):
+        yield
+        restore_safe_code()
+
+    def test_async_functions_are_detected_at_load_time(self, client):
+        from detectors.built_in.app import app
+        registry = app.get_detector("custom")
+        assert {name: info.is_async for name, info in registry.function_info.items()} == {
+            "slow_lookup": True, "slow_report": True, "async_failure": True, "sync_check": False, "decorated_lookup": True,
+        }
+
+    def test_async_steps_are_awaited_concurrently(self, client):
+        # 4 contents with 2 async detectors sleeping 0.2s each would take 1.6s one after another
+        payload = {
+            "contents": ["an apple", "a banana", "an apple and a banana", "nothing"],
+            "detector_params": {"custom": ["slow_lookup", "sync_check", "slow_report", "decorated_lookup"]},
+        }
+        start = time.time()
+        resp = client.post("/api/v1/text/contents", json=payload, headers={"magic-key": "wrong"})
+        assert time.time() - start < 0.8
+        assert resp.status_code == 200
+        assert [[d["detection"] for d in detections] for detections in resp.json()] == [
+            ["slow_lookup", "bad_key", "decorated_lookup"],
+            ["sync_check", "bad_key"],
+            ["slow_lookup", "sync_check", "bad_key", "decorated_lookup"],
+            ["bad_key"],
+        ]
+
+    def test_async_errors(self, client):
+        payload = {"contents": ["an apple"], "detector_params": {"custom": ["slow_lookup", "async_failure"]}}
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert resp.status_code == 500
+
+    def test_async_steps_do_not_hold_a_thread(self, client):
+        from concurrent.futures import ThreadPoolExecutor
+        import anyio.to_thread
+        from detectors.built_in.app import app
+
+        payload = {"contents": ["an apple"], "detector_params": {"custom": ["slow_lookup", "sync_check"]}}
+        with TestClient(app) as server:
+            # with a single server thread, 4 requests holding it while they wait 0.2s each would take 0.8s
+            server.portal.call(lambda: setattr(anyio.to_thread.current_default_thread_limiter(), "total_tokens", 1))
+            start = time.time()
+            with ThreadPoolExecutor(4) as threads:
+                responses = list(threads.map(lambda _: server.post("/api/v1/text/contents", json=payload), range(4)))
+            assert time.time() - start < 0.6
+        assert [[d["detection"] for d in resp.json()[0]] for resp in responses] == [["slow_lookup"]] * 4
+
+
+class TestIsolatedCustomDetectors:
+    @pytest.fixture
+    def client(self, monkeypatch):
+        write_code_to_custom_detectors(ISOLATED_CODE)
+        from detectors.built_in.app import app
+
+        import prometheus_client
+        prometheus_client.REGISTRY._names_to_collectors.clear()
+
+        from detectors.built_in import custom_detectors_wrapper
+        monkeypatch.setattr(custom_detectors_wrapper.isolated_detectors, "workers", 2)
+        registry = custom_detectors_wrapper.CustomDetectorRegistry()
+        registry.start()
+        app.set_detector(registry, "custom")
+        yield TestClient(app)
+        custom_detectors_wrapper.isolated_detectors.shutdown()
+
+    @pytest.fixture(autouse=True)
+    def cleanup_custom_detectors(self):
+        yield
+        restore_safe_code()
+
+    def test_isolated_functions_run_in_worker_processes(self, client):
+        payload = {
+            "contents": ["an apple a day", "a banana"],
+            "detector_params": {"custom": ["count_vowels", "needs_headers", "decorated", "in_process"]},
+        }
+        resp = client.post("/api/v1/text/contents", json=payload, headers={"magic-key": "wrong"})
+        assert resp.status_code == 200
+        assert [[d["detection"] for d in detections] for detections in resp.json()] == [
+            ["vowels: 5", "needs_headers", "decorated"],
+            ["needs_headers", "in_process"],
+        ]
+
+    def test_isolated_functions_are_not_registered_in_workers(self, client):
+        from detectors.built_in.app import app
+        assert set(app.get_detector("custom").registry) == {"count_vowels", "needs_headers", "too_slow", "decorated", "in_process"}
+
+    def test_isolated_timeouts(self, client):
+        payload = {"contents": ["an apple"], "detector_params": {"custom": ["too_slow"]}}
+        start = time.time()
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert time.time() - start < 3
+        assert resp.status_code == 500
+        # the other worker keeps serving, while the killed one is replaced
+        payload = {"contents": ["an apple"], "detector_params": {"custom": ["decorated"]}}
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert resp.status_code == 200 and resp.json()[0][0]["detection"] == "decorated"
+
+    def test_async_functions_cannot_be_isolated(self):
+        from detectors.built_in.custom_detectors_wrapper import isolated
+
+        async def lookup(text: str) -> bool:
+            return True
+        with pytest.raises(TypeError, match="does not support async functions"):
+            isolated()(lookup)
+
+
+class TestCachedCustomDetectors:
+    @pytest.fixture
+    def client(self):
+        write_code_to_custom_detectors(CACHED_CODE)
+        from detectors.built_in.app import app
+
+        import prometheus_client
+        prometheus_client.REGISTRY._names_to_collectors.clear()
+
+        from detectors.built_in.custom_detectors_wrapper import CustomDetectorRegistry
+        registry = CustomDetectorRegistry()
+        app.set_detector(registry, "custom")
+        return TestClient(app)
+
+    @pytest.fixture(autouse=True)
+    def cleanup_custom_detectors(self):
+        yield
+        restore_safe_code()
+
+    @staticmethod
+    def calls():
+        return sys.modules["custom_detectors.custom_detectors"].calls
+
+    @staticmethod
+    def detect(client, contents, detector_params):
+        resp = client.post("/api/v1/text/contents", json={"contents": contents, "detector_params": {"custom": detector_params}})
+        assert resp.status_code == 200
+        return [[d["detection"] for d in detections] for detections in resp.json()]
+
+    def test_results_are_memoized_by_content(self, client):
+        assert self.detect(client, ["an apple", "a banana", "an apple"], ["expensive", "async_lookup", "stacked"]) == [
+            ["expensive", "async_lookup", "stacked"], [], ["expensive", "async_lookup", "stacked"],
+        ]
+        assert self.detect(client, ["an apple"], ["expensive", "async_lookup", "stacked"]) == [["expensive", "async_lookup", "stacked"]]
+        assert {name: self.calls()[name] for name in ["expensive", "async_lookup", "stacked"]} == {"expensive": 2, "async_lookup": 2, "stacked": 2}
+
+    def test_results_are_memoized_by_kwargs(self, client):
+        assert self.detect(client, ["an apple"], {"with_kwargs": {"word": "apple"}}) == [["with_kwargs"]]
+        assert self.detect(client, ["an apple"], {"with_kwargs": {"word": "banana"}}) == [[]]
+        assert self.detect(client, ["an apple"], {"with_kwargs": {"word": "apple"}}) == [["with_kwargs"]]
+        assert self.calls()["with_kwargs"] == 2
+
+    def test_errors_are_not_memoized(self, client):
+        for _ in range(2):
+            resp = client.post("/api/v1/text/contents", json={"contents": ["an apple"], "detector_params": {"custom": ["failing"]}})
+            assert resp.status_code == 500
+        assert self.calls()["failing"] == 2
+
+    def test_ttl(self, client):
+        self.detect(client, ["an apple"], ["short_lived"])
+        self.detect(client, ["an apple"], ["short_lived"])
+        time.sleep(0.15)
+        self.detect(client, ["an apple"], ["short_lived"])
+        assert self.calls()["short_lived"] == 2
+
+    def test_metrics(self, client):
+        from detectors.built_in.app import app
+        from tests.detectors.builtIn.test_result_cache import RecordingInstrument
+        instruments = {name: RecordingInstrument() for name in ["cache_hits", "cache_misses", "cache_evictions", "cache_hit_ratio"]}
+        app.get_detector("custom").set_instruments(instruments)
+        self.detect(client, ["one", "two", "two", "one"], ["small"])
+        assert instruments["cache_misses"].values[("custom_function_small",)] == 3
+        assert instruments["cache_hits"].values[("custom_function_small",)] == 1
+        assert instruments["cache_evictions"].values[("custom_function_small",)] == 2
+
+    def test_composes_with_other_decorators(self, client):
+        from detectors.built_in.app import app
+        from detectors.built_in.custom_detectors_wrapper import get_underlying_function
+        registry = app.get_detector("custom")
+        stacked = get_underlying_function(registry.registry["stacked"])
+        assert stacked.function_cache.name == "custom_function_stacked"
+        assert stacked.cacheable is False and stacked.prometheus_instruments == []
+        assert registry.function_info["async_lookup"].is_async and not registry.function_info["expensive"].is_async
+        assert "cached" not in registry.registry
+
+    @pytest.mark.parametrize("cached_outermost", [True, False])
+    def test_cannot_be_combined_with_non_blocking(self, cached_outermost):
+        from detectors.built_in.custom_detectors_wrapper import cached, non_blocking
+
+        def background(text: str) -> bool:
+            return True
+        with pytest.raises(TypeError, match="cannot be combined"):
+            if cached_outermost:
+                cached()(non_blocking(return_value=False)(background))
+            else:
+                non_blocking(return_value=False)(cached()(background))
+
+
+class TestBatchedCustomDetectors:
+    @pytest.fixture
+    def client(self):
+        write_code_to_custom_detectors(BATCHED_CODE)
+        from detectors.built_in.app import app
+
+        import prometheus_client
+        prometheus_client.REGISTRY._names_to_collectors.clear()
+
+        from detectors.built_in.custom_detectors_wrapper import CustomDetectorRegistry
+        app.set_detector(CustomDetectorRegistry(), "custom")
+        return TestClient(app)
+
+    @pytest.fixture(autouse=True)
+    def cleanup_custom_detectors(self):
+        yield
+        restore_safe_code()
+
+    @staticmethod
+    def batches():
+        return sys.modules["custom_detectors.custom_detectors"].batches
+
+    def test_batched_functions_take_every_content(self, client):
+        contents = ["an apple", "a banana", "a cherry and an apple", "nothing"]
+        payload = {"contents": contents, "detector_params": {"custom": ["classify", "per_content", "classify_async"]}}
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert resp.status_code == 200
+        assert [[d["detection"] for d in detections] for detections in resp.json()] == [
+            ["classify"], ["classify_async"], ["classify", "per_content"], [],
+        ]
+        assert [d["text"] for d in resp.json()[2]] == ["a cherry and an apple"] * 2
+        assert self.batches() == [contents, contents]
+
+    def test_batched_functions_with_headers_and_kwargs(self, client):
+        payload = {"contents": ["key: 123", "key: 456"], "detector_params": {"custom": {"classify_with_kwargs": {"label": "found"}}}}
+        resp = client.post("/api/v1/text/contents", json=payload, headers={"magic-key": "456"})
+        assert resp.status_code == 200
+        assert [[d["detection"] for d in detections] for detections in resp.json()] == [[], ["found"]]
+        assert self.batches() == [["key: 123", "key: 456"]]
+
+    def test_batched_functions_must_return_one_result_per_content(self, client):
+        payload = {"contents": ["an apple", "a banana"], "detector_params": {"custom": ["wrong_length"]}}
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert resp.status_code == 500
+
+    def test_batched_functions_are_detected_at_load_time(self, client):
+        from detectors.built_in.app import app
+        registry = app.get_detector("custom")
+        assert {name: info.is_batched for name, info in registry.function_info.items()} == {
+            "classify": True, "classify_with_kwargs": True, "classify_async": True, "wrong_length": True, "per_content": False,
+        }
+        assert registry.runs_contents_together(registry.get_plan({"custom": ["classify"]}))
+        assert not registry.runs_contents_together(registry.get_plan({"custom": ["per_content"]}))
+
+
+class TestLifecycleHooks:
+    @pytest.fixture
+    def registry(self, monkeypatch):
+        write_code_to_custom_detectors(LIFECYCLE_CODE)
+        import prometheus_client
+        prometheus_client.REGISTRY._names_to_collectors.clear()
+
+        from detectors.built_in import custom_detectors_wrapper
+        monkeypatch.setattr(custom_detectors_wrapper.isolated_detectors, "workers", 1)
+        yield custom_detectors_wrapper.CustomDetectorRegistry()
+        custom_detectors_wrapper.isolated_detectors.shutdown()
+
+    @pytest.fixture(autouse=True)
+    def cleanup_custom_detectors(self):
+        yield
+        restore_safe_code()
+
+    @staticmethod
+    def module():
+        return sys.modules["custom_detectors.custom_detectors"]
+
+    def test_hooks_are_not_detectors(self, registry):
+        assert set(registry.registry) == {"in_table", "in_table_isolated"}
+        assert [hook.__name__ for hook in registry.startup_hooks] == ["load_table", "open_session"]
+        assert [hook.__name__ for hook in registry.shutdown_hooks] == ["close_session", "drop_table"]
+
+    def test_hooks_run_on_start_and_close(self, registry):
+        assert self.module().events == []
+        registry.start()
+        assert self.module().events == ["load_table", "open_session"]
+        plan = registry.get_plan({"custom": ["in_table", "in_table_isolated"]})
+        assert [d.detection for d in registry.run_plan(plan, "an apple", {})] == ["in_table", "in_table_isolated"]
+        registry.close()
+        assert self.module().events == ["load_table", "open_session", "drop_table", "close_session"]
+        # async hooks share the event loop of the async guardrails
+        assert self.module().resources == {"session": self.module().resources["session"], "session_closed": True}
+
+    def test_executor_workers_run_the_hooks_without_an_isolated_pool(self, monkeypatch):
+        write_code_to_custom_detectors(LIFECYCLE_CODE)
+        from detectors.built_in import custom_detectors_wrapper, detector_executor
+        monkeypatch.setattr(custom_detectors_wrapper.isolated_detectors, "in_process", False)
+        monkeypatch.setattr(detector_executor, "_worker_registries", {})
+
+        detector_executor._init_worker({"custom": custom_detectors_wrapper.CustomDetectorRegistry}, [])
+        assert self.module().events == ["load_table", "open_session"]
+        assert not custom_detectors_wrapper.isolated_detectors.started
+        # the @isolated guardrails run in the executor worker itself
+        (status, result), _, _ = detector_executor._run_in_worker("custom", ["in_table", "in_table_isolated"], ["an apple"], {})
+        assert status == "ok"
+        assert [d.detection for d in result[0]] == ["in_table", "in_table_isolated"]
+
+    def test_readiness_waits_for_the_startup_hooks(self, monkeypatch):
+        write_code_to_custom_detectors(LIFECYCLE_CODE)
+        from detectors.built_in import custom_detectors_wrapper
+        from detectors.built_in.app import app
+        monkeypatch.setattr(custom_detectors_wrapper.isolated_detectors, "workers", 1)
+
+        import prometheus_client
+        prometheus_client.REGISTRY._names_to_collectors.clear()
+        assert TestClient(app).get("/ready").status_code == 503
+        with TestClient(app) as client:
+            resp = client.get("/ready")
+            assert resp.status_code == 200 and resp.json() == {"status": "ready"}
+            assert self.module().events == ["load_table", "open_session"]
+            resp = client.post("/api/v1/text/contents", json={"contents": ["a banana"], "detector_params": {"custom": ["in_table"]}})
+            assert resp.json()[0][0]["detection"] == "in_table"
+        assert not app.state.ready
+        assert self.module().events[-2:] == ["drop_table", "close_session"]
+
+    def test_failing_startup_hooks_stop_the_server(self):
+        write_code_to_custom_detectors(FAILING_STARTUP_CODE)
+        from detectors.built_in.custom_detectors_wrapper import CustomDetectorRegistry
+        registry = CustomDetectorRegistry()
+        with pytest.raises(RuntimeError, match="model not found"):
+            registry.start()
+
+
+class TestCustomDetectorsReload:
+    @pytest.fixture
+    def client(self):
+        write_code_to_custom_detectors(RELOAD_CODE.replace("VERSION", "v1"))
+        from detectors.built_in.app import app
+
+        import prometheus_client
+        prometheus_client.REGISTRY._names_to_collectors.clear()
+
+        from detectors.built_in.custom_detectors_wrapper import CustomDetectorRegistry
+        app.set_detector(CustomDetectorRegistry(), "custom")
+        return TestClient(app)
+
+    @pytest.fixture(autouse=True)
+    def cleanup_custom_detectors(self):
+        yield
+        restore_safe_code()
+
+    @staticmethod
+    def detect(client, content):
+        resp = client.post("/api/v1/text/contents", json={"contents": [content], "detector_params": {"custom": ["version"]}})
+        assert resp.status_code == 200
+        return [d["detection"] for d in resp.json()[0]]
+
+    def test_reload(self, client):
+        from detectors.built_in.app import app
+        assert self.detect(client, "text") == ["v1"]
+        write_code_to_custom_detectors(RELOAD_CODE.replace("VERSION", "v2") + "\ndef added(text: str) -> bool:\n    return True\n")
+        resp = client.post("/custom_detectors/reload")
+        assert resp.status_code == 200
+        assert resp.json() == {"generation": 2, "detectors": ["added", "version"]}
+        assert app.get_detector("custom").generation == 2
+        assert self.detect(client, "text") == ["v2"]
+
+    def test_failed_reloads_keep_the_current_detectors(self, client):
+        from detectors.built_in.app import app
+        registry = app.get_detector("custom")
+        write_code_to_custom_detectors(UNSAFE_CODE)
+        resp = client.post("/custom_detectors/reload")
+        assert resp.status_code == 422 and "Unsafe code detected" in resp.text
+        write_code_to_custom_detectors("def broken(text: str) -> bool\n    return True\n")
+        assert client.post("/custom_detectors/reload").status_code == 422
+        assert app.get_detector("custom") is registry
+        assert self.detect(client, "text") == ["v1"]
+
+    def test_failed_reloads_release_the_collectors_of_the_new_version(self, client):
+        from detectors.built_in.app import app
+        # the shipped custom detectors create prometheus counters at import time
+        write_code_to_custom_detectors(SAFE_CODE)
+        assert client.post("/custom_detectors/reload").status_code == 200
+        registry = app.get_detector("custom")
+        assert registry.collectors
+
+        write_code_to_custom_detectors(SAFE_CODE + FAILING_STARTUP_CODE)
+        resp = client.post("/custom_detectors/reload")
+        assert resp.status_code == 422 and "model not found" in resp.text
+        assert app.get_detector("custom") is registry
+
+        for generation in [3, 4]:
+            resp = client.post("/custom_detectors/reload")
+            assert resp.status_code == 422
+            write_code_to_custom_detectors(SAFE_CODE)
+            resp = client.post("/custom_detectors/reload")
+            assert resp.status_code == 200 and resp.json()["generation"] == generation
+            write_code_to_custom_detectors(SAFE_CODE + FAILING_STARTUP_CODE)
+
+    def test_requests_in_flight_finish_on_the_old_detectors(self, client):
+        from concurrent.futures import ThreadPoolExecutor
+        old_module = sys.modules["custom_detectors.custom_detectors"]
+        with ThreadPoolExecutor(1) as threads:
+            in_flight = threads.submit(self.detect, client, "slow")
+            time.sleep(0.2)
+            write_code_to_custom_detectors(RELOAD_CODE.replace("VERSION", "v2"))
+            assert client.post("/custom_detectors/reload").status_code == 200
+            assert self.detect(client, "text") == ["v2"]
+            # the old detectors are released once the request is done
+            assert old_module.events == []
+            assert in_flight.result() == ["v1"]
+        deadline = time.time() + 5
+        while not old_module.events and time.time() < deadline:
+            time.sleep(0.01)
+        assert old_module.events == ["released"]
+
+    def test_reloads_wait_for_requests_with_compiled_plans(self, client, monkeypatch):
+        from detectors.built_in import app as app_module
+        old_module = sys.modules["custom_detectors.custom_detectors"]
+        get_plans = app_module.get_plans
+        released_before_running = []
+
+        def reload_after_get_plans(detector_params, leases):
+            plans = get_plans(detector_params, leases)
+            write_code_to_custom_detectors(RELOAD_CODE.replace("VERSION", "v2"))
+            app_module.app.state.custom_detectors_reloader.reload()
+            # give the old detectors the time to be retired, as they would without a request holding them
+            time.sleep(0.2)
+            released_before_running.append(list(old_module.events))
+            return plans
+
+        monkeypatch.setattr(app_module, "get_plans", reload_after_get_plans)
+        assert self.detect(client, "text") == ["v1"]
+        assert released_before_running == [[]]
+        deadline = time.time() + 5
+        while not old_module.events and time.time() < deadline:
+            time.sleep(0.01)
+        assert old_module.events == ["released"]
+
+    def test_reloads_invalidate_cached_results(self, client):
+        from detectors.built_in.app import app
+        params = {"custom": ["version"]}
+        cache_params = app.get_detector("custom").get_cache_params(params)
+        write_code_to_custom_detectors(RELOAD_CODE.replace("VERSION", "v2"))
+        client.post("/custom_detectors/reload")
+        assert app.get_detector("custom").get_cache_params(params) != cache_params
+
+    def test_watch_and_metrics(self, client):
+        from detectors.built_in.app import app
+        from detectors.built_in.custom_detectors_reloader import CustomDetectorReloader
+        from tests.detectors.builtIn.test_result_cache import RecordingInstrument
+        instruments = {name: RecordingInstrument() for name in ["registry_generation", "registry_reload_duration", "registry_reloads"]}
+        reloader = CustomDetectorReloader(
+            lambda: app.get_detector("custom"), lambda registry: app.set_detector(registry, "custom"), watch_interval=0.05,
+        )
+        reloader.set_instruments(instruments)
+        reloader.start_watching()
+        try:
+            time.sleep(0.1)
+            write_code_to_custom_detectors(UNSAFE_CODE)
+            deadline = time.time() + 5
+            while not instruments["registry_reloads"].values and time.time() < deadline:
+                time.sleep(0.01)
+            write_code_to_custom_detectors(RELOAD_CODE.replace("VERSION", "v2"))
+            while app.get_detector("custom").generation < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            reloader.stop_watching()
+        assert self.detect(client, "text") == ["v2"]
+        assert dict(instruments["registry_reloads"].values) == {("custom", "failed"): 1, ("custom", "success"): 1}
+        assert instruments["registry_generation"].values[("custom",)] == 2
+        assert instruments["registry_reload_duration"].values[("custom",)] > 0
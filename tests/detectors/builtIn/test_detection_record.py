@@ -0,0 +1,35 @@
+from fastapi.testclient import TestClient
+
+
+class TestDetectionRecord:
+    def test_serializes_like_content_analysis_response(self):
+        from detectors.built_in.detection_record import DetectionRecord, serialize_detection
+        from detectors.common.scheme import ContentAnalysisResponse
+
+        record = DetectionRecord(start=3, end=8, text="a@b.c", detection="email_address", detection_type="pii")
+        response = ContentAnalysisResponse(start=3, end=8, text="a@b.c", detection="email_address", detection_type="pii", score=1.0)
+        assert serialize_detection(record) == serialize_detection(response) == response.model_dump(mode="json")
+        assert record.to_response() == response
+
+    def test_records_are_compact(self):
+        from detectors.built_in.detection_record import DetectionRecord
+        record = DetectionRecord(0, 1, "a", "detection", "pii")
+        assert not hasattr(record, "__dict__")
+
+    def test_mixed_detections_response(self):
+        """Records and pydantic detections from different registries serialize side by side"""
+        from detectors.built_in.app import app
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry
+
+        app.set_detector(RegexDetectorRegistry(), "regex")
+        app.set_detector(FileTypeDetectorRegistry(), "file_type")
+        payload = {"contents": ["a@b.com"], "detector_params": {"regex": ["email"], "file_type": ["json"]}}
+        resp = TestClient(app).post("/api/v1/text/contents", json=payload)
+        assert resp.status_code == 200
+        assert resp.json() == [[
+            {"start": 0, "end": 7, "text": "a@b.com", "detection": "email_address", "detection_type": "pii",
+             "score": 1.0, "evidences": None, "metadata": {}},
+            {"start": 0, "end": 7, "text": "a@b.com", "detection": "invalid_json", "detection_type": "file_type",
+             "score": 1.0, "evidences": None, "metadata": {}},
+        ]]
@@ -0,0 +1,241 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+
+def make_registry(name, delay=0.0, fail=None):
+    # the app imports the built-in modules by their flat names, and only accepts registries of those classes
+    from base_detector_registry import BaseDetectorRegistry
+    from detection_record import DetectionRecord
+
+    class SleepyRegistry(BaseDetectorRegistry):
+        """Emits one detection naming the registry and the content, after a delay"""
+        def __init__(self):
+            super().__init__(name)
+            self.registry = {}
+            self.threads = set()
+
+        def handle_request(self, content, detector_params, headers):
+            self.threads.add(threading.get_ident())
+            time.sleep(delay)
+            if fail is not None:
+                raise fail
+            return [DetectionRecord(0, len(content), content, name, "test")]
+
+    return SleepyRegistry()
+
+
+def make_async_registry(name, delay=0.0, fail=None):
+    from base_detector_registry import BaseDetectorRegistry
+    from detection_record import DetectionRecord
+
+    class AwaitingRegistry(BaseDetectorRegistry):
+        """Emits one detection naming the registry and the content, after awaiting a delay"""
+        def __init__(self):
+            super().__init__(name)
+            self.registry = {}
+
+        def handle_request(self, content, detector_params, headers):
+            raise AssertionError("awaiting registries are not run in a thread")
+
+        def awaits_contents(self, plan):
+            return True
+
+        async def run_plan_contents_async(self, plan, contents, headers, recordings=None):
+            await asyncio.sleep(delay)
+            if fail is not None:
+                raise fail
+            return [[DetectionRecord(0, len(content), content, name, "test")] for content in contents]
+
+    return AwaitingRegistry()
+
+
+def run_registry(registry, plan, contents, headers):
+    return registry.run_plan_contents(plan, contents, headers)
+
+
+async def run_registry_async(registry, plan, contents, headers):
+    return await registry.run_plan_contents_async(plan, contents, headers)
+
+
+def plan_all(registries, detector_params=None):
+    return [(registry, registry.get_plan(detector_params or {})) for registry in registries]
+
+
+def detection_names(results):
+    return [[(d.detection, d.text) for d in detections] for detections in results]
+
+
+class TestDetectorExecutor:
+    def test_unknown_mode_defaults_to_serial(self):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        assert DetectorExecutor("fibers").mode == "serial"
+
+    def test_from_env(self, monkeypatch):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        monkeypatch.setenv("DETECTOR_EXECUTION_MODE", "Thread")
+        monkeypatch.setenv("DETECTOR_EXECUTION_WORKERS", "3")
+        monkeypatch.setenv("DETECTOR_EXECUTION_FAN_OUT_CONTENTS", "true")
+        executor = DetectorExecutor.from_env()
+        assert (executor.mode, executor.workers, executor.fan_out_contents) == ("thread", 3, True)
+
+    @pytest.mark.parametrize("mode", ["serial", "thread"])
+    @pytest.mark.parametrize("fan_out_contents", [False, True])
+    def test_results_keep_request_order(self, mode, fan_out_contents):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        executor = DetectorExecutor(mode, workers=4, fan_out_contents=fan_out_contents)
+        # the first registry finishes last
+        registries = [make_registry("slow", 0.2), make_registry("fast", 0.0), make_registry("medium", 0.1)]
+        results = executor.run(plan_all(registries), ["a", "b"], {}, run_registry, {}, [])
+        assert detection_names(results) == [
+            [("slow", "a"), ("fast", "a"), ("medium", "a")],
+            [("slow", "b"), ("fast", "b"), ("medium", "b")],
+        ]
+        executor.shutdown()
+
+    def test_thread_mode_runs_registries_concurrently(self):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        executor = DetectorExecutor("thread", workers=3)
+        registries = [make_registry(name, 0.3) for name in ["a", "b", "c"]]
+        start = time.time()
+        executor.run(plan_all(registries), ["text"], {}, run_registry, {}, [])
+        assert time.time() - start < 0.6
+        executor.shutdown()
+
+    def test_fan_out_contents(self):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        executor = DetectorExecutor("thread", workers=4, fan_out_contents=True)
+        registry = make_registry("a", 0.3)
+        start = time.time()
+        results = executor.run(plan_all([registry]), ["1", "2", "3", "4"], {}, run_registry, {}, [])
+        assert time.time() - start < 0.9
+        assert detection_names(results) == [[("a", "1")], [("a", "2")], [("a", "3")], [("a", "4")]]
+        assert len(registry.threads) > 1
+        executor.shutdown()
+
+    def test_single_registry_runs_inline(self):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        executor = DetectorExecutor("thread", workers=4)
+        registry = make_registry("a")
+        executor.run(plan_all([registry]), ["1", "2"], {}, run_registry, {}, [])
+        assert registry.threads == {threading.get_ident()}
+
+    def test_first_error_in_request_order_is_raised(self):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        executor = DetectorExecutor("thread", workers=3)
+        registries = [
+            make_registry("ok", 0.0),
+            make_registry("bad_request", 0.2, fail=HTTPException(status_code=400, detail="first")),
+            make_registry("broken", 0.0, fail=ValueError("second")),
+        ]
+        with pytest.raises(HTTPException) as e:
+            executor.run(plan_all(registries), ["text"], {}, run_registry, {}, [])
+        assert e.value.detail == "first"
+        executor.shutdown()
+
+    @pytest.mark.parametrize("mode", ["serial", "thread"])
+    def test_awaiting_registries_keep_request_order(self, mode):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        executor = DetectorExecutor(mode, workers=4)
+        registries = [make_registry("sync", 0.1), make_async_registry("awaited", 0.0), make_registry("other", 0.0)]
+        results = asyncio.run(executor.run_async(plan_all(registries), ["a", "b"], {}, run_registry, run_registry_async, {}, []))
+        assert detection_names(results) == [
+            [("sync", "a"), ("awaited", "a"), ("other", "a")],
+            [("sync", "b"), ("awaited", "b"), ("other", "b")],
+        ]
+        executor.shutdown()
+
+    def test_awaiting_registries_wait_alongside_the_others(self):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        executor = DetectorExecutor("thread", workers=2)
+        registries = [make_registry("a", 0.3), make_async_registry("b", 0.3), make_registry("c", 0.3)]
+        start = time.time()
+        asyncio.run(executor.run_async(plan_all(registries), ["text"], {}, run_registry, run_registry_async, {}, []))
+        assert time.time() - start < 0.6
+        executor.shutdown()
+
+    def test_first_error_in_request_order_is_raised_with_awaiting_registries(self):
+        from detectors.built_in.detector_executor import DetectorExecutor
+        executor = DetectorExecutor("thread", workers=3)
+        registries = [
+            make_registry("ok", 0.0),
+            make_async_registry("bad_request", 0.2, fail=HTTPException(status_code=400, detail="first")),
+            make_registry("broken", 0.0, fail=ValueError("second")),
+        ]
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(executor.run_async(plan_all(registries), ["text"], {}, run_registry, run_registry_async, {}, []))
+        assert e.value.detail == "first"
+        executor.shutdown()
+
+    def test_process_mode(self):
+        from detectors.built_in.base_detector_registry import DetectorPlan
+        from detectors.built_in.detector_executor import DetectorExecutor
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry
+        from detectors.built_in.result_cache import ResultCache
+        from tests.detectors.builtIn.test_result_cache import RecordingInstrument
+
+        instruments = {name: RecordingInstrument() for name in ["requests", "detections", "errors", "runtime"]}
+        registry = RegexDetectorRegistry()
+        registry.set_instruments(instruments)
+        other = make_registry("other")
+        result_cache = ResultCache(maxsize=16)
+
+        executor = DetectorExecutor("process", workers=2)
+        try:
+            params = {"regex": ["email", "us-social-security-number"], "other": []}
+            for _ in range(2):
+                results = executor.run(
+                    plan_all([registry, other], params), ["Email: a@b.com, SSN: 123-45-6789"], {},
+                    result_cache.run_plan_contents, {"regex": registry}, list(instruments),
+                )
+                assert detection_names(results) == [[("email_address", "a@b.com"), ("social_security_number", "123-45-6789"), ("other", "Email: a@b.com, SSN: 123-45-6789")]]
+
+            # the worker's instrument updates are applied here, and replayed by the result cache on the second request
+            assert instruments["requests"].values[("regex", "email")] == 2
+            assert instruments["detections"].values[("regex", "us-social-security-number")] == 2
+            assert result_cache.cache.hits == 2
+
+            # plans that fail to compile in the worker are reported like local failures
+            plan = DetectorPlan("regex", ["["], ())
+            with pytest.raises(HTTPException) as e:
+                executor.run([(registry, plan), (other, other.get_plan({}))], ["text"], {}, run_registry, {"regex": registry}, [])
+            assert e.value.status_code == 500
+        finally:
+            executor.shutdown()
+
+
+class TestConcurrentDetectContent:
+    @pytest.fixture
+    def client(self):
+        from detectors.built_in.app import app
+        from detectors.built_in.detector_executor import DetectorExecutor
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry
+
+        app.set_detector(RegexDetectorRegistry(), "regex")
+        app.set_detector(make_registry("slow", 0.2), "slow")
+        original = app.state.detector_executor
+        app.state.detector_executor = DetectorExecutor("thread", workers=4, fan_out_contents=True)
+        yield TestClient(app)
+        app.state.detector_executor.shutdown()
+        app.state.detector_executor = original
+        app.state.detectors.pop("slow")
+
+    def test_detect_content(self, client):
+        payload = {"contents": ["a@b.com", "no pii", "c@d.com"], "detector_params": {"slow": [], "regex": ["email"]}}
+        start = time.time()
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert time.time() - start < 0.5
+        assert resp.status_code == 200
+        assert [[d["detection"] for d in detections] for detections in resp.json()] == [
+            ["slow", "email_address"],
+            ["slow"],
+            ["slow", "email_address"],
+        ]
+
+    def test_unknown_detector(self, client):
+        resp = client.post("/api/v1/text/contents", json={"contents": ["a"], "detector_params": {"regex": ["email"], "missing": []}})
+        assert resp.status_code == 400
@@ -0,0 +1,78 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+
+class TestDetectorPlan:
+    @pytest.fixture
+    def regex_registry(self):
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry
+        return RegexDetectorRegistry()
+
+    def test_identical_params_share_a_plan(self, regex_registry):
+        plan = regex_registry.get_plan({"regex": ["email", r"\d+"]})
+        assert regex_registry.get_plan({"regex": ["email", r"\d+"], "file_type": ["json"]}) is plan
+        assert regex_registry.get_plan({"regex": [r"\d+", "email"]}) is not plan
+        assert [step.name for step in plan.steps] == ["email", r"\d+"]
+        assert [step.metric_name for step in plan.steps] == ["email", "custom_regex"]
+
+    def test_plan_skips_the_custom_regex_documenter(self, regex_registry):
+        plan = regex_registry.get_plan({"regex": ["$CUSTOM_REGEX", "email"]})
+        assert [step.name for step in plan.steps] == ["email"]
+
+    def test_plan_selects_multi_pattern_specs(self, regex_registry):
+        params = {"regex": ["credit-card", "us-social-security-number", "ipv6"]}
+        plan = regex_registry.get_plan(params)
+        assert set(plan.multi_pattern_specs) == {"credit-card", "us-social-security-number"}
+        content = "4111 1111 1111 1111, 123-45-6789"
+        assert [d.text for d in regex_registry.run_plan(plan, content, {})] == ["4111 1111 1111 1111", "123-45-6789"]
+
+    def test_invalid_regex_is_rejected_when_compiling(self, regex_registry):
+        with pytest.raises(HTTPException) as e:
+            regex_registry.get_plan({"regex": ["email", "("]})
+        assert e.value.status_code == 500
+        # failed compilations are not cached
+        assert len(regex_registry.plan_cache) == 0
+
+    def test_kwargs_key_order_is_normalized(self):
+        from detectors.built_in.keyword_detectors import KeywordDetectorRegistry
+        registry = KeywordDetectorRegistry()
+        assert registry.get_params_key({"keyword": {"a": 1, "b": 2}}) == registry.get_params_key({"keyword": {"b": 2, "a": 1}})
+
+
+class TestPlansInDetectContent:
+    @pytest.fixture
+    def client(self):
+        from detectors.built_in.app import app
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry
+
+        app.set_detector(RegexDetectorRegistry(), "regex")
+        app.set_detector(FileTypeDetectorRegistry(), "file_type")
+        return TestClient(app)
+
+    def test_invalid_names_are_rejected_before_scanning(self, client, monkeypatch):
+        from detectors.built_in.app import app
+
+        def fail(*args, **kwargs):
+            raise AssertionError("no content may be scanned")
+        monkeypatch.setattr(app.get_detector("regex"), "run_plan", fail)
+
+        payload = {"contents": ["a@b.com"] * 100, "detector_params": {"regex": ["email"], "file_type": ["json", "not_a_type"]}}
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert resp.status_code == 400
+        assert "Unrecognized file type: not_a_type" in resp.json()["message"]
+
+    def test_plan_is_compiled_once_per_request(self, client, monkeypatch):
+        from detectors.built_in.app import app
+        registry = app.get_detector("regex")
+        compile_plan = registry.compile_plan
+        compiled = []
+        monkeypatch.setattr(registry, "compile_plan", lambda params: compiled.append(params) or compile_plan(params))
+
+        payload = {"contents": ["a@b.com", "c@d.com", "nothing"], "detector_params": {"regex": ["email", r"\d+"]}}
+        for _ in range(2):
+            resp = client.post("/api/v1/text/contents", json=payload)
+            assert resp.status_code == 200
+            assert [len(detections) for detections in resp.json()] == [1, 1, 0]
+        assert len(compiled) == 1
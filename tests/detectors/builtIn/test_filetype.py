@@ -356,4 +356,391 @@ class TestFileTypeDetectors:
         assert resp.status_code == 400
         data = resp.json()
         assert "message" in data
-        assert "Unrecognized file type" in data["message"]
\ No newline at end of file
+        assert "Unrecognized file type" in data["message"]
+
+class TestSchemaCache:
+    @pytest.fixture
+    def file_type_detectors(self):
+        from detectors.built_in import file_type_detectors
+        from tests.detectors.builtIn.test_result_cache import RecordingInstrument
+
+        instruments = {name: RecordingInstrument() for name in ["cache_hits", "cache_misses", "schema_compile_time"]}
+        for cache in [file_type_detectors.json_schema_cache, file_type_detectors.xml_schema_cache]:
+            cache.clear()
+            cache.set_instruments(instruments)
+        yield file_type_detectors
+        for cache in [file_type_detectors.json_schema_cache, file_type_detectors.xml_schema_cache]:
+            cache.set_instruments({})
+
+    def test_validators_are_compiled_once(self, file_type_detectors):
+        schema = json.dumps({"type": "object", "required": ["a"]})
+        results = [file_type_detectors.is_valid_json_schema(content, schema) for content in ['{"a": 1}', '{"b": 1}'] * 5]
+        results += [file_type_detectors.is_valid_yaml_schema(content, schema) for content in ["a: 1", "b: 1"]]
+        assert [r.detection if r else None for r in results[:2]] == [None, "json_schema_mismatch"]
+        assert [r.detection if r else None for r in results[-2:]] == [None, "yaml_schema_mismatch"]
+
+        instruments = file_type_detectors.json_schema_cache.instruments
+        assert instruments["cache_misses"].values[("json_schemas",)] == 1
+        assert instruments["cache_hits"].values[("json_schemas",)] == 11
+        assert instruments["schema_compile_time"].values[("json_schemas",)] > 0
+
+    def test_invalid_json_schema_is_cached(self, file_type_detectors):
+        for _ in range(2):
+            result = file_type_detectors.is_valid_json_schema('{"a": 1}', "{not json")
+            assert result.detection == "invalid_schema"
+            assert result.end == len("{not json")
+        assert len(file_type_detectors.json_schema_cache.cache) == 1
+
+    def test_schema_failing_its_metaschema_still_raises(self, file_type_detectors):
+        import jsonschema
+        for _ in range(2):
+            with pytest.raises(jsonschema.SchemaError):
+                file_type_detectors.is_valid_json_schema('{"a": 1}', json.dumps({"type": 12}))
+        assert len(file_type_detectors.json_schema_cache.cache) == 0
+
+    def test_validator_follows_the_schema_draft(self, file_type_detectors):
+        # draft 4 spells an exclusive maximum as a boolean modifier of `maximum`
+        schema = json.dumps({"$schema": "http://json-schema.org/draft-04/schema#", "maximum": 5, "exclusiveMaximum": True})
+        assert file_type_detectors.is_valid_json_schema("4", schema) is None
+        assert file_type_detectors.is_valid_json_schema("5", schema).detection == "json_schema_mismatch"
+
+    XSD = """<?xml version="1.0"?>
+    <xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:orders" xmlns="urn:orders" elementFormDefault="qualified">
+      <xs:simpleType name="sku"><xs:restriction base="xs:string"><xs:pattern value="[A-Z]{3}-[0-9]{4}"/></xs:restriction></xs:simpleType>
+      <xs:complexType name="line">
+        <xs:sequence>
+          <xs:element name="sku" type="sku"/>
+          <xs:element name="quantity" type="xs:positiveInteger"/>
+          <xs:element name="price" type="xs:decimal"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:element name="order">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="customer" type="xs:string"/>
+            <xs:element name="line" type="line" maxOccurs="unbounded"/>
+          </xs:sequence>
+          <xs:attribute name="id" type="xs:ID" use="required"/>
+        </xs:complexType>
+      </xs:element>
+    </xs:schema>
+    """
+    ORDER = '<order xmlns="urn:orders" id="o1"><customer>ACME</customer><line><sku>ABC-1234</sku><quantity>2</quantity><price>9.99</price></line></order>'
+
+    def test_xml_schemas_are_compiled_once(self, file_type_detectors):
+        bad_order = self.ORDER.replace("ABC-1234", "abc")
+        results = [file_type_detectors.is_valid_xml_schema(content, self.XSD) for content in [self.ORDER, bad_order] * 3]
+        assert [r.detection if r else None for r in results] == [None, "xml_schema_mismatch"] * 3
+        assert file_type_detectors.is_valid_xml_schema("<order", self.XSD).detection == "invalid_xml"
+
+        instruments = file_type_detectors.xml_schema_cache.instruments
+        assert instruments["cache_misses"].values[("xml_schemas",)] == 1
+        assert instruments["cache_hits"].values[("xml_schemas",)] == 5
+        assert instruments["schema_compile_time"].values[("xml_schemas",)] > 0
+
+    def test_invalid_xml_schema_is_cached(self, file_type_detectors):
+        for _ in range(2):
+            result = file_type_detectors.is_valid_xml_schema(self.ORDER, "<xs:schema>")
+            assert result.detection == "invalid_xml_schema"
+        assert len(file_type_detectors.xml_schema_cache.cache) == 1
+
+    def test_xml_schema_validation_reuses_the_compiled_schema(self, file_type_detectors, monkeypatch):
+        """Repeated validations against a known XSD must neither compile it again nor parse the document twice"""
+        import xml.etree.ElementTree as ET
+        cache = file_type_detectors.xml_schema_cache
+        compiled, validated = [], []
+        monkeypatch.setattr(cache, "compile", lambda schema: compiled.append(schema) or file_type_detectors.compile_xml_schema(schema))
+        check_xml_schema = file_type_detectors.check_xml_schema
+
+        def spy(s, root, xs):
+            validated.append((root, xs))
+            return check_xml_schema(s, root, xs)
+        monkeypatch.setattr(file_type_detectors, "check_xml_schema", spy)
+
+        for _ in range(20):
+            assert file_type_detectors.is_valid_xml_schema(self.ORDER, self.XSD) is None
+        assert compiled == [self.XSD]
+        assert cache.instruments["cache_misses"].values[("xml_schemas",)] == 1
+        assert cache.instruments["cache_hits"].values[("xml_schemas",)] == 19
+        # the schema validates the tree parsed by the syntax check, and every call gets the same compiled schema
+        assert all(isinstance(root, ET.Element) for root, _ in validated)
+        assert len({id(xs) for _, xs in validated}) == 1
+
+
+class TestNamedSchemas:
+    ORDER_SCHEMA = {"type": "object", "properties": {"id": {"type": "integer"}}, "required": ["id"]}
+    NOTE_XSD = """<?xml version="1.0"?>
+    <xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+      <xs:element name="note" type="xs:string"/>
+    </xs:schema>
+    """
+
+    @pytest.fixture
+    def schemas_dir(self, tmp_path):
+        (tmp_path / "order.json").write_text(json.dumps(self.ORDER_SCHEMA))
+        (tmp_path / "note.xsd").write_text(self.NOTE_XSD)
+        (tmp_path / "broken.json").write_text("{not json")
+        (tmp_path / "README.md").write_text("not a schema")
+        return tmp_path
+
+    @pytest.fixture
+    def client(self, schemas_dir, monkeypatch):
+        from detectors.built_in.app import app
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+
+        monkeypatch.setenv("SCHEMAS_DIR", str(schemas_dir))
+        app.set_detector(FileTypeDetectorRegistry(), "file_type")
+        return TestClient(app)
+
+    def detect(self, client, contents, file_types):
+        resp = client.post("/api/v1/text/contents", json={"contents": contents, "detector_params": {"file_type": file_types}})
+        assert resp.status_code == 200, resp.text
+        return [[d["detection"] for d in detections] for detections in resp.json()]
+
+    def test_named_schemas(self, client):
+        contents = ['{"id": 1}', '{"id": "x"}', "{oops"]
+        assert self.detect(client, contents, ["json-with-schema-ref:order"]) == [[], ["json_schema_mismatch"], ["invalid_json"]]
+        assert self.detect(client, ["id: 1", "name: x"], ["yaml-with-schema-ref:order"]) == [[], ["yaml_schema_mismatch"]]
+        assert self.detect(client, ["<note>hi</note>", "<other/>"], ["xml-with-schema-ref:note"]) == [[], ["xml_schema_mismatch"]]
+
+    def test_named_schemas_match_inline_schemas(self, client):
+        contents = ['{"id": 1}', '{"id": "x"}', "{oops"]
+        inline = self.detect(client, contents, [f"json-with-schema:{json.dumps(self.ORDER_SCHEMA)}"])
+        assert self.detect(client, contents, ["json-with-schema-ref:order"]) == inline
+
+    def test_registry_lists_named_schemas(self, client):
+        registry = client.get("/registry").json()["file_type"]
+        assert "order" in registry["json-with-schema-ref:order"]
+        assert "yaml-with-schema-ref:order" in registry
+        assert "xml-with-schema-ref:note" in registry
+        assert not any("broken" in file_type for file_type in registry)
+
+    def test_unknown_schema_reference(self, client):
+        resp = client.post("/api/v1/text/contents", json={"contents": ["{}"], "detector_params": {"file_type": ["json-with-schema-ref:broken"]}})
+        assert resp.status_code == 400
+        assert "Unrecognized schema reference" in resp.json()["message"]
+
+    def test_reload(self, client, schemas_dir):
+        assert self.detect(client, ['{"id": "x"}'], ["json-with-schema-ref:order"]) == [["json_schema_mismatch"]]
+
+        (schemas_dir / "order.json").write_text(json.dumps({"type": "object"}))
+        (schemas_dir / "invoice.json").write_text(json.dumps({"type": "array"}))
+        resp = client.post("/schemas/reload")
+        assert resp.status_code == 200
+        assert resp.json() == {"schemas": ["invoice", "note", "order"]}
+
+        assert self.detect(client, ['{"id": "x"}'], ["json-with-schema-ref:order"]) == [[]]
+        assert self.detect(client, ['{"id": "x"}'], ["json-with-schema-ref:invoice"]) == [["json_schema_mismatch"]]
+
+    def test_reload_invalidates_cached_results(self, schemas_dir):
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        from detectors.built_in.result_cache import ResultCache
+
+        registry = FileTypeDetectorRegistry(schemas_dir=str(schemas_dir))
+        result_cache = ResultCache(maxsize=16)
+        params = {"file_type": ["json-with-schema-ref:order"]}
+        assert len(result_cache.handle_request(registry, '{"id": "x"}', params, {})) == 1
+
+        (schemas_dir / "order.json").write_text(json.dumps({"type": "object"}))
+        registry.reload_schemas()
+        assert result_cache.handle_request(registry, '{"id": "x"}', params, {}) == []
+
+
+class TestParsedContent:
+    @pytest.fixture
+    def parse_counts(self, monkeypatch):
+        # the registries import the built-in modules by their flat names
+        import document_parsers
+        counts = {file_type: 0 for file_type in document_parsers.PARSERS}
+        parsers = dict(document_parsers.PARSERS)
+        for file_type, (parse, invalid_errors) in parsers.items():
+            def counting_parse(text, file_type=file_type, parse=parse):
+                counts[file_type] += 1
+                return parse(text)
+            parsers[file_type] = (counting_parse, invalid_errors)
+        monkeypatch.setattr(document_parsers, "PARSERS", parsers)
+        return counts
+
+    def test_each_format_is_parsed_once_per_content(self, parse_counts):
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        registry = FileTypeDetectorRegistry()
+        schema = json.dumps({"type": "object", "required": ["a"]})
+        params = {"file_type": ["json", f"json-with-schema:{schema}", "yaml", f"yaml-with-schema:{schema}", "xml"]}
+
+        detections = registry.handle_request('{"b": 1}', params, {})
+        assert [d.detection for d in detections] == ["json_schema_mismatch", "yaml_schema_mismatch", "invalid_xml"]
+        assert parse_counts == {"json": 1, "yaml": 1, "xml": 1}
+
+        registry.handle_request('{"a": 1}', params, {})
+        assert parse_counts == {"json": 2, "yaml": 2, "xml": 2}
+
+    def test_invalid_content_is_parsed_once(self, parse_counts):
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        registry = FileTypeDetectorRegistry()
+        detections = registry.handle_request("{oops", {"file_type": ["json", "json-with-schema:{}"]}, {})
+        assert [d.detection for d in detections] == ["invalid_json", "invalid_json"]
+        assert parse_counts["json"] == 1
+
+    @pytest.mark.parametrize("text", [
+        '{"a": [1, 2.5, "x", null, true]}',
+        "NaN",
+        "[-Infinity]",
+        str(2 ** 80),
+        f'{{"id": {2 ** 64 + 1}, "note": "-1234567890123456789"}}',
+        '"\\ud800"',
+        '{"a": 1,}',
+        "",
+        "1e400",
+    ])
+    def test_fast_json_parser_matches_the_standard_library(self, text):
+        from detectors.built_in import document_parsers
+        fast_parse, invalid_errors = document_parsers.get_parsers(fast=True)["json"]
+        try:
+            expected = json.loads(text)
+        except invalid_errors:
+            with pytest.raises(invalid_errors):
+                fast_parse(text)
+            return
+        assert repr(fast_parse(text)) == repr(expected)
+
+    def test_fast_json_parser_falls_back_beyond_its_nesting_limit(self):
+        from detectors.built_in import document_parsers
+        fast_parse, _ = document_parsers.get_parsers(fast=True)["json"]
+        document = fast_parse("[" * 2000 + "]" * 2000)
+        for _ in range(1999):
+            document = document[0]
+        assert document == []
+
+    @pytest.mark.parametrize("text", ["a: 1\nb: [x, 2.5, null]", "- !!binary aGk=", "a: b: c", "key: 'unterminated", "{a: 1}"])
+    def test_fast_yaml_parser_matches_the_pure_python_loader(self, text):
+        import yaml
+        from detectors.built_in import document_parsers
+        fast_parse, invalid_errors = document_parsers.get_parsers(fast=True)["yaml"]
+        try:
+            expected = yaml.safe_load(text)
+        except invalid_errors:
+            with pytest.raises(invalid_errors):
+                fast_parse(text)
+            return
+        assert fast_parse(text) == expected
+
+    # documents that `yaml.safe_load` refuses, but libyaml accepts
+    LENIENT_YAML = ["a:\t1", "key: value\t", "foo\t: bar", "a: [1,\t2]", "a: {b: 1,\tc: 2}", "- 1\t- 2"]
+
+    @pytest.mark.parametrize("text", LENIENT_YAML)
+    def test_yaml_refused_by_the_pure_python_loader_is_invalid(self, text):
+        import document_parsers
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        assert document_parsers.PARSERS["yaml"][0] is document_parsers.load_yaml_stdlib
+        detections = FileTypeDetectorRegistry().handle_request(text, {"file_type": ["yaml"]}, {})
+        assert [d.detection for d in detections] == ["invalid_yaml"]
+
+
+class TestStreamingValidation:
+    @pytest.fixture
+    def streamed(self, monkeypatch):
+        # stream every content, and fail loudly if a plain validity check still builds the object tree
+        import document_parsers
+
+        def no_parse(text):
+            raise AssertionError("streamed contents may not be parsed")
+        monkeypatch.setattr(document_parsers, "STREAMING_THRESHOLD", 1)
+        monkeypatch.setattr(document_parsers, "PARSERS", {file_type: (no_parse, ()) for file_type in document_parsers.PARSERS})
+
+    @pytest.mark.parametrize("text", [
+        '{"a": [1, 2.5e3, -0, "x\\n", true, null], "b": {}}', " [ ] ", "NaN", "[-Infinity]", '"\\ud800"', "1e400",
+        "", "[1,]", '{"a" 1}', '{"a": 1,}', "01", "[1 2]", "{1: 2}", '"abc', '"\x01"', "١", '{"a": 1}{',
+    ])
+    def test_json_matches_the_standard_library(self, text):
+        from detectors.built_in.streaming_validators import check_json_stream
+        try:
+            json.loads(text)
+            valid = True
+        except ValueError:
+            valid = False
+        assert (check_json_stream(text) is None) == valid
+
+    @pytest.mark.parametrize("text", [
+        "a: 1", "- &x 1\n- *x", "a: !!str 1", "", "a: [1, 2", "- *y", "--- 1\n--- 2", "!foo 1", "&a [1, &a 2]",
+        "!!python/object:os.system x", "key: value\n  bad: indent",
+    ])
+    def test_yaml_matches_the_safe_loader(self, text):
+        import yaml
+        from detectors.built_in.streaming_validators import check_yaml_stream
+        try:
+            yaml.safe_load(text)
+            valid = True
+        except yaml.YAMLError:
+            valid = False
+        assert (check_yaml_stream(text) is None) == valid
+
+    @pytest.mark.parametrize("text", TestParsedContent.LENIENT_YAML + ["a: 1\t# comment", "a:\n\t- 1", "\ta: 1", "a: 'x\ty'"])
+    def test_yaml_with_tabs_gets_the_same_verdict_when_streamed(self, monkeypatch, text):
+        import document_parsers
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        parsed = FileTypeDetectorRegistry().handle_request(text, {"file_type": ["yaml"]}, {})
+        monkeypatch.setattr(document_parsers, "STREAMING_THRESHOLD", 1)
+        streamed = FileTypeDetectorRegistry().handle_request(text, {"file_type": ["yaml"]}, {})
+        assert [d.detection for d in streamed] == [d.detection for d in parsed]
+
+    @pytest.mark.parametrize("file_type, text", [
+        ("yaml", "a: !!int abc\n# " + "x" * 2 ** 21),
+        ("yaml", "<<: 1\n# " + "x" * 2 ** 21),
+        ("xml", '<!DOCTYPE a [<!ENTITY % p SYSTEM "x"> %p;]><a>&foo;</a><!-- ' + "x" * 2 ** 21 + " -->"),
+    ])
+    def test_streaming_is_off_by_default(self, file_type, text):
+        # the streamed checks accept these large documents, which parsing refuses
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        from detectors.built_in.streaming_validators import STREAMING_CHECKS
+        assert STREAMING_CHECKS[file_type](text) is None
+        detections = FileTypeDetectorRegistry().handle_request(text, {"file_type": [file_type]}, {})
+        assert [d.detection for d in detections] == [f"invalid_{file_type}"]
+
+    @pytest.mark.parametrize("text", ["<a/>", "<r><x a='1'/></r>", "<a>", "<a:b/>", "<a>&foo;</a>", "<a/><b/>", ""])
+    def test_xml_matches_element_tree(self, text):
+        import xml.etree.ElementTree as ET
+        from detectors.built_in.streaming_validators import check_xml_stream
+        try:
+            ET.fromstring(text)
+            valid = True
+        except ET.ParseError:
+            valid = False
+        assert (check_xml_stream(text) is None) == valid
+
+    @pytest.mark.parametrize("file_type, text", [
+        ("json", '{"name": "café", "items": [1, 2,, 3]}'),
+        ("yaml", "name: café\nitems: [1, 2\n"),
+        ("xml", "<root><name>café</name><item></root>"),
+    ])
+    def test_errors_are_reported_at_their_byte_offset(self, streamed, file_type, text):
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        detections = FileTypeDetectorRegistry().handle_request(text, {"file_type": [file_type]}, {})
+        assert len(detections) == 1
+        detection = detections[0]
+        assert detection.detection == f"invalid_{file_type}"
+        # the span is in characters, like every other detection, while the offset counts the UTF-8 bytes before it
+        assert detection.metadata["byte_offset"] == len(text[:detection.start].encode("utf-8")) == detection.start + 1
+        assert detection.metadata["reason"]
+
+    @pytest.mark.parametrize("file_type, text, position", [
+        ("json", "[" * 10 + "]" * 10, 9),
+        ("yaml", "[" * 10 + "]" * 10, 9),
+        ("xml", "<a>" * 10 + "</a>" * 10, 27),
+    ])
+    def test_depth_limit(self, file_type, text, position):
+        from detectors.built_in.streaming_validators import STREAMING_CHECKS
+        assert STREAMING_CHECKS[file_type](text, max_depth=10) is None
+        error = STREAMING_CHECKS[file_type](text, max_depth=9)
+        assert error.reason == "Document exceeds the maximum depth of 9"
+        assert error.position == position
+
+    def test_size_limit(self):
+        from detectors.built_in.streaming_validators import check_json_stream
+        assert check_json_stream('["café"]', max_bytes=9) is None
+        error = check_json_stream('["café"]', max_bytes=8)
+        assert (error.position, error.byte_offset) == (7, 8)
+
+    def test_valid_contents_are_not_materialized(self, streamed):
+        from detectors.built_in.file_type_detectors import FileTypeDetectorRegistry
+        text = json.dumps({"rows": [{"id": i, "tags": ["a", "b"]} for i in range(1000)]})
+        assert FileTypeDetectorRegistry().handle_request(text, {"file_type": ["json", "yaml"]}, {}) == []
@@ -0,0 +1,66 @@
+import pytest
+from fastapi.testclient import TestClient
+
+
+class TestKeywordDetectors:
+    @pytest.fixture
+    def keyword_lists_dir(self, tmp_path):
+        (tmp_path / "fruit.txt").write_text("# fruit that should be flagged\napple\npineapple\n\nGrape\n")
+        (tmp_path / "codes.yaml").write_text("terms: [AB, ABC]\ncase_sensitive: true\nword_boundaries: false\n")
+        (tmp_path / "notes.md").write_text("not a keyword list")
+        return tmp_path
+
+    @pytest.fixture
+    def client(self, keyword_lists_dir, monkeypatch):
+        from detectors.built_in.app import app
+        from detectors.built_in.keyword_detectors import KeywordDetectorRegistry
+
+        monkeypatch.setenv("KEYWORD_LISTS_DIR", str(keyword_lists_dir))
+        app.set_detector(KeywordDetectorRegistry(), "keyword")
+
+        return TestClient(app)
+
+    def detect(self, client, content, lists):
+        resp = client.post("/api/v1/text/contents", json={"contents": [content], "detector_params": {"keyword": lists}})
+        assert resp.status_code == 200
+        return [(d["start"], d["end"], d["text"], d["detection"]) for d in resp.json()[0]]
+
+    def test_keyword_match(self, client):
+        assert self.detect(client, "I like apple and grapes", ["fruit"]) == [(7, 12, "apple", "fruit")]
+
+    def test_case_folding(self, client):
+        assert self.detect(client, "APPLE, GRAPE", ["fruit"]) == [(0, 5, "APPLE", "fruit"), (7, 12, "GRAPE", "fruit")]
+
+    def test_word_boundaries(self, client):
+        # "apple" is a suffix of "pineapple", but not a whole word there
+        assert self.detect(client, "pineapple", ["fruit"]) == [(0, 9, "pineapple", "fruit")]
+
+    def test_case_sensitive_substrings(self, client):
+        assert self.detect(client, "xABCx abc", ["codes"]) == [(1, 3, "AB", "codes"), (1, 4, "ABC", "codes")]
+
+    def test_multiple_lists(self, client):
+        assert self.detect(client, "apple ABC", ["fruit", "codes"]) == [
+            (0, 5, "apple", "fruit"), (6, 8, "AB", "codes"), (6, 9, "ABC", "codes")
+        ]
+
+    def test_no_match(self, client):
+        assert self.detect(client, "nothing to see here", ["fruit", "codes"]) == []
+
+    def test_unknown_list(self, client):
+        resp = client.post("/api/v1/text/contents", json={"contents": ["apple"], "detector_params": {"keyword": ["veg"]}})
+        assert resp.status_code == 400
+
+    def test_registry_endpoint(self, client):
+        data = client.get("/registry").json()
+        assert set(data["keyword"]) == {"fruit", "codes"}
+        assert "3 terms" in data["keyword"]["fruit"]
+
+    def test_missing_directory(self, tmp_path):
+        from detectors.built_in.keyword_detectors import KeywordDetectorRegistry
+        assert KeywordDetectorRegistry(str(tmp_path / "missing")).get_registry() == {}
+
+    def test_overlapping_terms(self):
+        from detectors.built_in.keyword_detectors import AhoCorasickAutomaton
+        automaton = AhoCorasickAutomaton(["he", "she", "his", "hers"])
+        matches = sorted((start, end) for start, end, _ in automaton.iter_matches("ushers"))
+        assert matches == [(1, 4), (2, 4), (2, 6)]
@@ -216,6 +216,11 @@ class TestMetrics:
             f'{METRIC_PREFIX}_detections_total{{detector_kind="regex",detector_name="custom_regex"}}': 7.0,
             f'{METRIC_PREFIX}_errors_total{{detector_kind="regex",detector_name="custom_regex"}}': 1.0,
             f'{METRIC_PREFIX}_requests_total{{detector_kind="regex",detector_name="custom_regex"}}': 10.0,
+            # two distinct valid regex plans are compiled once each, the invalid one is never cached, and the custom
+            # regexes are only compiled while compiling plans
+            f'{METRIC_PREFIX}_cache_hits_total{{cache_name="regex_plans"}}': 7.0,
+            f'{METRIC_PREFIX}_cache_misses_total{{cache_name="regex_plans"}}': 3.0,
+            f'{METRIC_PREFIX}_cache_misses_total{{cache_name="custom_regex"}}': 3.0,
 
             f'{METRIC_PREFIX}_detections_total{{detector_kind="file_type",detector_name="json"}}': 6.0,
             f'{METRIC_PREFIX}_errors_total{{detector_kind="file_type",detector_name="json"}}': 0.0,
@@ -249,6 +254,22 @@ class TestMetrics:
         assert func_runtime < 2.2
 
 
+    def test_prefilter_skip_metrics(self, client: TestClient):
+        # neither an email address nor an SSN can be present without an "@" or 9 digits, so both regexes are skipped
+        payload = {
+            "contents": ["totally innocuous", "mail me at a@b.com"],
+            "detector_params": {"regex": ["email", "us-social-security-number"]}
+        }
+        response = client.post("/api/v1/text/contents", json=payload)
+        assert response.status_code == 200
+        assert [len(detections) for detections in response.json()] == [0, 1]
+
+        metric_dict = get_metric_dict(client)
+        assert metric_dict[f'{METRIC_PREFIX}_prefilter_skips_total{{detector_kind="regex",detector_name="email"}}'] == 1
+        assert metric_dict[f'{METRIC_PREFIX}_prefilter_skips_total{{detector_kind="regex",detector_name="us-social-security-number"}}'] == 2
+        assert metric_dict[f'{METRIC_PREFIX}_requests_total{{detector_kind="regex",detector_name="email"}}'] == 2
+
+
     def test_user_metrics(self, client: TestClient):
         # ensure that metrics created by the user are visible
         for i in range(8):
@@ -0,0 +1,144 @@
+import os
+import time
+
+import pytest
+
+from tests.detectors.builtIn.test_result_cache import RecordingInstrument
+
+
+def spin(seconds: float) -> int:
+    deadline, count = time.perf_counter() + seconds, 0
+    while time.perf_counter() < deadline:
+        count += 1
+    return count
+
+
+def fail(text: str) -> bool:
+    raise ValueError(f"cannot check {text}")
+
+
+def load_functions(prefix: str) -> dict:
+    """Loaded by the worker processes, so the functions are looked up in this module by name"""
+    return {
+        "echo": lambda text, suffix="": prefix + text + suffix,
+        "pid": os.getpid,
+        "spin": spin,
+        "fail": fail,
+    }
+
+
+def load_nothing():
+    raise ImportError("broken module")
+
+
+@pytest.fixture
+def instruments():
+    return {name: RecordingInstrument() for name in ["isolated_queue_wait", "isolated_exec_time", "isolated_timeouts", "isolated_recycles"]}
+
+
+@pytest.fixture
+def make_pool(instruments):
+    from detectors.built_in.process_isolation import IsolatedProcessPool
+    pools = []
+
+    def make(**kwargs):
+        pool = IsolatedProcessPool("test", **kwargs)
+        pool.set_instruments(instruments)
+        pool.start(load_functions, ">")
+        pools.append(pool)
+        return pool
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+
+def wait_for_idle_workers(pool, count, timeout=10):
+    deadline = time.time() + timeout
+    while pool._idle.qsize() < count and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class TestIsolatedProcessPool:
+    def test_from_env(self, monkeypatch):
+        from detectors.built_in.process_isolation import IsolatedProcessPool
+        monkeypatch.setenv("ISOLATED_WORKERS", "3")
+        monkeypatch.setenv("ISOLATED_TIMEOUT", "0.5")
+        monkeypatch.setenv("ISOLATED_MAX_CALLS", "7")
+        pool = IsolatedProcessPool.from_env("test")
+        assert (pool.workers, pool.timeout, pool.max_calls) == (3, 0.5, 7)
+
+    def test_calls_run_in_worker_processes(self, make_pool, instruments):
+        pool = make_pool(workers=1)
+        assert pool.call("echo", ("text",), {"suffix": "!"}) == ">text!"
+        assert pool.call("pid", (), {}) != os.getpid()
+        assert instruments["isolated_exec_time"].values[("test", "echo")] > 0
+        assert ("test", "echo") in instruments["isolated_queue_wait"].values
+
+    def test_calls_before_start_fail(self):
+        from detectors.built_in.process_isolation import IsolatedCallError, IsolatedProcessPool
+        with pytest.raises(IsolatedCallError, match="has not been started"):
+            IsolatedProcessPool("test").call("echo", ("text",), {})
+
+    def test_errors_are_raised_in_the_caller(self, make_pool, instruments):
+        from detectors.built_in.process_isolation import IsolatedCallError
+        pool = make_pool(workers=1)
+        pid = pool.call("pid", (), {})
+        with pytest.raises(IsolatedCallError, match="ValueError: cannot check text"):
+            pool.call("fail", ("text",), {})
+        # the worker survives the errors of its functions
+        assert pool.call("pid", (), {}) == pid
+        assert not instruments["isolated_recycles"].values
+
+    def test_timeouts_kill_the_worker(self, make_pool, instruments):
+        from detectors.built_in.process_isolation import IsolatedTimeoutError
+        pool = make_pool(workers=1, timeout=0.2)
+        pid = pool.call("pid", (), {})
+        start = time.time()
+        with pytest.raises(IsolatedTimeoutError):
+            pool.call("spin", (5,), {})
+        assert time.time() - start < 2
+        assert instruments["isolated_timeouts"].values[("test", "spin")] == 1
+        assert instruments["isolated_recycles"].values[("test", "timeout")] == 1
+        # a per-call timeout overrides the pool's
+        assert pool.call("spin", (0.3,), {}, timeout=5) > 0
+        assert pool.call("pid", (), {}) != pid
+
+    def test_workers_are_recycled_after_max_calls(self, make_pool, instruments):
+        pool = make_pool(workers=1, max_calls=2)
+        pids = [pool.call("pid", (), {}) for _ in range(4)]
+        assert pids[0] == pids[1] != pids[2] == pids[3]
+        assert instruments["isolated_recycles"].values[("test", "max_calls")] == 2
+
+    def test_cpu_bound_calls_run_in_parallel(self, make_pool):
+        from concurrent.futures import ThreadPoolExecutor
+        pool = make_pool(workers=2)
+        start = time.time()
+        with ThreadPoolExecutor(2) as threads:
+            list(threads.map(lambda _: pool.call("spin", (0.5,), {}), range(2)))
+        assert time.time() - start < 0.9
+
+    def test_waiting_calls_are_reported(self, make_pool, instruments):
+        from concurrent.futures import ThreadPoolExecutor
+        pool = make_pool(workers=1)
+        with ThreadPoolExecutor(2) as threads:
+            list(threads.map(lambda _: pool.call("spin", (0.2,), {}), range(2)))
+        assert instruments["isolated_queue_wait"].values[("test", "spin")] >= 0.15
+        assert instruments["isolated_exec_time"].values[("test", "spin")] >= 0.4
+
+    def test_workers_that_cannot_load_report_the_error(self, instruments):
+        from detectors.built_in.process_isolation import IsolatedCallError, IsolatedProcessPool
+        pool = IsolatedProcessPool("test", workers=1)
+        pool.start(load_nothing)
+        try:
+            with pytest.raises(IsolatedCallError, match="exited while loading"):
+                pool.call("echo", ("text",), {})
+        finally:
+            wait_for_idle_workers(pool, 1)
+            pool.shutdown()
+
+    def test_restart_replaces_the_workers(self, make_pool):
+        pool = make_pool(workers=2)
+        pid = pool.call("pid", (), {})
+        pool.start(load_functions, "<")
+        assert pool.call("echo", ("text",), {}) == "<text"
+        assert pool.call("pid", (), {}) != pid
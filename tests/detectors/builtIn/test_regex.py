@@ -1,3 +1,5 @@
+import random
+
 import pytest
 from fastapi.testclient import TestClient
 
@@ -121,6 +123,31 @@ class TestRegexDetectors:
         assert resp.json()[0] == []
 
 
+    @staticmethod
+    def reference_luhn_checksum(card_number: str) -> int:
+        """The textbook Luhn algorithm, one digit at a time"""
+        digits = [int(c) for c in card_number if c in "0123456789"]
+        checksum = sum(digits[-1::-2])
+        for d in digits[-2::-2]:
+            checksum += sum(divmod(d * 2, 10))
+        return checksum % 10
+
+    def test_luhn_checksum_matches_reference(self):
+        from detectors.built_in.regex_detectors import are_valid_card_matches, luhn_checksum
+        rng = random.Random(0)
+        numbers = ["".join(rng.choice("0123456789 -") for _ in range(rng.randint(0, 23))) for _ in range(5000)]
+        assert [luhn_checksum(n) for n in numbers] == [self.reference_luhn_checksum(n) for n in numbers]
+        assert are_valid_card_matches(numbers) == [self.reference_luhn_checksum(n) == 0 for n in numbers]
+
+    def test_luhn_batch_matches_per_match_checks(self):
+        """Validating the candidates of a transaction export at once must agree with checking them one by one"""
+        from detectors.built_in.regex_detectors import are_valid_card_matches, is_luhn_valid
+        rng = random.Random(0)
+        candidates = ["-".join("".join(rng.choice("0123456789") for _ in range(4)) for _ in range(4)) for _ in range(5000)]
+        expected = [self.reference_luhn_checksum(c) == 0 for c in candidates]
+        assert are_valid_card_matches(candidates) == [is_luhn_valid(c) for c in candidates] == expected
+        assert any(expected) and not all(expected)
+
     def test_multiple_regexes(self, client):
         payload = {
             "contents": ["Email: a@b.com, SSN: 123-45-6789"],
@@ -132,6 +159,116 @@ class TestRegexDetectors:
         assert "a@b.com" in texts
         assert "123-45-6789" in texts
 
+    @pytest.mark.parametrize(
+        "content",
+        [
+            "Card 4111 1111 1111 1111, call (123) 456-7890 or 123-456-7890, SSN 123-45-6789, IP 10.0.0.1, SW1A 1AA",
+            "Invoice 5555-5555-5555-4444 paid from 192.168.1.1 by +1 (123) 456-7890",
+            "nothing to see here",
+        ]
+    )
+    def test_multi_pattern_scan_matches_individual_scans(self, client, content):
+        """Requesting several regexes at once must give the same detections as requesting them one by one"""
+        regexes = ["credit-card", "us-phone-number", "us-social-security-number", "ipv4", "uk-post-code", r"\d{4}", "email"]
+        resp = client.post("/api/v1/text/contents", json={"contents": [content], "detector_params": {"regex": regexes}})
+        assert resp.status_code == 200
+
+        expected = []
+        for regex in regexes:
+            single = client.post("/api/v1/text/contents", json={"contents": [content], "detector_params": {"regex": [regex]}})
+            expected += single.json()[0]
+        assert resp.json()[0] == expected
+
+    def test_multi_pattern_scan_overlapping_matches(self, client):
+        """A match of one pattern must not hide an overlapping match of another"""
+        payload = {
+            "contents": ["Card: 4111 1111 1111 1111"],
+            "detector_params": {"regex": ["credit-card", r"\d{4} \d{4}"]}
+        }
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert resp.status_code == 200
+        texts = [d["text"] for d in resp.json()[0]]
+        assert texts == ["4111 1111 1111 1111", "4111 1111", "1111 1111"]
+
+    def test_multi_pattern_scan_without_the_re_parser(self, client, monkeypatch):
+        """Without the private parser of `re`, every pattern is scanned separately, with the same detections"""
+        import re
+        import sys
+        from detectors.built_in.app import app
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry, get_scan_guard, parse_pattern
+        from detectors.built_in.regex_sandbox import has_nested_quantifier
+        regexes = [r"\d{4}", r"[A-Z]{2}\d", "credit-card"]
+        content = "Card 4111 1111 1111 1111 from AB1"
+        expected = client.post("/api/v1/text/contents", json={"contents": [content], "detector_params": {"regex": regexes}}).json()
+
+        monkeypatch.setattr(sys.modules[parse_pattern.__module__], "sre_parse", None)
+        assert get_scan_guard(re.compile(r"\d{3}-\d{2}")) is None
+        assert not has_nested_quantifier(re.compile(r"(b+)+c"))
+        app.set_detector(RegexDetectorRegistry(), "regex")
+        resp = client.post("/api/v1/text/contents", json={"contents": [content], "detector_params": {"regex": regexes}})
+        assert resp.status_code == 200
+        assert resp.json() == expected
+
+    @pytest.mark.parametrize(
+        "content,expected",
+        [
+            ("addr fe80::1 here", [(4, 13, " fe80::1 ")]),
+            ("at ::1.", [(2, 6, " ::1")]),
+            ("[::1]:8080", [(1, 4, "::1")]),
+            ("fe80::1%eth0", [(0, 7, "fe80::1")]),
+            ("fe80::1:", [(0, 7, "fe80::1")]),
+            ("2001:0db8:85a3:0000:0000:8a2e:0370:7334", [(0, 39, "2001:0db8:85a3:0000:0000:8a2e:0370:7334")]),
+            ("::ffff:192.168.1.254", [(0, 20, "::ffff:192.168.1.254")]),
+            ("::ffff:192.168.1.255", [(0, 20, "::ffff:192.168.1.255")]),
+            ("a b 1::2  3::4 x", [(3, 10, " 1::2  "), (10, 15, "3::4 ")]),
+            ("fe80::1\n\n2001:db8::1\n", [(0, 9, "fe80::1\n\n"), (9, 21, "2001:db8::1\n")]),
+            ("::", [(0, 2, "::")]),
+            ("addr:fe80::1", [(5, 12, "fe80::1")]),
+            ("src:2001:db8::1", [(4, 15, "2001:db8::1")]),
+            ("IPv6:2001:db8::1 up", [(5, 17, "2001:db8::1 ")]),
+            ("ip:::1", [(3, 6, "::1")]),
+            # not addresses
+            ("time 12:30:45 now", []),
+            ("mac aa:bb:cc:dd:ee:ff", []),
+            ("std::vector<int> and a::b::c", []),
+            ("deadbeef::1", []),
+            ("1:2:3:4:5:6:7", []),
+        ]
+    )
+    def test_ipv6_detector(self, client, content, expected):
+        resp = client.post("/api/v1/text/contents", json={"contents": [content], "detector_params": {"regex": ["ipv6"]}})
+        assert resp.status_code == 200
+        assert [(d["start"], d["end"], d["text"]) for d in resp.json()[0]] == expected
+
+    def test_ipv6_detector_adversarial_input(self):
+        from detectors.built_in.regex_detectors import ipv6_detector
+        # the regex this scanner replaced took tens of seconds on inputs like these, see benchmarks/bench_ipv6.py
+        for content in ["a:" * 100_000, "deadbeef" * 25_000 + "::", ":" * 200_000]:
+            assert ipv6_detector(content) == []
+        detections = ipv6_detector("fe80::1 " * 50_000)
+        assert len(detections) == 50_000
+        assert (detections[-1].start, detections[-1].end, detections[-1].text) == (399_992, 400_000, "fe80::1 ")
+
+    @pytest.mark.parametrize(
+        "regex,content",
+        [
+            ("email", "no at sign in example.com"),
+            ("credit-card", "Card: 4111 1111 1111"),
+            ("ipv4", "version 1.2.3"),
+            ("ipv6", "time is 12:30"),
+            ("us-social-security-number", "SSN: 123-45-678"),
+        ]
+    )
+    def test_prefilters_skip_impossible_matches(self, client, regex, content):
+        from detectors.built_in.regex_detectors import PREFILTERS, RegexDetectorRegistry
+        assert not PREFILTERS[regex](content)
+        assert RegexDetectorRegistry().registry[regex](content) == []
+
+    def test_prefilter_counts_non_ascii_digits(self):
+        from detectors.built_in.regex_detectors import has_min_digits
+        assert has_min_digits("١٢٣-٤٥-٦٧٨٩", 9)
+        assert not has_min_digits("12-34", 5)
+
     def test_custom_regex(self, client):
         payload = {
             "contents": ["foo bar baz"],
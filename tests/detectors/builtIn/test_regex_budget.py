@@ -0,0 +1,109 @@
+import re
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+CATASTROPHIC_REGEX = r"^(a+)+$"
+CATASTROPHIC_CONTENT = "a" * 40 + "!"
+
+
+class TestRegexBudget:
+    @pytest.fixture
+    def client(self, monkeypatch):
+        from detectors.built_in.app import app
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry
+
+        monkeypatch.setenv("CUSTOM_REGEX_TIMEOUT", "0.5")
+        monkeypatch.setenv("CUSTOM_REGEX_WORKERS", "1")
+        registry = RegexDetectorRegistry()
+        app.set_detector(registry, "regex")
+
+        yield TestClient(app)
+        registry.close()
+
+    def test_custom_regex_within_budget(self, client):
+        payload = {"contents": ["foo bar baz"], "detector_params": {"regex": [r"ba.", "email"]}}
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert resp.status_code == 200
+        assert [d["text"] for d in resp.json()[0]] == ["bar", "baz"]
+
+    def test_custom_regex_timeout(self, client):
+        payload = {"contents": [CATASTROPHIC_CONTENT], "detector_params": {"regex": [CATASTROPHIC_REGEX]}}
+        start = time.time()
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert time.time() - start < 5
+        assert resp.status_code == 422
+        assert "execution budget" in resp.json()["message"]
+
+        # the killed worker is replaced for the next request
+        resp = client.post("/api/v1/text/contents", json={"contents": ["foo bar"], "detector_params": {"regex": [r"ba."]}})
+        assert resp.status_code == 200
+        assert resp.json()[0][0]["text"] == "bar"
+
+    def test_close_stops_the_workers(self, client):
+        from detectors.built_in.app import app
+        resp = client.post("/api/v1/text/contents", json={"contents": ["foo bar"], "detector_params": {"regex": [r"ba."]}})
+        assert resp.status_code == 200
+        registry = app.get_detector("regex")
+        processes = [worker.process for worker in registry.regex_sandbox.workers]
+        assert any(process is not None and process.is_alive() for process in processes)
+
+        registry.close()
+        assert all(worker.process is None for worker in registry.regex_sandbox.workers)
+        assert not any(process is not None and process.is_alive() for process in processes)
+        # later regexes fail rather than waiting for a worker, or starting one again
+        with pytest.raises(RuntimeError, match="shut down"):
+            registry.regex_sandbox.finditer_spans(re.compile("ba."), "foo bar")
+        assert all(worker.process is None for worker in registry.regex_sandbox.workers)
+
+    def test_shutdown_stops_the_busy_workers_once_they_are_done(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from detectors.built_in.regex_sandbox import RegexSandbox
+        sandbox = RegexSandbox(timeout=10, workers=1)
+        with ThreadPoolExecutor(1) as threads:
+            busy = threads.submit(sandbox.finditer_spans, re.compile(r"(a|a)*b"), "a" * 21)
+            deadline = time.time() + 5
+            while sandbox.idle.qsize() and time.time() < deadline:
+                time.sleep(0.01)
+            sandbox.shutdown()
+            assert busy.result() == []
+        assert all(worker.process is None for worker in sandbox.workers)
+
+    def test_invalid_custom_regex(self, client):
+        resp = client.post("/api/v1/text/contents", json={"contents": ["foo"], "detector_params": {"regex": ["["]}})
+        assert resp.status_code == 500
+
+    def test_reject_nested_quantifiers(self, monkeypatch):
+        from detectors.built_in.app import app
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry
+
+        monkeypatch.setenv("CUSTOM_REGEX_REJECT_NESTED_QUANTIFIERS", "true")
+        app.set_detector(RegexDetectorRegistry(), "regex")
+        client = TestClient(app)
+
+        payload = {"contents": [CATASTROPHIC_CONTENT], "detector_params": {"regex": [CATASTROPHIC_REGEX]}}
+        resp = client.post("/api/v1/text/contents", json=payload)
+        assert resp.status_code == 422
+        assert "nested quantifiers" in resp.json()["message"]
+
+        resp = client.post("/api/v1/text/contents", json={"contents": ["foo bar"], "detector_params": {"regex": [r"ba+r"]}})
+        assert resp.status_code == 200
+
+    @pytest.mark.parametrize(
+        "regex,expected",
+        [
+            (r"(a+)+", True),
+            (r"(\w*\s?)*", True),
+            (r"(?:x(?:ab+)c)*", True),
+            (r"(a|b)+", False),
+            (r"a+b+", False),
+            (r"(?:a+)?", False),
+            (r"(?>a+)+", False),
+            (r"(a++)+", False),
+            (r"\d{3}-\d{4}", False),
+        ]
+    )
+    def test_has_nested_quantifier(self, regex, expected):
+        from detectors.built_in.regex_sandbox import has_nested_quantifier
+        assert has_nested_quantifier(re.compile(regex)) == expected
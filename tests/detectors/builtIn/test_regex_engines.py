@@ -0,0 +1,91 @@
+import pytest
+
+
+class TestRegexEngines:
+    @pytest.fixture(autouse=True)
+    def restore_engine(self):
+        yield
+        from detectors.built_in.regex_detectors import set_regex_engine
+        from detectors.built_in.regex_engines import RegexEngine
+        set_regex_engine(RegexEngine())
+
+    def test_default_engine(self, monkeypatch):
+        from detectors.built_in import regex_detectors
+        monkeypatch.setenv("REGEX_ENGINE", "re2")
+        # the engine is selected when the module is loaded, not by each registry
+        regex_detectors.RegexDetectorRegistry()
+        assert regex_detectors._regex_engine.name == "re"
+
+    def test_unknown_engine_falls_back_to_re(self):
+        from detectors.built_in.regex_engines import create_regex_engine
+        assert create_regex_engine("nonexistent").name == "re"
+
+    def test_re_engine_runs_patterns_as_they_are(self):
+        import re
+        from detectors.built_in.regex_engines import RegexEngine
+        pattern = re.compile(r"\d+")
+        engine = RegexEngine()
+        assert engine.compile(pattern) is pattern
+        assert not engine.is_native(engine.compile(pattern))
+
+
+class TestRe2Engine:
+    @pytest.fixture
+    def registry(self):
+        pytest.importorskip("re2")
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry, set_regex_engine
+        from detectors.built_in.regex_engines import Re2Engine, RegexEngine
+
+        set_regex_engine(Re2Engine())
+        yield RegexDetectorRegistry()
+        set_regex_engine(RegexEngine())
+
+    def test_unsupported_patterns_fall_back_per_pattern(self, registry):
+        from detectors.built_in import regex_detectors
+        engine = regex_detectors._regex_engine
+        assert engine.name == "re2"
+        assert engine.is_native(engine.compile(regex_detectors.EMAIL_PATTERN))
+        # the credit card pattern uses backreferences to require consistent separators
+        assert not engine.is_native(engine.compile(regex_detectors.CREDIT_CARD_PATTERN))
+
+    @pytest.mark.parametrize(
+        "regex,is_native",
+        [
+            (r"\d{3}-\d{2}", True),
+            (r"[\w.]+@\w+\s", True),
+            (r"(?m)^\d+$", True),
+            (r"\bfoo", False),  # RE2 has no Unicode word boundaries
+            (r"[\S]", False),
+            (r"foo$", False),  # the `$` of `re` also matches before a final newline
+        ]
+    )
+    def test_patterns_that_match_differently_fall_back(self, registry, regex, is_native):
+        import re
+        from detectors.built_in import regex_detectors
+        engine = regex_detectors._regex_engine
+        assert engine.is_native(engine.compile(re.compile(regex))) == is_native
+
+    @pytest.mark.parametrize(
+        "regex,content",
+        [
+            ("email", "Contact me at test@example.com or a.b@c.org"),
+            ("credit-card", "Card: 4111 1111 1111 1111 and 5555-5555-5555-4444"),
+            ("ipv4", "My IP is 192.168.1.1, not 10.0.0.256"),
+            ("us-social-security-number", "SSN: 123-45-6789"),
+            ("us-phone-number", "Call (123) 456-7890 or +1 123-456-7890"),
+            ("uk-post-code", "Postcode: SW1A 1AA"),
+            (r"ba.", "foo bar baz"),
+            # non-ASCII digits, letters and spaces
+            ("us-social-security-number", "ssn \u0661\u0662\u0663-\u0664\u0665-\u0666\u0667\u0668\u0669 on file"),
+            (r"\d{3}\s\w+", "\u0663\u0664\u0665\u3000na\u00efve 123 ok"),
+            (r"[\d\s]+x", "\u0661 \u00a0\u0662x"),
+            (r"\W+\D", "caf\u00e9 \u2014 \u0661a"),
+        ]
+    )
+    def test_same_detections_as_re(self, registry, regex, content):
+        from detectors.built_in.regex_detectors import set_regex_engine
+        from detectors.built_in.regex_engines import RegexEngine
+        re2_detections = registry.handle_request(content, {"regex": [regex]}, {})
+        assert re2_detections
+        set_regex_engine(RegexEngine())
+        assert re2_detections == registry.handle_request(content, {"regex": [regex]}, {})
@@ -0,0 +1,99 @@
+from collections import Counter
+
+import pytest
+
+
+class RecordingInstrument:
+    """Collects the values of a prometheus instrument per label set"""
+    def __init__(self):
+        self.values = Counter()
+        self._labels = None
+
+    def labels(self, *labels):
+        self._labels = labels
+        return self
+
+    def inc(self, amount=1):
+        self.values[self._labels] += amount
+
+    def set(self, value):
+        self.values[self._labels] = value
+
+
+class TestResultCache:
+    @pytest.fixture
+    def instruments(self):
+        return {name: RecordingInstrument() for name in ["requests", "detections", "errors", "runtime", "cache_hits", "cache_misses", "cache_hit_ratio"]}
+
+    @pytest.fixture
+    def registry(self, instruments):
+        from detectors.built_in.regex_detectors import RegexDetectorRegistry
+        registry = RegexDetectorRegistry()
+        registry.set_instruments(instruments)
+        return registry
+
+    @pytest.fixture
+    def result_cache(self, instruments):
+        from detectors.built_in.result_cache import ResultCache
+        result_cache = ResultCache(maxsize=16)
+        result_cache.set_instruments(instruments)
+        return result_cache
+
+    def test_hits_return_the_same_detections(self, registry, result_cache, monkeypatch):
+        params = {"regex": ["email", "us-social-security-number"]}
+        content = "Email: a@b.com, SSN: 123-45-6789"
+        first = result_cache.handle_request(registry, content, params, {})
+
+        def fail(*args, **kwargs):
+            raise AssertionError("a cached result must not run the detectors again")
+        monkeypatch.setattr(registry, "handle_request", fail)
+        assert result_cache.handle_request(registry, content, params, {}) == first
+        assert [d.text for d in first] == ["a@b.com", "123-45-6789"]
+
+    def test_metrics_are_replayed_on_hits(self, registry, result_cache, instruments):
+        for _ in range(3):
+            result_cache.handle_request(registry, "Email: a@b.com", {"regex": ["email", "us-social-security-number"]}, {})
+        assert instruments["requests"].values[("regex", "email")] == 3
+        assert instruments["requests"].values[("regex", "us-social-security-number")] == 3
+        assert instruments["detections"].values[("regex", "email")] == 3
+        assert instruments["detections"].values[("regex", "us-social-security-number")] == 0
+        assert instruments["cache_hits"].values[("results",)] == 2
+        assert instruments["cache_misses"].values[("results",)] == 1
+        assert instruments["cache_hit_ratio"].values[("results",)] == pytest.approx(2 / 3)
+
+    def test_key_includes_content_and_params(self, registry, result_cache):
+        assert result_cache.handle_request(registry, "a@b.com", {"regex": ["email"]}, {})
+        assert not result_cache.handle_request(registry, "a@b.com", {"regex": ["ipv4"]}, {})
+        assert not result_cache.handle_request(registry, "c at d.com", {"regex": ["email"]}, {})
+        assert len(result_cache.cache) == 3
+
+    def test_errors_are_not_cached(self, registry, result_cache):
+        from fastapi import HTTPException
+        for _ in range(2):
+            with pytest.raises(HTTPException):
+                result_cache.handle_request(registry, "foo", {"regex": ["["]}, {})
+        assert len(result_cache.cache) == 0
+
+    def test_disabled_by_default(self, registry):
+        from detectors.built_in.result_cache import ResultCache
+        result_cache = ResultCache.from_env()
+        assert not result_cache.enabled
+        assert result_cache.handle_request(registry, "a@b.com", {"regex": ["email"]}, {})
+        assert len(result_cache.cache) == 0
+
+    def test_custom_detectors_can_opt_out(self):
+        from detectors.built_in.custom_detectors_wrapper import CustomDetectorRegistry
+        registry = CustomDetectorRegistry()
+        assert registry.get_cache_params({"custom": ["over_100_characters"]}) is not None
+        # needs headers
+        assert registry.get_cache_params({"custom": ["over_100_characters", "function_that_needs_headers"]}) is None
+        # non-blocking guardrails have side effects on every call
+        assert registry.get_cache_params({"custom": ["background_function"]}) is None
+
+    def test_non_cacheable_decorator(self):
+        from detectors.built_in.custom_detectors_wrapper import non_cacheable
+
+        @non_cacheable
+        def random_guardrail(text: str) -> bool:
+            return True
+        assert random_guardrail.cacheable is False